@@ -1,70 +1,262 @@
 """This module include some function to make bin movable.
 
-Make windows executable, shell script and Macho-O files movable.
+Make windows executable, shell script, Macho-O and ELF files movable.
 """
 
 # Import built-in modules
+import logging
+import mmap
 import os
 import platform
 import re
 import shutil
+import stat
 import struct
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Import local modules
+from rezbuild.constants import FILE_DATA
+from rezbuild.constants import FILE_ELF
+from rezbuild.constants import FILE_HEADER_SIZE
+from rezbuild.constants import FILE_MACHO
+from rezbuild.constants import FILE_MACHO_FAT
+from rezbuild.constants import FILE_PE
+from rezbuild.constants import FILE_SCRIPT
+from rezbuild.constants import HASH_CHUNK_SIZE
+from rezbuild.constants import SHEBANG_MAX_SIZE
 from rezbuild.exceptions import ArgumentError
+from rezbuild.exceptions import MakeMovableError
 from rezbuild.exceptions import ReNotMatchError
+from rezbuild.exceptions import UnsupportedError
+from rezbuild.utils import get_cpu_count
 from rezbuild.utils import get_relative_path
+from rezbuild.utils import get_workers
+
+# The file types keyed by the file identities, see `classify_file`.
+_file_types = {}
+_file_types_lock = threading.Lock()
+
+
+def bundle_elfs(
+        paths, lib_dir, search_dirs=None, exclude_prefixes=None, workers=None):
+    """Copy the shared libraries needed by the ELF files into the lib dir.
+
+    The closure is resolved first by `get_elf_bundle_plan` and logged, then
+    the libraries are copied by a thread pool. The copied libraries are
+    named by the DT_NEEDED names. Use `make_elfs_movable` to change the run
+    paths after bundling.
+
+    Args:
+        paths (:obj:`list` of :obj:`str`): The directories of the ELF files,
+            like the `bin` and `lib` folders of the package.
+        lib_dir (str): The lib dir of the package to copy into.
+        search_dirs (:obj:`list` of :obj:`str`, optional): The extra
+            directories to search the libraries after the run paths and
+            `LD_LIBRARY_PATH`.
+        exclude_prefixes (:obj:`list` of :obj:`str`, optional): The path
+            prefixes of the system libraries never bundled. Default is
+            `ELF.SYSTEM_LIB_PREFIX`.
+        workers (int, optional): The number of the threads. Get from the
+            `REZBUILD_BIN_WORKERS` environment variable if not given. Default
+            is the cpu count.
+
+    Returns:
+        dict: The exceptions keyed by the destination paths of the libraries
+            failed to copy. Empty if all the libraries copied.
+    """
+    filepaths = []
+    for path in paths:
+        filepaths.extend(_list_elfs(path))
+    copies = get_elf_bundle_plan(
+        filepaths, lib_dir, search_dirs=search_dirs,
+        exclude_prefixes=exclude_prefixes, workers=workers)
+    sources = {}
+    for src, dst in copies:
+        logging.getLogger(__name__).info(f"Copy {src} to {dst}.")
+        sources[dst] = src
+    if sources:
+        os.makedirs(lib_dir, exist_ok=True)
+
+    def copy(dst):
+        shutil.copy2(sources[dst], dst)
+
+    errors = map_files(copy, list(sources), workers=workers)
+    for filepath, error in errors.items():
+        logging.getLogger(__name__).warning(
+            f"Failed to bundle {filepath}: {error}")
+    return errors
 
 
 def change_shebang(filepath, shebang, is_bin=False, origin_shebang=""):
     """Change shebang of the exe file.
 
+    Only the shebang is read and changed, the rest of the file is never loaded
+    into the memory. The files not classified as scripts by `classify_file`
+    are never read again. The file is patched in place if the new shebang has
+    the same length as the original one, like the padded shebang of the binary
+    files. Otherwise the file is streamed into a temporary file with the new
+    shebang and renamed back.
+
     Args:
         filepath (str): The path of the file you want to change.
         shebang (str): The shebang to change to.
         is_bin (bool): Whether the file is a binary file.
         origin_shebang (str): The original shebang to replaced.
+
+    Raises:
+        ReNotMatchError: When the file does not start with a shebang and the
+            original shebang is not given.
     """
     if not shebang.startswith("#!"):
         shebang = f"#!{shebang}"
     if origin_shebang and not origin_shebang.startswith("#!"):
         origin_shebang = f"#!{origin_shebang}"
+    shebang = bytes(shebang, encoding="utf-8")
 
-    read_mode, write_mode = "r", "w"
-    if is_bin:
-        read_mode += "b"
-        write_mode += "b"
-        shebang = bytes(shebang, encoding="utf-8")
-
-    with open(filepath, read_mode) as file:
-        content = file.read()
-
-    if origin_shebang and is_bin:
+    if origin_shebang:
         origin_shebang = bytes(origin_shebang, encoding="utf-8")
-        shebang = shebang.ljust(len(origin_shebang), b" ")
-    elif origin_shebang:
-        pass
-    elif is_bin:
-        match = re.match(b"#!.+", content)
-        if match:
-            origin_shebang = match.group(0)
-        else:
-            raise ReNotMatchError(f"Can't find shebang in file `{filepath}`")
+        offset, _ = _search_file(filepath, re.escape(origin_shebang))
+        if offset < 0:
+            return
+        if is_bin:
+            shebang = shebang.ljust(len(origin_shebang), b" ")
     else:
-        match = re.match("#!.+", content)
-        if match:
-            origin_shebang = match.group(0)
-        else:
+        match = None
+        if classify_file(filepath) == FILE_SCRIPT:
+            with open(filepath, "rb") as file:
+                match = re.match(b"#!.+", file.readline(SHEBANG_MAX_SIZE))
+        if not match:
             raise ReNotMatchError(f"Can't find shebang in file `{filepath}`")
+        offset = 0
+        origin_shebang = match.group(0)
+        if not is_bin:
+            origin_shebang = origin_shebang.rstrip(b"\r")
+
+    if origin_shebang != shebang:
+        _replace_bytes(filepath, offset, len(origin_shebang), shebang)
 
-    with open(filepath, write_mode) as file:
-        file.write(content.replace(origin_shebang, shebang))
+
+def classify_file(filepath):
+    """Tell the type of the file by its header.
+
+    Only the first few bytes of the file are read, and the result is cached
+    by the device, inode, size and modification time of the file, so a tree
+    is classified by one bounded read per file no matter how many times the
+    files are checked.
+
+    Args:
+        filepath (str): The path of the file.
+
+    Returns:
+        str: One of `FILE_MACHO`, `FILE_MACHO_FAT`, `FILE_ELF`, `FILE_PE`,
+            `FILE_SCRIPT` and `FILE_DATA` in `rezbuild.constants`.
+    """
+    file_stat = os.stat(filepath)
+    key = (
+        file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+        file_stat.st_mtime_ns)
+    with _file_types_lock:
+        file_type = _file_types.get(key)
+    if file_type is None:
+        with open(filepath, "rb") as file:
+            file_type = _classify_header(file.read(FILE_HEADER_SIZE))
+        with _file_types_lock:
+            _file_types[key] = file_type
+    return file_type
+
+
+def get_elf_bundle_plan(
+        filepaths, lib_dir, search_dirs=None, exclude_prefixes=None,
+        workers=None):
+    """Resolve the closure of the shared libraries needed by the ELF files.
+
+    Each DT_NEEDED name is resolved once, against the lib dir, the run paths
+    of the loader, `LD_LIBRARY_PATH`, the search dirs and the system library
+    dirs in order. Each directory is listed once. The libraries of each level
+    of the dependency graph are parsed by a thread pool and each library is
+    parsed once in the call, see `ELF.get`. The system libraries are neither
+    copied nor traversed.
+
+    Args:
+        filepaths (:obj:`list` of :obj:`str`): The paths of the ELF files.
+        lib_dir (str): The lib dir of the package to copy into.
+        search_dirs (:obj:`list` of :obj:`str`, optional): The extra
+            directories to search the libraries.
+        exclude_prefixes (:obj:`list` of :obj:`str`, optional): The path
+            prefixes of the system libraries. Default is
+            `ELF.SYSTEM_LIB_PREFIX`.
+        workers (int, optional): The number of the threads. Get from the
+            `REZBUILD_BIN_WORKERS` environment variable if not given. Default
+            is the cpu count.
+
+    Returns:
+        :obj:`list` of :obj:`tuple`: The libraries to copy and the
+            destinations.
+    """
+    lib_dir = os.path.abspath(lib_dir)
+    if exclude_prefixes is None:
+        exclude_prefixes = ELF.SYSTEM_LIB_PREFIX
+    search_dirs = list(search_dirs or []) + ELF.SYSTEM_LIB_DIRS
+    indexes = {}
+    copies = []
+    # The resolved paths of the libraries, keyed by the names.
+    located = {}
+    visited = {os.path.realpath(filepath) for filepath in filepaths}
+    # The parsed ELF files of this call.
+    cache = {}
+
+    def find(name, dirs):
+        if os.path.isabs(name):
+            return name if os.path.isfile(name) else ""
+        for dir_ in dirs:
+            if dir_ not in indexes:
+                indexes[dir_] = _list_dir(dir_)
+            if name in indexes[dir_]:
+                return os.path.join(dir_, name)
+        return ""
+
+    workers = get_workers(workers, "REZBUILD_BIN_WORKERS", get_cpu_count())
+    frontier = list(filepaths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while frontier:
+            elfs = list(executor.map(
+                lambda path: ELF.get(path, cache), frontier))
+            frontier = []
+            for elf in elfs:
+                if not elf.elf or elf.static:
+                    continue
+                dirs = [lib_dir] + elf.get_search_dirs() + search_dirs
+                for name in elf.needed:
+                    if name in located:
+                        continue
+                    path = find(name, dirs)
+                    located[name] = path
+                    if not path:
+                        logging.getLogger(__name__).warning(
+                            f"Can't find {name} needed by {elf.path}.")
+                        continue
+                    if any(path.startswith(prefix)
+                           for prefix in exclude_prefixes):
+                        continue
+                    if os.path.realpath(path) in visited:
+                        continue
+                    visited.add(os.path.realpath(path))
+                    if os.path.dirname(os.path.abspath(path)) != lib_dir:
+                        copies.append(
+                            (path, os.path.join(lib_dir, os.path.basename(
+                                name))))
+                    frontier.append(path)
+    return copies
 
 
 def get_windows_shebang(filepath, pattern):
     """Get the windows shebang from binary files.
 
+    The file is searched in chunks and the search stops at the first match.
+
     Args:
         filepath (str): The filepath to get shebang from.
         pattern (str): The re pattern to match shebang.
@@ -74,12 +266,8 @@ def get_windows_shebang(filepath, pattern):
     """
     if not pattern.startswith("#!"):
         pattern = f"#!{pattern}"
-    with open(filepath, "rb") as file:
-        content = file.read()
-    match = re.search(bytes(pattern, encoding="utf-8"), content)
-    if match:
-        return str(match.group(0), encoding="utf-8")
-    return ""
+    _, shebang = _search_file(filepath, bytes(pattern, encoding="utf-8"))
+    return str(shebang, encoding="utf-8")
 
 
 def make_bin_movable(
@@ -108,19 +296,30 @@ def make_bin_movable(
         change_shebang(
             bin_path, shebang, is_bin=True, origin_shebang=origin_shebang)
     else:
-        if MachO.is_macho(bin_path):
+        file_type = classify_file(bin_path)
+        if file_type in [FILE_MACHO, FILE_MACHO_FAT]:
             macho = MachO(bin_path)
             if not macho.static:
                 macho.make_macho_movable(lib_dir, extra_lib_dirs, add_rpath)
+        elif file_type == FILE_ELF:
+            elf = ELF(bin_path)
+            if not elf.static and add_rpath:
+                elf.make_elf_movable(lib_dir, extra_lib_dirs)
         else:
             change_shebang(bin_path, shebang)
 
 
 def make_bins_movable(
         path, shebang="", pattern="", lib_dir="", extra_lib_dirs=None,
-        add_rpath=True):
+        add_rpath=True, exclude=None, workers=None, raise_errors=True):
     """Make all the bins movable which in the directory.
 
+    The files are processed by a thread pool and each file is classified by
+    one read of its header, see `classify_file`. The plans of the Mach-O
+    files are merged before any file changed, so the dylibs shared by them are
+    copied and changed only once. Each Mach-O file is parsed once in the call.
+    A failed file never stops the others.
+
     Args:
         path (str): Path to the directory.
         shebang (str, optional): The shebang to change to. Default is "".
@@ -133,13 +332,802 @@ def make_bins_movable(
             file will not be copied when it in the exclude_lib_dirs.
         add_rpath (bool, optional): Whether to add rpath into macho. Default is
             True.
+        exclude (:obj:`list` of :obj:`str`, optional): The file paths to
+            skip.
+        workers (int, optional): The number of the threads. Get from the
+            `REZBUILD_BIN_WORKERS` environment variable if not given. Default
+            is the cpu count.
+        raise_errors (bool, optional): Whether to raise when any of the files
+            failed. Default is True.
+
+    Returns:
+        dict: The exceptions keyed by the paths of the files failed to make
+            movable. Empty if all the files succeeded.
+
+    Raises:
+        MakeMovableError: When failed to make any of the files movable and
+            raise_errors is True. All the failed files are listed in the
+            message.
     """
-    for filename in os.listdir(path):
+    exclude = exclude or []
+    filepaths = []
+    for filename in sorted(os.listdir(path)):
         filepath = os.path.join(path, filename)
-        if os.path.isdir(filepath) or os.path.islink(filepath):
+        if filepath in exclude or os.path.isdir(filepath) or (
+                os.path.islink(filepath)):
             continue
-        make_bin_movable(
-            filepath, shebang, pattern, lib_dir, extra_lib_dirs, add_rpath)
+        filepaths.append(filepath)
+    plans = {}
+    # The parsed Mach-O files of this call, see `MachO.get`.
+    cache = {}
+
+    def plan_or_change(filepath):
+        if platform.system() == "Windows":
+            make_bin_movable(filepath, shebang, pattern)
+            return
+        file_type = classify_file(filepath)
+        if file_type in [FILE_MACHO, FILE_MACHO_FAT]:
+            macho = MachO.get(filepath, cache)
+            if not macho.static:
+                plans[filepath] = macho.get_movable_plan(
+                    lib_dir, extra_lib_dirs, add_rpath, cache)
+        elif file_type == FILE_ELF:
+            elf = ELF(filepath)
+            if not elf.static and add_rpath:
+                elf.make_elf_movable(lib_dir, extra_lib_dirs)
+        else:
+            change_shebang(filepath, shebang)
+
+    errors = map_files(plan_or_change, filepaths, workers=workers)
+    copies = {}
+    edits = {}
+    for filepath in filepaths:
+        for src, dst in plans.get(filepath, ([], []))[0]:
+            copies.setdefault(dst, src)
+        for path_, dylib_id, changes, rpaths in plans.get(
+                filepath, ([], []))[1]:
+            _, merged_changes, merged_rpaths = edits.setdefault(
+                path_, (dylib_id, {}, []))
+            merged_changes.update(changes)
+            merged_rpaths.extend(
+                rpath for rpath in rpaths or [] if rpath not in merged_rpaths)
+    MachO.log_movable_plan(
+        [(src, dst) for dst, src in copies.items()],
+        [(path_,) + edit for path_, edit in edits.items()])
+
+    def copy(dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.copy2(copies[dst], dst)
+
+    def edit(path_):
+        dylib_id, changes, rpaths = edits[path_]
+        MachO.get(path_, cache).edit(
+            dylib_id=dylib_id, changes=changes, rpaths=rpaths)
+
+    errors.update(map_files(copy, list(copies), workers=workers))
+    errors.update(map_files(
+        edit, [path_ for path_ in edits if path_ not in errors],
+        workers=workers))
+    for filepath, error in errors.items():
+        logging.getLogger(__name__).warning(
+            f"Failed to make {filepath} movable: {error}")
+    if errors and raise_errors:
+        raise MakeMovableError(
+            "Failed to make the files movable:\n" + "\n".join(
+                f"{path}: {error}" for path, error in errors.items()))
+    return errors
+
+
+def make_elfs_movable(path, lib_dir="", extra_lib_dirs=None, workers=None):
+    """Make all the ELF files in the directory tree movable.
+
+    The run paths of the ELF files are changed to the ones relative to
+    `$ORIGIN` by a thread pool, see `ELF.make_elf_movable`.
+
+    Args:
+        path (str): The directory, like the `lib` folder of the package.
+        lib_dir (str, optional): The lib dir of the package. Default is the
+            "lib" folder in the same level directory as the parent directory
+            of each file.
+        extra_lib_dirs (:obj:`list` of :obj:`str`, optional): The extra
+            library directory to add to the run paths.
+        workers (int, optional): The number of the threads. Get from the
+            `REZBUILD_BIN_WORKERS` environment variable if not given. Default
+            is the cpu count.
+
+    Returns:
+        dict: The exceptions keyed by the paths of the files failed to make
+            movable. Empty if all the files succeeded.
+    """
+    filepaths = _list_elfs(path)
+
+    def make_elf_movable(filepath):
+        elf = ELF(filepath)
+        if not elf.static:
+            elf.make_elf_movable(lib_dir, extra_lib_dirs)
+
+    errors = map_files(make_elf_movable, filepaths, workers=workers)
+    for filepath, error in errors.items():
+        logging.getLogger(__name__).warning(
+            f"Failed to make {filepath} movable: {error}")
+    return errors
+
+
+def map_files(function, filepaths, workers=None):
+    """Call the function with each file by a thread pool.
+
+    Args:
+        function (callable): The function to call with the file path.
+        filepaths (:obj:`list` of :obj:`str`): The file paths.
+        workers (int, optional): The number of the threads. Get from the
+            `REZBUILD_BIN_WORKERS` environment variable if not given. Default
+            is the cpu count.
+
+    Returns:
+        dict: The exceptions keyed by the paths of the files the function
+            raised with.
+    """
+    workers = get_workers(workers, "REZBUILD_BIN_WORKERS", get_cpu_count())
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (filepath, executor.submit(function, filepath))
+            for filepath in filepaths]
+        for filepath, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors[filepath] = e
+    return errors
+
+
+def _classify_header(header):
+    """Tell the type of the file by its header.
+
+    Args:
+        header (bytes): The first `FILE_HEADER_SIZE` bytes of the file.
+
+    Returns:
+        str: The file type.
+    """
+    magic_number = header[:4]
+    if magic_number == ELF.MAGIC_NUMBER:
+        return FILE_ELF
+    if magic_number == MachO.MACHO_MAGIC_NUMBERS[2]:
+        # Java class files share the magic number, their major version in
+        # the place of the arch count is never less than 45.
+        if len(header) >= 8 and struct.unpack_from(">I", header, 4)[0] < 45:
+            return FILE_MACHO_FAT
+        return FILE_DATA
+    if magic_number in MachO.MACHO_MAGIC_NUMBERS:
+        return FILE_MACHO
+    if header.startswith(b"MZ"):
+        return FILE_PE
+    if header.startswith(b"#!"):
+        return FILE_SCRIPT
+    return FILE_DATA
+
+
+def _list_dir(path):
+    """List the names in the directory once.
+
+    Args:
+        path (str): The directory path.
+
+    Returns:
+        set: The names in the directory. Empty if it does not exist.
+    """
+    try:
+        return set(os.listdir(path))
+    except OSError:
+        return set()
+
+
+def _list_elfs(path):
+    """List the ELF files in the directory tree.
+
+    Args:
+        path (str): The directory.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The paths of the ELF files, the symbolic
+            links are skipped.
+    """
+    filepaths = []
+    for root, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            filepath = os.path.join(root, filename)
+            if not os.path.islink(filepath) and ELF.is_elf(filepath):
+                filepaths.append(filepath)
+    return filepaths
+
+
+def _replace_bytes(filepath, offset, size, data):
+    """Replace the bytes in the file.
+
+    Args:
+        filepath (str): The file path.
+        offset (int): The offset of the bytes to replace.
+        size (int): The size of the bytes to replace.
+        data (bytes): The bytes to replace with.
+    """
+    if len(data) == size:
+        with open(filepath, "r+b") as file:
+            file.seek(offset)
+            file.write(data)
+        return
+    handle, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(filepath) or ".")
+    try:
+        with open(filepath, "rb") as src, os.fdopen(handle, "wb") as dst:
+            remain = offset
+            while remain:
+                chunk = src.read(min(remain, HASH_CHUNK_SIZE))
+                dst.write(chunk)
+                remain -= len(chunk)
+            dst.write(data)
+            src.seek(offset + size)
+            shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+        shutil.copymode(filepath, temp_path)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _search_file(filepath, pattern):
+    """Search the pattern in the file chunk by chunk.
+
+    The matches longer than SHEBANG_MAX_SIZE may be missed.
+
+    Args:
+        filepath (str): The file path.
+        pattern (bytes): The re pattern to search.
+
+    Returns:
+        tuple: The offset and the bytes of the first match. The offset is -1
+            if not found.
+    """
+    regex = re.compile(pattern)
+    start = 0
+    buffer = b""
+    with open(filepath, "rb") as file:
+        while True:
+            chunk = file.read(HASH_CHUNK_SIZE)
+            buffer += chunk
+            match = regex.search(buffer)
+            # The match may continue in the next chunk if it is near the end.
+            complete = match and match.end() + SHEBANG_MAX_SIZE <= len(buffer)
+            if match and (complete or not chunk):
+                return start + match.start(), match.group(0)
+            if not chunk:
+                return -1, b""
+            if not match and len(buffer) > SHEBANG_MAX_SIZE:
+                start += len(buffer) - SHEBANG_MAX_SIZE
+                buffer = buffer[-SHEBANG_MAX_SIZE:]
+
+
+def _write_patches(filepath, patches):
+    """Write the patches into the file.
+
+    The file is replaced instead of changed in place if it has other hard
+    links.
+
+    Args:
+        filepath (str): The file path.
+        patches (:obj:`list` of :obj:`tuple`): The file offsets and the bytes
+            to write.
+    """
+    file_stat = os.stat(filepath)
+    path = filepath
+    if file_stat.st_nlink > 1:
+        # Never change the content of the other hard links.
+        handle, path = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".")
+        os.close(handle)
+        shutil.copy2(filepath, path)
+    os.chmod(path, file_stat.st_mode | stat.S_IWUSR)
+    with open(path, "r+b") as file:
+        for offset, data in patches:
+            file.seek(offset)
+            file.write(data)
+    os.chmod(path, stat.S_IMODE(file_stat.st_mode))
+    if path != filepath:
+        os.replace(path, filepath)
+
+
+class ELF(object):
+    """Read and change the run paths of the ELF files."""
+
+    DT_NEEDED = 1
+    DT_NULL = 0
+    DT_RELACOUNT = 0x6ffffff9
+    DT_RELCOUNT = 0x6ffffffa
+    DT_RPATH = 15
+    DT_RUNPATH = 29
+    DT_SONAME = 14
+    DT_STRSZ = 10
+    DT_STRTAB = 5
+    MAGIC_NUMBER = b"\x7fELF"
+    PT_DYNAMIC = 2
+    PT_LOAD = 1
+    SHT_NOBITS = 8
+
+    # The directories searched by the dynamic linker by default.
+    SYSTEM_LIB_DIRS = [
+        "/lib64",
+        "/usr/lib64",
+        "/lib/x86_64-linux-gnu",
+        "/usr/lib/x86_64-linux-gnu",
+        "/lib/aarch64-linux-gnu",
+        "/usr/lib/aarch64-linux-gnu",
+        "/lib",
+        "/usr/lib",
+    ]
+
+    # File path prefix of the system libraries.
+    SYSTEM_LIB_PREFIX = [
+        "/lib/",
+        "/lib32/",
+        "/lib64/",
+        "/usr/lib/",
+        "/usr/lib32/",
+        "/usr/lib64/",
+    ]
+
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path):
+        """Initialize.
+
+        Args:
+            path (str): The path of the ELF file.
+        """
+        self.elf = False
+        self.needed = []
+        self.path = path
+        self.rpaths = []
+        self.runpaths = []
+        self.soname = ""
+        self.static = False
+        # The file offsets and the sizes of the DT_RPATH and DT_RUNPATH
+        # strings, and the file offsets of the other dynamic strings.
+        self._run_path_strings = []
+        self._string_offsets = []
+        # The file offsets of the DT_RPATH and DT_RUNPATH entries, and of the
+        # entries can be turned into a new one, see `get_append_patches`.
+        self._run_path_entries = []
+        self._spare_entries = []
+        # The virtual address and the file offset of the dynamic string
+        # table, and the file offset and the value of the DT_STRSZ entry.
+        self._strtab = None
+        self._strsz = None
+        self._parse_file()
+
+    def _parse_file(self):
+        """Parse the ELF file.
+
+        The file is mapped into the memory and only the headers and the
+        dynamic section are read.
+        """
+        with open(self.path, "rb") as file:
+            if file.read(4) != self.MAGIC_NUMBER:
+                return
+            self.elf = True
+            with mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                self.parse_dynamic(content)
+
+    def _is_bundled_path(self, path, bundled):
+        """Check whether the run path only provides the bundled libraries.
+
+        Args:
+            path (str): The absolute run path.
+            bundled (set): The needed libraries found in the lib dirs.
+
+        Returns:
+            bool: True if the path holds any of the bundled libraries and
+                none of the other needed libraries.
+        """
+        provided = {
+            name for name in self.needed
+            if os.path.exists(os.path.join(path, name))}
+        return bool(provided) and provided <= bundled
+
+    @classmethod
+    def get(cls, path, cache=None):
+        """Get the parsed ELF file, reuse it if the file is unchanged.
+
+        The cache is owned by the caller, like `get_elf_bundle_plan`, so the
+        parsed files never outlive one run.
+
+        Args:
+            path (str): The path of the ELF file.
+            cache (dict, optional): The parsed ELF files keyed by the path and
+                the file state. Parse the file every time if not given.
+
+        Returns:
+            ELF: The parsed ELF file.
+        """
+        if cache is None:
+            return cls(path)
+        file_stat = os.stat(path)
+        key = (
+            os.path.realpath(path), file_stat.st_size, file_stat.st_mtime_ns,
+            file_stat.st_ino)
+        with cls._cache_lock:
+            elf = cache.get(key)
+        if elf is None:
+            elf = cls(path)
+            with cls._cache_lock:
+                cache[key] = elf
+        return elf
+
+    def get_default_libdir(self):
+        """Get the path of the lib dir under the package root.
+
+        Assume the package tree like this:
+        package_root/
+            |___bin/
+                |___ELF file
+            |___lib/
+                |___lib1
+                |___lib2
+        """
+        return os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(self.path))),
+            "lib")
+
+    def get_origin_path(self, path):
+        """Get the path relative with the directory of the file.
+
+        Args:
+            path (str): The absolute path.
+
+        Returns:
+            str: The path start with `$ORIGIN`.
+        """
+        relative_path = get_relative_path(
+            os.path.dirname(os.path.abspath(self.path)),
+            os.path.abspath(path))
+        return "/".join(["$ORIGIN", relative_path]).rstrip("/")
+
+    def get_search_dirs(self):
+        """Get the directories to search the needed libraries of the file.
+
+        Same as the dynamic linker, the DT_RPATH is ignored if the file has
+        DT_RUNPATH.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The DT_RPATH, `LD_LIBRARY_PATH` and
+                DT_RUNPATH directories, `$ORIGIN` expanded.
+        """
+        origin = os.path.dirname(os.path.abspath(self.path))
+        dirs = [] if self.runpaths else list(self.rpaths)
+        dirs += [
+            dir_ for dir_ in os.getenv("LD_LIBRARY_PATH", "").split(":")
+            if dir_]
+        dirs += self.runpaths
+        return [
+            os.path.normpath(dir_.replace("${ORIGIN}", origin).replace(
+                "$ORIGIN", origin))
+            for dir_ in dirs]
+
+    @classmethod
+    def is_elf(cls, filepath):
+        """Check if the file is an ELF file.
+
+        Args:
+            filepath (str): The path of the file to check.
+
+        Returns:
+            bool: True if the file is an ELF file, false otherwise.
+        """
+        return classify_file(filepath) == FILE_ELF
+
+    def make_elf_movable(self, lib_dir="", extra_lib_dirs=None):
+        """Make the ELF file movable by the run paths relative to `$ORIGIN`.
+
+        The absolute run paths under the package root, the parent of the lib
+        dir, are changed to the `$ORIGIN` ones. The lib dir and the extra lib
+        dirs are added. An absolute run path outside the package root is
+        dropped only if it holds any of the needed libraries found in the lib
+        dirs, like the libraries copied by `bundle_elfs`, and none of the
+        other needed libraries. The other run paths, including the ones not
+        exist at build time, are kept.
+
+        Args:
+            lib_dir (str, optional): The lib dir of the package. Default is
+                the "lib" folder in the same level directory as the parent
+                directory of the file.
+            extra_lib_dirs (:obj:`list` of :obj:`str`, optional): The extra
+                library directory to add to the run paths.
+        """
+        lib_dir = os.path.abspath(lib_dir or self.get_default_libdir())
+        lib_dirs = [lib_dir] + list(extra_lib_dirs or [])
+        bundled = {
+            name for name in self.needed
+            if any(os.path.exists(os.path.join(dir_, name))
+                   for dir_ in lib_dirs)}
+        if not (self.runpaths or self.rpaths or bundled):
+            # Never add the run paths the file does not need.
+            return
+        root = os.path.dirname(lib_dir)
+        run_paths = []
+        for path in self.runpaths or self.rpaths:
+            if os.path.isabs(path) and (
+                    path == root or path.startswith(root + os.sep)):
+                path = self.get_origin_path(path)
+            elif os.path.isabs(path) and self._is_bundled_path(
+                    path, bundled):
+                logging.getLogger(__name__).info(
+                    f"Remove the run path {path} of {self.path}, the "
+                    f"libraries in it are bundled.")
+                continue
+            if path not in run_paths:
+                run_paths.append(path)
+        for dir_ in lib_dirs:
+            path = self.get_origin_path(dir_)
+            if path not in run_paths:
+                run_paths.append(path)
+        self.set_run_paths(run_paths)
+
+    def get_append_patches(self, value):
+        """Get the patches to append the run path string in the process.
+
+        The string is appended to the loadable segment holding the dynamic
+        string table, in the zero padding before the next segment, and the
+        segment is grown to cover it. The DT_RPATH and DT_RUNPATH entries are
+        pointed to the string, and the DT_STRSZ is grown to reach it. If the
+        file has neither of them, a DT_RUNPATH entry takes a spare DT_NULL
+        entry, or the DT_RELACOUNT or DT_RELCOUNT entry which is only a hint
+        of the dynamic linker.
+
+        Args:
+            value (bytes): The new run path string.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: The file offsets and the bytes to
+                write. None if the file has no room for the string or the
+                entry.
+        """
+        if self._strtab is None or not (
+                self._run_path_entries or self._spare_entries):
+            return None
+        with open(self.path, "rb") as file:
+            with mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                is_64, endian, headers = self.read_program_headers(content)
+                sections = self.read_section_ranges(content)
+                strtab_vaddr = self._strtab[0]
+                load = None
+                for header in headers:
+                    type_, offset, vaddr, filesz, memsz, _ = header
+                    if type_ == self.PT_LOAD and (
+                            vaddr <= strtab_vaddr < vaddr + filesz):
+                        load = header
+                if load is None or load[3] != load[4]:
+                    # No room after the segment with the bss.
+                    return None
+                _, offset, vaddr, filesz, memsz, header_offset = load
+                start, end = offset + filesz, offset + filesz + len(value) + 1
+                start_vaddr = vaddr + filesz
+                if end > len(content) or content[start:end].strip(b"\x00"):
+                    return None
+        for header in headers:
+            if header is load:
+                continue
+            type_, offset_, vaddr_, filesz_, memsz_, _ = header
+            if filesz_ and offset_ < end and start < offset_ + filesz_:
+                return None
+            if type_ == self.PT_LOAD and (
+                    vaddr_ < start_vaddr + end - start
+                    and start_vaddr < vaddr_ + memsz_):
+                return None
+        if any(offset_ < end and start < offset_ + size
+               for offset_, size in sections):
+            return None
+        size_format = f"{endian}Q" if is_64 else f"{endian}I"
+        size_offsets = (32, 40) if is_64 else (16, 20)
+        string_offset = start_vaddr - strtab_vaddr
+        patches = [(start, value + b"\x00")]
+        for field_offset in size_offsets:
+            patches.append((
+                header_offset + field_offset,
+                struct.pack(size_format, filesz + end - start)))
+        if self._strsz:
+            patches.append((
+                self._strsz[0] + struct.calcsize(size_format),
+                struct.pack(size_format, max(
+                    self._strsz[1], string_offset + end - start))))
+        if self._run_path_entries:
+            for entry_offset in self._run_path_entries:
+                patches.append((
+                    entry_offset + struct.calcsize(size_format),
+                    struct.pack(size_format, string_offset)))
+        else:
+            tag_format = f"{endian}q" if is_64 else f"{endian}i"
+            patches.append((
+                self._spare_entries[0],
+                struct.pack(tag_format, self.DT_RUNPATH)
+                + struct.pack(size_format, string_offset)))
+        return patches
+
+    def parse_dynamic(self, content):
+        """Parse the dynamic section.
+
+        Args:
+            content (mmap.mmap or bytes): The ELF file content.
+        """
+        is_64, endian, headers = self.read_program_headers(content)
+        dynamic_format = f"{endian}qQ" if is_64 else f"{endian}iI"
+        loads = []
+        dynamic = None
+        for type_, offset, vaddr, filesz, _, _ in headers:
+            if type_ == self.PT_LOAD:
+                loads.append((vaddr, offset, filesz))
+            elif type_ == self.PT_DYNAMIC:
+                dynamic = (offset, filesz)
+        if dynamic is None:
+            self.static = True
+            return
+        entries = []
+        nulls = []
+        hints = []
+        dynamic_size = struct.calcsize(dynamic_format)
+        for offset in range(
+                dynamic[0], dynamic[0] + dynamic[1], dynamic_size):
+            tag, value = struct.unpack_from(dynamic_format, content, offset)
+            if tag == self.DT_NULL:
+                nulls.append(offset)
+                continue
+            if nulls:
+                break
+            if tag in [self.DT_RPATH, self.DT_RUNPATH]:
+                self._run_path_entries.append(offset)
+            elif tag in [self.DT_RELACOUNT, self.DT_RELCOUNT]:
+                hints.append(offset)
+            elif tag == self.DT_STRSZ:
+                self._strsz = (offset, value)
+            entries.append((tag, value))
+        # A DT_NULL entry is kept to end the entries.
+        self._spare_entries = nulls[:-1] + hints
+        strtab = None
+        for tag, value in entries:
+            if tag == self.DT_STRTAB:
+                for vaddr, offset, size in loads:
+                    if vaddr <= value < vaddr + size:
+                        strtab = value - vaddr + offset
+                        self._strtab = (value, strtab)
+        if strtab is None:
+            return
+        for tag, value in entries:
+            if tag not in [
+                    self.DT_NEEDED, self.DT_RPATH, self.DT_RUNPATH,
+                    self.DT_SONAME]:
+                continue
+            offset = strtab + value
+            end = content.find(b"\x00", offset)
+            string = content[offset:end].decode("utf-8")
+            if tag == self.DT_NEEDED:
+                self.needed.append(string)
+            elif tag == self.DT_SONAME:
+                self.soname = string
+            else:
+                paths = [path for path in string.split(":") if path]
+                if tag == self.DT_RPATH:
+                    self.rpaths.extend(paths)
+                else:
+                    self.runpaths.extend(paths)
+                self._run_path_strings.append((offset, end - offset))
+                continue
+            self._string_offsets.append(offset)
+
+    def read_program_headers(self, content):
+        """Read the program headers.
+
+        Args:
+            content (mmap.mmap or bytes): The ELF file content.
+
+        Returns:
+            tuple: Whether the file is 64-bit, the struct byte order, and a
+                list of tuples of the type, file offset, virtual address, file
+                size, memory size and the file offset of each header.
+        """
+        is_64 = content[4] == 2
+        endian = "<" if content[5] == 1 else ">"
+        if is_64:
+            phoff = struct.unpack_from(f"{endian}Q", content, 32)[0]
+            entry_size, count = struct.unpack_from(f"{endian}2H", content, 54)
+            # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz
+            header_format, indexes = f"{endian}2I5Q", (0, 2, 3, 5, 6)
+        else:
+            phoff = struct.unpack_from(f"{endian}I", content, 28)[0]
+            entry_size, count = struct.unpack_from(f"{endian}2H", content, 42)
+            # p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz
+            header_format, indexes = f"{endian}6I", (0, 1, 2, 4, 5)
+        headers = []
+        for index in range(count):
+            header_offset = phoff + index * entry_size
+            fields = struct.unpack_from(header_format, content, header_offset)
+            headers.append(
+                tuple(fields[i] for i in indexes) + (header_offset,))
+        return is_64, endian, headers
+
+    def read_section_ranges(self, content):
+        """Read the file ranges of the sections and the headers.
+
+        Args:
+            content (mmap.mmap or bytes): The ELF file content.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: The file offsets and the sizes of the
+                ELF header, the program header table, the section header table
+                and the sections with content.
+        """
+        is_64 = content[4] == 2
+        endian = "<" if content[5] == 1 else ">"
+        if is_64:
+            phoff, shoff = struct.unpack_from(f"{endian}2Q", content, 32)
+            ph_size, ph_count, sh_size, sh_count = struct.unpack_from(
+                f"{endian}4H", content, 54)
+            # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size
+            section_format, indexes = f"{endian}2I4Q", (1, 4, 5)
+        else:
+            phoff, shoff = struct.unpack_from(f"{endian}2I", content, 28)
+            ph_size, ph_count, sh_size, sh_count = struct.unpack_from(
+                f"{endian}4H", content, 42)
+            # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size
+            section_format, indexes = f"{endian}6I", (1, 4, 5)
+        ranges = [
+            (0, 64 if is_64 else 52), (phoff, ph_size * ph_count),
+            (shoff, sh_size * sh_count)]
+        if not shoff:
+            return ranges
+        for index in range(sh_count):
+            fields = struct.unpack_from(
+                section_format, content, shoff + index * sh_size)
+            type_, offset, size = [fields[i] for i in indexes]
+            if type_ != self.SHT_NOBITS and size:
+                ranges.append((offset, size))
+        return ranges
+
+    def set_run_paths(self, run_paths):
+        """Set the DT_RPATH and DT_RUNPATH of the file in the process.
+
+        The strings are changed in place if the new value is not longer than
+        the old one. Otherwise the new string is appended to the segment of
+        the dynamic string table, see `get_append_patches`. No `patchelf` is
+        needed.
+
+        Args:
+            run_paths (:obj:`list` of :obj:`str`): The run paths to set.
+
+        Raises:
+            UnsupportedError: When the file has no room for the new run paths.
+        """
+        if run_paths == (self.runpaths or self.rpaths):
+            return
+        value = ":".join(run_paths).encode("utf-8")
+        patches = []
+        for offset, size in self._run_path_strings:
+            # The strings sharing the tail of the old value.
+            shared = any(
+                offset < string_offset <= offset + size
+                for string_offset in self._string_offsets)
+            if len(value) > size or shared:
+                patches = []
+                break
+            patches.append((offset, value.ljust(size, b"\x00")))
+        if not patches:
+            patches = self.get_append_patches(value)
+        if not patches:
+            raise UnsupportedError(
+                f"No room in {self.path} to set the run paths "
+                f"{':'.join(run_paths)}.")
+        _write_patches(self.path, patches)
+        # Parse again for the new offsets of the strings and the entries.
+        self.__init__(self.path)
 
 
 class MachO(object):
@@ -148,9 +1136,24 @@ class MachO(object):
     # of the file.
     LOAD_COMMANDS_MAPPING = {
         12: "parse_load_dylib",
+        13: "parse_dylib_id",
+        32: "parse_load_dylib",
+        2147483672: "parse_load_dylib",
         2147483676: "parse_rpath",
+        2147483679: "parse_load_dylib",
+        2147483683: "parse_load_dylib",
     }
 
+    # The load commands referencing a dylib by the name, they are
+    # LC_LOAD_DYLIB, LC_ID_DYLIB, LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB,
+    # LC_LAZY_LOAD_DYLIB and LC_LOAD_UPWARD_DYLIB.
+    DYLIB_COMMANDS = [12, 13, 2147483672, 2147483679, 32, 2147483683]
+    LC_CODE_SIGNATURE = 29
+    LC_ID_DYLIB = 13
+    LC_RPATH = 2147483676
+    LC_SEGMENT = 1
+    LC_SEGMENT_64 = 25
+
     # The magic numbers of Mach-O files
     MACHO_MAGIC_NUMBERS = [
         b"\xcf\xfa\xed\xfe",
@@ -158,6 +1161,8 @@ class MachO(object):
         b"\xca\xfe\xba\xbe",
     ]
 
+    _cache_lock = threading.Lock()
+
     # File path prefix of the system dylib.
     SYSTEM_DYLIB_PREFIX = [
         "/usr/lib/",
@@ -170,6 +1175,7 @@ class MachO(object):
         Args:
             path (str): The path of the Mach-O file.
         """
+        self.dylib_id = ""
         self.fat = False
         self.load_dylibs = []
         self.macho = False
@@ -179,24 +1185,30 @@ class MachO(object):
         self._parse_file()
 
     def _parse_file(self):
-        """Parse the MachO file."""
+        """Parse the MachO file.
+
+        The file is mapped into the memory and only the headers and the load
+        commands are read, so the memory never grows with the file size.
+        """
         with open(self.path, "rb") as file:
             magic_number = file.read(4)
             if magic_number in self.MACHO_MAGIC_NUMBERS:
                 self.macho = True
             else:
                 return
-            if magic_number == b"\xca\xfe\xba\xbe":
-                self.fat = True
-                arch_count = struct.unpack(">I", file.read(4))[0]
-                # Each fat header has 5 entity. Each entity occupies 4 bytes.
-                offsets = self.get_fat_offsets(
-                    arch_count, file.read(20 * arch_count))
-                content = b"\x00" * (8 + arch_count * 20) + file.read()
-            else:
-                offsets = [0]
-                content = magic_number + file.read()
-        self.parse_arch(content, offsets)
+            with mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as content:
+                    if magic_number == b"\xca\xfe\xba\xbe":
+                        self.fat = True
+                        arch_count = struct.unpack_from(">I", content, 4)[0]
+                        # Each fat header has 5 entity. Each entity occupies 4
+                        # bytes.
+                        offsets = self.get_fat_offsets(
+                            arch_count, content[8:8 + 20 * arch_count])
+                    else:
+                        offsets = [0]
+                    self.parse_arch(content, offsets)
 
     def add_rpath(self, rpath):
         """Add rpath into Macho-O file.
@@ -204,8 +1216,7 @@ class MachO(object):
         Args:
             rpath (str): The rpath to add.
         """
-        cmd = ["install_name_tool", "-add_rpath", rpath, self.path]
-        subprocess.run(cmd, check=True)
+        self.edit(rpaths=[rpath])
 
     def change_dylib_id(self, dylib_id):
         """change the load dylib ID.
@@ -213,8 +1224,7 @@ class MachO(object):
         Args:
             dylib_id (str): The id to change to.
         """
-        cmd = ["install_name_tool", "-id", dylib_id, self.path]
-        subprocess.run(cmd, check=True)
+        self.edit(dylib_id=dylib_id)
 
     def change_load_dylib(self, old_path, new_path):
         """Change the load dylib path.
@@ -223,18 +1233,74 @@ class MachO(object):
             old_path (str): The old load dylib to change.
             new_path (str): The new load dylib to change to.
         """
-        cmd = ["install_name_tool", "-change", old_path, new_path, self.path]
-        subprocess.run(cmd, check=True)
+        self.edit(changes={old_path: new_path})
 
     @staticmethod
     def decode_str(content):
         """Decode bytes to str.
 
         Args:
-            content (bytes): The bytes to decode.
+            content (bytes): The bytes to decode, end with the null padding.
+        """
+        return bytes(content).split(b"\x00", 1)[0].decode("utf-8")
+
+    def edit(self, dylib_id="", changes=None, rpaths=None):
+        """Change the ID, the load dylibs and add the rpaths in a single pass.
+
+        The load commands of all the architectures are rewritten in the
+        process, the new commands must fit in the padding between the load
+        commands and the first section. Fall back to one `install_name_tool`
+        call with all the edits if the padding runs out. The file is replaced
+        instead of changed in place if it has other hard links. Like
+        `install_name_tool`, the edit invalidates the code signature, the
+        signed file is signed again ad hoc by `codesign`. A warning is logged
+        if `codesign` is not available, like on Linux, as the file will be
+        killed on Apple silicon until it is signed again.
+
+        Args:
+            dylib_id (str, optional): The ID to change to. Ignored if the file
+                is not a dylib.
+            changes (dict, optional): The new load dylib paths keyed by the
+                old paths.
+            rpaths (:obj:`list` of :obj:`str`, optional): The rpaths to add.
+                The existing rpaths are skipped.
+
+        Raises:
+            UnsupportedError: When the padding runs out and
+                `install_name_tool` is not available.
         """
-        result = b"".join(struct.unpack(f"{len(content)}c", content))
-        return result.decode("utf-8").strip(b"\x00".decode())
+        dylib_id = dylib_id if self.dylib_id else ""
+        if dylib_id == self.dylib_id:
+            dylib_id = ""
+        changes = {
+            old: new for old, new in (changes or {}).items()
+            if old != new and old in self.load_dylibs}
+        new_rpaths = []
+        for rpath in rpaths or []:
+            if rpath not in self.rpaths and rpath not in new_rpaths:
+                new_rpaths.append(rpath)
+        rpaths = new_rpaths
+        if not (dylib_id or changes or rpaths):
+            return
+        patches, signed = self.get_edit_patches(dylib_id, changes, rpaths)
+        if patches is None:
+            self._run_install_name_tool(dylib_id, changes, rpaths)
+        else:
+            _write_patches(self.path, patches)
+            if signed and shutil.which("codesign"):
+                subprocess.run(
+                    ["codesign", "--force", "--sign", "-", self.path],
+                    check=True)
+            elif signed:
+                logging.getLogger(__name__).warning(
+                    f"The code signature of {self.path} is invalid after the "
+                    f"edit and codesign is not available, sign it again with "
+                    f"`codesign --force --sign -` on macOS.")
+        if dylib_id:
+            self.dylib_id = dylib_id
+        self.load_dylibs = [
+            changes.get(dylib, dylib) for dylib in self.load_dylibs]
+        self.rpaths.extend(rpaths)
 
     def get_default_libdir(self):
         """Get the path of the lib dir under the package root.
@@ -273,11 +1339,46 @@ class MachO(object):
             content (bytes): The header content of the fat file.
         """
         offsets = []
-        for i in range(arch_count):
-            offset = struct.unpack(">I", content[i * 20 + 8:i * 20 + 12])[0]
-            offsets.append(offset)
+        for i in range(min(arch_count, len(content) // 20)):
+            offsets.append(struct.unpack_from(">I", content, i * 20 + 8)[0])
         return offsets
 
+    def get_edit_patches(self, dylib_id="", changes=None, rpaths=None):
+        """Get the bytes to write for the edits of all the architectures.
+
+        Args:
+            dylib_id (str, optional): The ID to change to.
+            changes (dict, optional): The new load dylib paths keyed by the
+                old paths.
+            rpaths (:obj:`list` of :obj:`str`, optional): The rpaths to add.
+
+        Returns:
+            tuple: A list of tuples of the file offset and the bytes to write,
+                None if the padding of any architecture runs out. And whether
+                the file has a code signature.
+        """
+        patches = []
+        signed = False
+        with open(self.path, "rb") as file:
+            with mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as content:
+                    if self.fat:
+                        arch_count = struct.unpack_from(">I", content, 4)[0]
+                        offsets = self.get_fat_offsets(
+                            arch_count, content[8:8 + 20 * arch_count])
+                    else:
+                        offsets = [0]
+                    for offset in offsets:
+                        arch_patches, arch_signed = self._get_arch_patches(
+                            content, offset, dylib_id, changes or {},
+                            rpaths or [])
+                        if arch_patches is None:
+                            return None, False
+                        patches.extend(arch_patches)
+                        signed = signed or arch_signed
+        return patches, signed
+
     def get_load_dylibs(self, ignore_system_dylib=False):
         """Get all the dylibs in this Mach-O files.
 
@@ -321,11 +1422,18 @@ class MachO(object):
         Returns:
             bool: True if the file is a Mach-O file, false otherwise.
         """
-        return cls.get_magic_number(filepath) in cls.MACHO_MAGIC_NUMBERS
+        return classify_file(filepath) in [FILE_MACHO, FILE_MACHO_FAT]
 
-    def make_macho_movable(
-            self, lib_dir="", extra_lib_dirs=None, add_rpath=True):
-        """Make the macho file movable.
+    def get_movable_plan(
+            self, lib_dir="", extra_lib_dirs=None, add_rpath=True,
+            cache=None):
+        """Resolve the dylib closure and plan the copies and the edits.
+
+        Each library directory is listed once. Each dylib in the closure is
+        parsed and planned once, even if many Mach-O files load it or the
+        dylibs load each other. The dylibs are searched in the library
+        directories by the name first, then by the load path resolved
+        against `@loader_path`, `@executable_path` and the rpaths.
 
         Args:
             lib_dir (str, optional): The destination path to put the dylib file
@@ -336,64 +1444,177 @@ class MachO(object):
                 copied when it already in extra_lib_dirs.
             add_rpath (bool, optional): Whether to add rpath into macho.
                 Default is True.
+            cache (dict, optional): The parsed Mach-O files to reuse, see
+                `get`.
+
+        Returns:
+            tuple: A list of tuples of the dylib to copy and the destination.
+                And a list of tuples of the Mach-O file to edit, the new ID,
+                the load dylib changes and the rpaths to add, see `edit`.
         """
         lib_dir = lib_dir or self.get_default_libdir()
-        extra_lib_dirs = extra_lib_dirs or []
-        extra_lib_dirs.append(lib_dir)
+        lib_dirs = list(extra_lib_dirs or []) + [lib_dir]
+        indexes = {dir_: _list_dir(dir_) for dir_ in lib_dirs}
+        rpaths = []
         if add_rpath:
-            for dir_ in extra_lib_dirs:
-                rpath = self.get_default_rpath(dir_)
-                if rpath not in self.rpaths:
-                    self.add_rpath(rpath)
-                    self.rpaths.append(rpath)
-
-        def copy_and_change(macho):
-            """Copy dylibs and change lcload path.
-
-            Args:
-                macho (MachO): The macho object to change.
-            """
-            macho.change_dylib_id(f"@rpath/{os.path.basename(macho.path)}")
-            for dylib in macho.get_load_dylibs(ignore_system_dylib=True):
+            rpaths = [self.get_default_rpath(dir_) for dir_ in lib_dirs]
+        copies = []
+        edits = []
+        # The paths of the dylibs after the copies, keyed by the names.
+        located = {}
+        visited = {os.path.realpath(self.path)}
+        # Each item is the Mach-O to parse, the path to edit and the rpaths.
+        queue = [(self, self.path, rpaths)]
+        while queue:
+            macho, path, rpaths_ = queue.pop(0)
+            changes = {}
+            for dylib in macho.get_non_system_dylibs():
                 lib_name = os.path.basename(dylib)
-                macho.change_load_dylib(dylib, f"@rpath/{lib_name}")
-                for extra_lib_dir in extra_lib_dirs:
-                    if lib_name in os.listdir(extra_lib_dir):
-                        copy_and_change(
-                            MachO(os.path.join(extra_lib_dir, lib_name)))
+                if dylib != f"@rpath/{lib_name}":
+                    changes[dylib] = f"@rpath/{lib_name}"
+                if lib_name in located:
+                    continue
+                src = dst = ""
+                for dir_ in lib_dirs:
+                    if lib_name in indexes[dir_]:
+                        src = dst = os.path.join(dir_, lib_name)
                         break
                 else:
-                    dst = os.path.join(lib_dir, lib_name)
-                    shutil.copy2(dylib, dst)
-                    copy_and_change(MachO(dst))
+                    src = self._resolve_dylib(macho, dylib)
+                    if src:
+                        dst = os.path.join(lib_dir, lib_name)
+                        copies.append((src, dst))
+                        indexes[lib_dir].add(lib_name)
+                located[lib_name] = dst
+                if not src:
+                    logging.getLogger(__name__).warning(
+                        f"Can't find {dylib} loaded by {macho.path}.")
+                    continue
+                if os.path.realpath(dst) in visited:
+                    continue
+                visited.add(os.path.realpath(dst))
+                queue.append((self.get(src, cache), dst, None))
+            edits.append((
+                path, f"@rpath/{os.path.basename(path)}", changes, rpaths_))
+        return copies, edits
+
+    @classmethod
+    def get(cls, path, cache=None):
+        """Get the parsed Mach-O file, reuse it if the file is unchanged.
+
+        The cache is owned by the caller, like `make_bins_movable`, so the
+        parsed files never outlive one run.
+
+        Args:
+            path (str): The path of the Mach-O file.
+            cache (dict, optional): The parsed Mach-O files keyed by the path
+                and the file state. Parse the file every time if not given.
+
+        Returns:
+            MachO: The parsed Mach-O file.
+        """
+        if cache is None:
+            return cls(path)
+        file_stat = os.stat(path)
+        key = (
+            os.path.realpath(path), file_stat.st_size, file_stat.st_mtime_ns,
+            file_stat.st_ino)
+        with cls._cache_lock:
+            macho = cache.get(key)
+        if macho is None:
+            macho = cls(path)
+            with cls._cache_lock:
+                cache[key] = macho
+        return macho
+
+    @staticmethod
+    def log_movable_plan(copies, edits):
+        """Log the planned copies and edits.
 
-        copy_and_change(self)
+        Args:
+            copies (:obj:`list` of :obj:`tuple`): The dylibs to copy and the
+                destinations.
+            edits (:obj:`list` of :obj:`tuple`): The Mach-O files to edit, the
+                new IDs, the load dylib changes and the rpaths to add.
+        """
+        logger = logging.getLogger(__name__)
+        for src, dst in copies:
+            logger.info(f"Copy {src} to {dst}.")
+        for path, dylib_id, changes, rpaths in edits:
+            logger.info(
+                f"Change {path}: id {dylib_id}, load dylibs {changes}, add "
+                f"rpaths {rpaths or []}.")
+
+    def make_macho_movable(
+            self, lib_dir="", extra_lib_dirs=None, add_rpath=True):
+        """Make the macho file movable.
+
+        The whole plan is resolved and logged before any file changed, see
+        `get_movable_plan`. The non system dylibs not in the library
+        directories are copied into the lib dir, then the ID and the load
+        dylibs of each Mach-O file in the closure are changed to the
+        `@rpath` ones at once.
+
+        Args:
+            lib_dir (str, optional): The destination path to put the dylib file
+                to. Default is the "lib" folder in the same level directory as
+                the parent directory of macho_path.
+            extra_lib_dirs (:obj:`list` of :obj:`str`, optional): The extra
+                library directory to add to rpath. The dylib files will not be
+                copied when it already in extra_lib_dirs.
+            add_rpath (bool, optional): Whether to add rpath into macho.
+                Default is True.
+        """
+        cache = {}
+        copies, edits = self.get_movable_plan(
+            lib_dir, extra_lib_dirs, add_rpath, cache)
+        self.log_movable_plan(copies, edits)
+        for src, dst in copies:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst)
+        for path, dylib_id, changes, rpaths in edits:
+            macho = self if path == self.path else self.get(path, cache)
+            macho.edit(dylib_id=dylib_id, changes=changes, rpaths=rpaths)
 
     def parse_arch(self, content, offsets):
         """Parse the MachO file architecture.
 
+        Only the load commands to parse are copied out of the content.
+
         Args:
-            content (bytes): The MachO file content.
+            content (bytes or memoryview): The MachO file content.
             offsets (:obj:`list` of :obj:`int`): The offset of each
                 architecture in MachO file.
         """
         for offset in offsets:
-            magic_number = content[offset:offset + 4]
-            if magic_number not in self.MACHO_MAGIC_NUMBERS:
+            magic_number = bytes(content[offset:offset + 4])
+            if magic_number not in self.MACHO_MAGIC_NUMBERS[:2]:
                 self.static = True
                 break
-            load_cmd_count = struct.unpack(
-                "I", content[offset + 16:offset + 20])[0]
-            feed = 32 + offset
+            load_cmd_count = struct.unpack_from("<I", content, offset + 16)[0]
+            # The 64 bit header has an extra reserved field.
+            header_size = 32 if magic_number == b"\xcf\xfa\xed\xfe" else 28
+            feed = offset + header_size
             for _ in range(load_cmd_count):
-                cmd, size = struct.unpack("2I", content[feed:feed + 8])
-                if cmd not in self.LOAD_COMMANDS_MAPPING.keys():
-                    feed += size
-                    continue
-                func = self.LOAD_COMMANDS_MAPPING[cmd]
-                getattr(self, func)(content[feed + 8:feed + size])
+                if feed + 8 > len(content):
+                    break
+                cmd, size = struct.unpack_from("<2I", content, feed)
+                if size < 8:
+                    break
+                if cmd in self.LOAD_COMMANDS_MAPPING:
+                    func = self.LOAD_COMMANDS_MAPPING[cmd]
+                    getattr(self, func)(bytes(content[feed + 8:feed + size]))
                 feed += size
 
+    def parse_dylib_id(self, content):
+        """Parse the dylib ID from the given content.
+
+        Args:
+            content (bytes): Part of the Mach-O file content that contain the
+                dylib ID to parse.
+        """
+        self.dylib_id = self.decode_str(content[16:])
+
     def parse_rpath(self, content):
         """Parse rpath from the given rpath content.
 
@@ -401,7 +1622,10 @@ class MachO(object):
             content (bytes): Part of the Mach-O file content that contain the
                 rpath to parse.
         """
-        self.rpaths.append(self.decode_str(content[4:]))
+        rpath = self.decode_str(content[4:])
+        # The architectures of the fat file usually have the same rpaths.
+        if rpath not in self.rpaths:
+            self.rpaths.append(rpath)
 
     def parse_load_dylib(self, content):
         """Parse load dylib from the given content.
@@ -410,4 +1634,162 @@ class MachO(object):
             content (bytes): Part of the Mach-O file content that contain the
                 load dylib to parse.
         """
-        self.load_dylibs.append(self.decode_str(content[16:]))
+        dylib = self.decode_str(content[16:])
+        if dylib not in self.load_dylibs:
+            self.load_dylibs.append(dylib)
+
+    def _get_arch_patches(self, content, offset, dylib_id, changes, rpaths):
+        """Get the bytes to write for the edits of one architecture.
+
+        Args:
+            content (memoryview): The MachO file content.
+            offset (int): The offset of the architecture.
+            dylib_id (str): The ID to change to.
+            changes (dict): The new load dylib paths keyed by the old paths.
+            rpaths (:obj:`list` of :obj:`str`): The rpaths to add.
+
+        Returns:
+            tuple: A list of tuples of the file offset and the bytes to write,
+                None if the padding runs out. And whether the architecture has
+                a code signature.
+        """
+        magic_number = bytes(content[offset:offset + 4])
+        is_64 = magic_number == b"\xcf\xfa\xed\xfe"
+        header_size = 32 if is_64 else 28
+        align = 8 if is_64 else 4
+        load_cmd_count, commands_size = struct.unpack_from(
+            "<2I", content, offset + 16)
+        # The load commands can grow until the first section content.
+        limit = len(content) - offset
+        commands = []
+        existing_rpaths = []
+        signed = False
+        feed = offset + header_size
+        for _ in range(load_cmd_count):
+            cmd, size = struct.unpack_from("<2I", content, feed)
+            command = bytes(content[feed:feed + size])
+            feed += size
+            if cmd in [self.LC_SEGMENT, self.LC_SEGMENT_64]:
+                limit = min(limit, self._get_segment_data_offset(command))
+            elif cmd == self.LC_CODE_SIGNATURE:
+                signed = True
+            elif cmd == self.LC_RPATH:
+                existing_rpaths.append(self.decode_str(command[12:]))
+            elif cmd in self.DYLIB_COMMANDS:
+                old_name = self.decode_str(command[24:])
+                if cmd == self.LC_ID_DYLIB:
+                    name = dylib_id or old_name
+                else:
+                    name = changes.get(old_name, old_name)
+                if name != old_name:
+                    command = self._pack_command(command[:24], name, align)
+            commands.append(command)
+        for rpath in rpaths:
+            if rpath not in existing_rpaths:
+                commands.append(self._pack_command(
+                    struct.pack("<3I", self.LC_RPATH, 0, 12), rpath, align))
+        new_commands = b"".join(commands)
+        if header_size + len(new_commands) > limit:
+            return None, signed
+        header = struct.pack("<2I", len(commands), len(new_commands))
+        # Clear the tail of the old load commands if the new ones are shorter.
+        new_commands = new_commands.ljust(commands_size, b"\x00")
+        return [
+            (offset + 16, header), (offset + header_size, new_commands),
+        ], signed
+
+    @staticmethod
+    def _get_segment_data_offset(command):
+        """Get the offset of the first content of the segment in the file.
+
+        Args:
+            command (bytes): The LC_SEGMENT or LC_SEGMENT_64 load command.
+
+        Returns:
+            int: The offset relative to the architecture. A big number if the
+                segment has no content.
+        """
+        no_content = 2 ** 64
+        if struct.unpack_from("<I", command)[0] == MachO.LC_SEGMENT_64:
+            fileoff, filesize = struct.unpack_from("<2Q", command, 40)
+            section_count = struct.unpack_from("<I", command, 64)[0]
+            header_size, section_size, offset_field = 72, 80, 48
+        else:
+            fileoff, filesize = struct.unpack_from("<2I", command, 32)
+            section_count = struct.unpack_from("<I", command, 48)[0]
+            header_size, section_size, offset_field = 56, 68, 40
+        result = fileoff if fileoff and filesize else no_content
+        for index in range(section_count):
+            section_offset = struct.unpack_from(
+                "<I", command,
+                header_size + index * section_size + offset_field)[0]
+            # The zero fill sections have no content in the file.
+            if section_offset:
+                result = min(result, section_offset)
+        return result
+
+    @staticmethod
+    def _pack_command(head, name, align):
+        """Pack the load command with the name at the end.
+
+        Args:
+            head (bytes): The fixed fields of the command, begin with the cmd
+                and the cmdsize.
+            name (str): The name to put after the fixed fields.
+            align (int): The alignment of the command size.
+
+        Returns:
+            bytes: The load command.
+        """
+        data = head + name.encode("utf-8") + b"\x00"
+        data += b"\x00" * (-len(data) % align)
+        return head[:4] + struct.pack("<I", len(data)) + data[8:]
+
+    def _resolve_dylib(self, macho, dylib):
+        """Resolve the load path of the dylib to an existing file.
+
+        Args:
+            macho (MachO): The Mach-O file loading the dylib.
+            dylib (str): The load path of the dylib.
+
+        Returns:
+            str: The file path of the dylib. Empty if not found.
+        """
+        loader_dir = os.path.dirname(macho.path)
+        executable_dir = os.path.dirname(self.path)
+        candidates = [dylib]
+        if dylib.startswith("@rpath/"):
+            candidates = [
+                os.path.join(rpath, dylib[len("@rpath/"):])
+                for rpath in macho.rpaths]
+        for candidate in candidates:
+            candidate = candidate.replace(
+                "@loader_path", loader_dir).replace(
+                "@executable_path", executable_dir)
+            if os.path.isabs(candidate) and os.path.isfile(candidate):
+                return candidate
+        return ""
+
+    def _run_install_name_tool(self, dylib_id, changes, rpaths):
+        """Apply all the edits by one `install_name_tool` call.
+
+        Args:
+            dylib_id (str): The ID to change to.
+            changes (dict): The new load dylib paths keyed by the old paths.
+            rpaths (:obj:`list` of :obj:`str`): The rpaths to add.
+
+        Raises:
+            UnsupportedError: When `install_name_tool` is not available.
+        """
+        if not shutil.which("install_name_tool"):
+            raise UnsupportedError(
+                f"Not enough header padding to edit {self.path} and "
+                f"install_name_tool is not available.")
+        cmd = ["install_name_tool"]
+        if dylib_id:
+            cmd.extend(["-id", dylib_id])
+        for old_path, new_path in changes.items():
+            cmd.extend(["-change", old_path, new_path])
+        for rpath in rpaths:
+            cmd.extend(["-add_rpath", rpath])
+        subprocess.run(cmd + [self.path], check=True)
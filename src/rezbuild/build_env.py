@@ -0,0 +1,370 @@
+"""Pool of the reusable isolated environments to build the wheels.
+
+Creating a venv and installing the build requirements is the slowest part of
+building a small python package. The pool keeps the prepared environments
+keyed on the `build-system.requires` and the python interpreter:
+
+pool_root/
+└── <key>/
+    └── <slot>/
+        ├── env/
+        ├── lock
+        └── meta.json
+
+Each environment slot is used by one build at a time, which is guaranteed by
+an exclusive lock on the `lock` file. Concurrent builds with the same key get
+different slots. `meta.json` is written after the environment is prepared and
+records the interpreter identity and the installed distributions. A slot is
+recreated if it is incomplete, too old, the interpreter changed or a build
+installed or removed distributions in it.
+
+venv and pip run without `PYTHONPATH`, `PYTHONHOME`, the user site and the
+`PIP_*` variables, so the contents of a slot only depend on the key.
+"""
+
+# Import built-in modules
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import time
+
+# Import local modules
+from rezbuild.compiler_cache import get_compiler_id
+from rezbuild.exceptions import BuildEnvError
+from rezbuild.exceptions import UnsupportedError
+from rezbuild.utils import remove_tree
+
+# The requirements of the build backend when pyproject.toml does not specify,
+# same as PEP 517 and pyproject-build.
+DEFAULT_BUILD_REQUIRES = ["setuptools >= 40.8.0", "wheel"]
+
+# Check the requirements the build backend asks for, exit with
+# MISSING_REQUIRES_CODE if any of them is not installed.
+CHECK_REQUIRES_SCRIPT = """import sys
+import build
+builder = build.ProjectBuilder(sys.argv[1])
+sys.exit(3 if builder.check_dependencies("wheel") else 0)
+"""
+MISSING_REQUIRES_CODE = 3
+
+
+class BuildEnvPool(object):
+    """Check out and return the prepared build environments."""
+
+    def __init__(self, root, python, max_age=0):
+        """Initialize the pool.
+
+        Args:
+            root (str): The root directory of the pool.
+            python (str): The python interpreter to create the environments.
+            max_age (int, optional): The seconds after that an environment is
+                recreated, so the unpinned requirements get updated. Never
+                expire if it is 0. Default is 0.
+        """
+        self.root = root
+        self.python = python
+        self.max_age = max_age
+
+    @contextlib.contextmanager
+    def checkout(self, requires):
+        """Check out an environment with the requirements installed.
+
+        The environment is locked until the context exits. Environments
+        changed during the context are recreated at the next checkout.
+
+        Args:
+            requires (:obj:`list` of :obj:`str`): The build requirements.
+
+        Yields:
+            str: The python executable of the environment.
+
+        Raises:
+            BuildEnvError: When failed to prepare the environment.
+        """
+        key = self.get_key(requires)
+        key_root = os.path.join(self.root, key)
+        os.makedirs(key_root, exist_ok=True)
+        index = 0
+        while True:
+            slot = os.path.join(key_root, str(index))
+            os.makedirs(slot, exist_ok=True)
+            lock_file = open(os.path.join(slot, "lock"), "a")
+            if _try_lock(lock_file):
+                break
+            lock_file.close()
+            index += 1
+        try:
+            python = self.prepare(slot, requires)
+            yield python
+            meta = self.read_meta(slot)
+            meta_path = os.path.join(slot, "meta.json")
+            if meta.get("installed") != self.get_installed(slot):
+                logging.getLogger(__name__).debug(
+                    f"Build environment {slot} changed, discard it.")
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+            else:
+                os.utime(meta_path, None)
+        finally:
+            _unlock(lock_file)
+            lock_file.close()
+
+    @staticmethod
+    def get_clean_env():
+        """Get the environment variables to prepare the environments in.
+
+        The variables that make pip find or install the distributions outside
+        the environment are removed.
+
+        Returns:
+            dict: The environment variables.
+        """
+        env = {
+            name: value for name, value in os.environ.items()
+            if name not in ["PYTHONHOME", "PYTHONPATH", "PYTHONUSERBASE"]
+            and not name.startswith("PIP_")}
+        env["PYTHONNOUSERSITE"] = "1"
+        return env
+
+    @staticmethod
+    def get_env_python(slot):
+        """Get the python executable of the environment in the slot.
+
+        Args:
+            slot (str): The slot directory.
+
+        Returns:
+            str: The python executable path.
+        """
+        if platform.system() == "Windows":
+            return os.path.join(slot, "env", "Scripts", "python.exe")
+        return os.path.join(slot, "env", "bin", "python")
+
+    @staticmethod
+    def get_installed(slot):
+        """Get the distributions installed in the environment.
+
+        Args:
+            slot (str): The slot directory.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The sorted names of the dist-info
+                directories.
+        """
+        installed = []
+        for root, dirs, _ in os.walk(os.path.join(slot, "env")):
+            if os.path.basename(root) == "site-packages":
+                installed.extend(
+                    dir_ for dir_ in dirs if dir_.endswith(".dist-info"))
+                dirs[:] = []
+        return sorted(installed)
+
+    def get_key(self, requires):
+        """Get the pool key of the requirements and the interpreter.
+
+        Args:
+            requires (:obj:`list` of :obj:`str`): The build requirements.
+
+        Returns:
+            str: The key.
+        """
+        hasher = hashlib.sha256()
+        hasher.update(os.path.realpath(self.python).encode("utf-8"))
+        for require in sorted(
+                re.sub(r"\s+", "", require) for require in requires):
+            hasher.update(b"\x00" + require.encode("utf-8"))
+        return hasher.hexdigest()[:32]
+
+    @staticmethod
+    def has_build_requires(python, source_root, env=None):
+        """Check whether the requirements the backend asks for are installed.
+
+        The static `build-system.requires` are installed by the pool, but the
+        backend may ask for more, like setuptools asks for wheel.
+
+        Args:
+            python (str): The python executable of the environment.
+            source_root (str): The source root to build.
+            env (dict, optional): The environment variables.
+
+        Returns:
+            bool: True if all the requirements are installed.
+
+        Raises:
+            BuildEnvError: When failed to ask the backend.
+        """
+        # Not run in the source root, or the `build.py` of the rez package
+        # will shadow the build module.
+        result = subprocess.run(
+            [python, "-c", CHECK_REQUIRES_SCRIPT, source_root],
+            cwd=os.path.dirname(python), env=env)
+        if result.returncode not in [0, MISSING_REQUIRES_CODE]:
+            raise BuildEnvError(
+                f"Failed to get the build requirements of {source_root}.")
+        return result.returncode == 0
+
+    def is_fresh(self, slot):
+        """Check whether the environment in the slot can be reused.
+
+        Args:
+            slot (str): The slot directory.
+
+        Returns:
+            bool: True if the environment is complete and up to date.
+        """
+        meta = self.read_meta(slot)
+        if not meta or not os.path.isfile(self.get_env_python(slot)):
+            return False
+        if meta.get("python") != get_compiler_id(self.python):
+            return False
+        if self.max_age and time.time() - meta.get("created", 0) > (
+                self.max_age):
+            return False
+        return True
+
+    def prepare(self, slot, requires):
+        """Create the environment in the slot if it can't be reused.
+
+        Args:
+            slot (str): The locked slot directory.
+            requires (:obj:`list` of :obj:`str`): The build requirements.
+
+        Returns:
+            str: The python executable of the environment.
+
+        Raises:
+            BuildEnvError: When failed to create the environment or install
+                the requirements.
+        """
+        python = self.get_env_python(slot)
+        if self.is_fresh(slot):
+            print(f"\nReuse build environment: {slot}")
+            return python
+        meta_path = os.path.join(slot, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        env_path = os.path.join(slot, "env")
+        if os.path.exists(env_path):
+            remove_tree(env_path)
+        print(f"\nCreate build environment: {slot}")
+        env = self.get_clean_env()
+        try:
+            subprocess.run(
+                [self.python, "-m", "venv", env_path], check=True, env=env)
+            subprocess.run(
+                [python, "-m", "pip", "install",
+                 "--disable-pip-version-check", "build"] + list(requires),
+                check=True, env=env)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise BuildEnvError(
+                f"Failed to prepare the build environment {slot}: {e}")
+        with open(meta_path, "w") as file:
+            json.dump({
+                "created": time.time(),
+                "installed": self.get_installed(slot),
+                "python": get_compiler_id(self.python),
+                "requires": list(requires),
+            }, file)
+        return python
+
+    @staticmethod
+    def read_meta(slot):
+        """Read the meta data of the slot.
+
+        Args:
+            slot (str): The slot directory.
+
+        Returns:
+            dict: The meta data. Empty if the slot is not prepared.
+        """
+        try:
+            with open(os.path.join(slot, "meta.json")) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+def read_build_requires(source_root):
+    """Read the `build-system.requires` from the pyproject.toml.
+
+    Args:
+        source_root (str): The source root.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The build requirements.
+
+    Raises:
+        UnsupportedError: When no toml parser available, neither `tomllib`,
+            `tomli` nor `toml`.
+    """
+    path = os.path.join(source_root, "pyproject.toml")
+    if not os.path.isfile(path):
+        return list(DEFAULT_BUILD_REQUIRES)
+    with open(path, encoding="utf-8") as file:
+        content = file.read()
+    try:
+        # Import built-in modules
+        import tomllib as toml
+    except ImportError:
+        try:
+            # Import third-party modules
+            import tomli as toml
+        except ImportError:
+            try:
+                # Import third-party modules
+                import toml
+            except ImportError:
+                raise UnsupportedError(
+                    f"Can't read {path}, install tomli to parse it.")
+    build_system = toml.loads(content).get("build-system", {})
+    return list(build_system.get("requires", DEFAULT_BUILD_REQUIRES))
+
+
+def _try_lock(file):
+    """Lock the file exclusively without blocking.
+
+    Args:
+        file (file): The opened file to lock.
+
+    Returns:
+        bool: True if locked.
+    """
+    try:
+        if platform.system() == "Windows":
+            # Import built-in modules
+            import msvcrt
+
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            # Import built-in modules
+            import fcntl
+
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(file):
+    """Unlock the file locked by _try_lock.
+
+    Args:
+        file (file): The locked file.
+    """
+    if platform.system() == "Windows":
+        # Import built-in modules
+        import msvcrt
+
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        # Import built-in modules
+        import fcntl
+
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -21,52 +21,300 @@ Rez builder help to build rez packages.
 
 # Import built-in modules
 import abc
+import contextlib
+import hashlib
+import json
 import logging
 import os
 import platform
-import re
 import shutil
 import stat
 import subprocess
+import sys
 import tarfile
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Import local modules
+from rezbuild.bin_utils import bundle_elfs
+from rezbuild.bin_utils import classify_file
+from rezbuild.bin_utils import get_windows_shebang
 from rezbuild.bin_utils import make_bin_movable
 from rezbuild.bin_utils import make_bins_movable
+from rezbuild.bin_utils import make_elfs_movable
+from rezbuild.bin_utils import map_files
+from rezbuild.build_env import BuildEnvPool
+from rezbuild.build_env import read_build_requires
+from rezbuild.cache import DirectoryCache
+from rezbuild.checksum import VerifiedHashCache
+from rezbuild.checksum import get_expected_hashes
+from rezbuild.checksum import verify_file
+from rezbuild.compiler_cache import CompilerCache
+from rezbuild.compiler_cache import get_compiler_id
+from rezbuild.constants import CONFIGURE_ENV_VARS
+from rezbuild.constants import DEFAULT_BUILD_CACHE_SIZE
+from rezbuild.constants import DEFAULT_BUILD_ENV_MAX_AGE
+from rezbuild.constants import DEFAULT_COMPILER_CACHE_SIZE
+from rezbuild.constants import DEFAULT_DOWNLOAD_WORKERS
+from rezbuild.constants import DEFAULT_PYPI_CACHE_SIZE
+from rezbuild.constants import DEFAULT_PYPI_URL
+from rezbuild.constants import DEFAULT_WHEEL_CACHE_SIZE
+from rezbuild.constants import FILE_PE
+from rezbuild.constants import FILE_SCRIPT
+from rezbuild.constants import INSTALL_COPY
+from rezbuild.constants import PARALLEL_UNZIP_SIZE
 from rezbuild.constants import SHELL_CONTENT
+from rezbuild.constants import WHEEL_CACHE_IGNORE_NAMES
 from rezbuild.exceptions import ArgumentError
+from rezbuild.exceptions import BuildEnvError
+from rezbuild.exceptions import ChecksumError
+from rezbuild.exceptions import FileAlreadyExistError
 from rezbuild.exceptions import InstallerNotFoundError
+from rezbuild.exceptions import MakeMovableError
 from rezbuild.exceptions import NotFoundPythonInBinError
 from rezbuild.exceptions import ReNotMatchError
 from rezbuild.exceptions import UnsupportedError
+from rezbuild.installer_index import InstallerIndex
+from rezbuild.jobserver import JobServer
+from rezbuild.pypi import SimpleIndex
+from rezbuild.pypi import get_supported_tags
+from rezbuild.pypi import match_files
+from rezbuild.pypi import select_files
+from rezbuild.stages import SharedStages
 from rezbuild.utils import clear_path
 from rezbuild.utils import copy_tree
+from rezbuild.utils import get_cpu_count
 from rezbuild.utils import get_delimiter
+from rezbuild.utils import get_git_revision
+from rezbuild.utils import get_workers
+from rezbuild.utils import hash_file
+from rezbuild.utils import hash_tree
+from rezbuild.utils import install_tree
+from rezbuild.utils import list_source_files
+from rezbuild.utils import normalize_member_name
+from rezbuild.utils import parse_size
 from rezbuild.utils import remove_tree
+from rezbuild.utils import snapshot_tree
+from rezbuild.wheel import install_wheel
 
 
 class RezBuilder(abc.ABC):
     """The basic class of RezBuild."""
 
-    def __init__(self, **kwargs):
-        """Initialize builder."""
-        self.build_path = os.environ["REZ_BUILD_PATH"]
-        self.install_path = os.environ["REZ_BUILD_INSTALL_PATH"]
+    def __init__(
+            self, cache_root=None, cache_size=None, install_strategy=None,
+            install_hash=None, build_path=None, install_path=None,
+            variant_index=None, shared_stages=None, env=None, **kwargs):
+        """Initialize builder.
+
+        Args:
+            cache_root (str, optional): The root directory of the rezbuild
+                caches. Get from the `REZBUILD_CACHE_ROOT` environment variable
+                if not given. The build cache is disabled if both are empty.
+            cache_size (str or int, optional): The size limit of the build
+                cache, like `10G`. Get from the `REZBUILD_BUILD_CACHE_SIZE`
+                environment variable if not given. Default is 10G.
+            install_strategy (str, optional): How to install the workspace
+                into the install path. One of `copy`, `hardlink`,
+                `incremental`, `reflink` and `move`. Get from the
+                `REZBUILD_INSTALL_STRATEGY` environment variable if not given.
+                Default is `copy`.
+            install_hash (bool, optional): Whether to compare the file content
+                by hash in the `incremental` install strategy. Get from the
+                `REZBUILD_INSTALL_HASH` environment variable if not given.
+                Default is True, as the workspace is recreated every build.
+            build_path (str, optional): The build path of the variant. Get
+                from the `REZ_BUILD_PATH` environment variable if not given.
+            install_path (str, optional): The install path of the variant. Get
+                from the `REZ_BUILD_INSTALL_PATH` environment variable if not
+                given.
+            variant_index (str, optional): The index of the variant. Get from
+                the `REZ_BUILD_VARIANT_INDEX` environment variable if not
+                given.
+            shared_stages (SharedStages, optional): The stages shared with
+                the builders of the other variants. Default is not to share.
+            env (dict, optional): The resolved environment variables of the
+                variant, used to find the python interpreter and to run the
+                compilers and the python build tools. Default is the current
+                environment.
+        """
+        self.build_path = build_path or os.environ["REZ_BUILD_PATH"]
+        self.install_path = install_path or os.environ[
+            "REZ_BUILD_INSTALL_PATH"]
         self.name = os.environ["REZ_BUILD_PROJECT_NAME"]
         self.version = os.environ["REZ_BUILD_PROJECT_VERSION"]
         self.source_path = os.environ["REZ_BUILD_SOURCE_PATH"]
-        self.variant_index = os.environ["REZ_BUILD_VARIANT_INDEX"]
+        if variant_index is None:
+            variant_index = os.environ["REZ_BUILD_VARIANT_INDEX"]
+        self.variant_index = str(variant_index)
+        self.shared_stages = shared_stages
+        self.env = dict(os.environ if env is None else env)
         self.workspace = os.path.join(self.build_path, "workspace")
+        self.cache_root = cache_root or os.getenv("REZBUILD_CACHE_ROOT", "")
+        self.cache_size = parse_size(
+            cache_size or os.getenv(
+                "REZBUILD_BUILD_CACHE_SIZE", DEFAULT_BUILD_CACHE_SIZE))
+        self.install_strategy = install_strategy or os.getenv(
+            "REZBUILD_INSTALL_STRATEGY", INSTALL_COPY)
+        if install_hash is None:
+            install_hash = os.getenv("REZBUILD_INSTALL_HASH", "1") == "1"
+        self.install_hash = install_hash
         super().__init__(**kwargs)
 
     def build(self, **kwargs):
-        """Build the package."""
+        """Build the package.
+
+        If the build cache is enabled and the inputs of the build are unchanged
+        since a previous build, restore the workspace from the cache instead of
+        running `custom_build`.
+        """
         self.create_work_dir()
-        self.custom_build(**kwargs)
+        cache = self.get_build_cache()
+        key = ""
+        if cache and self.is_build_cacheable(**kwargs):
+            key = self.get_build_cache_key(**kwargs)
+        if key and cache.restore(key, self.workspace):
+            logging.getLogger(__name__).info(
+                f"Build cache hit, restore workspace from {key}.")
+        else:
+            self.custom_build(**kwargs)
+            if key:
+                cache.store(key, self.workspace)
         self.install()
 
+    @classmethod
+    def build_variants(
+            cls, variants, workers=None, builder_kwargs=None, **kwargs):
+        """Build the variants concurrently in this process.
+
+        Each variant is built by its own builder, with its own workspace and
+        install path. The variant independent stages, like creating the same
+        wheel or extracting the same archives, run once and are shared by the
+        variants with the same environment, see `run_shared_stage`.
+
+        The variants are built in the current environment unless the `env`
+        of the variant is given. The variants with different requirements,
+        like different python versions, must give their own resolved
+        environments, or they are all built by the current interpreter.
+
+        Args:
+            variants (:obj:`list` of :obj:`dict`): The variants to build. Each
+                item contains the `variant_index`, `build_path` and
+                `install_path` of a variant, and optionally the resolved
+                environment variables of the variant as `env`.
+            workers (int, optional): The number of the variants to build at
+                the same time. Get from the `REZBUILD_VARIANT_WORKERS`
+                environment variable if not given. Default is the cpu count.
+            builder_kwargs (dict, optional): The key word arguments to create
+                the builders.
+            kwargs: The key word arguments to pass to the build method.
+
+        Returns:
+            :obj:`list` of :obj:`RezBuilder`: The builders of the variants.
+        """
+        shared_stages = SharedStages()
+        workers = get_workers(
+            workers, "REZBUILD_VARIANT_WORKERS", get_cpu_count())
+
+        def build_variant(variant):
+            builder = cls(
+                shared_stages=shared_stages, **dict(
+                    builder_kwargs or {}, **variant))
+            builder.build(**kwargs)
+            return builder
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(build_variant, variant)
+                for variant in variants]
+        return [future.result() for future in futures]
+
+    def get_build_cache(self):
+        """Get the build cache.
+
+        Returns:
+            DirectoryCache: The build cache. None if the cache is disabled.
+        """
+        if not self.cache_root:
+            return None
+        return DirectoryCache(
+            os.path.join(self.cache_root, "build"), self.cache_size)
+
+    def get_build_cache_inputs(self):
+        """Get the paths that the build result depends on.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The file or directory paths.
+        """
+        return [self.source_path]
+
+    def get_build_cache_key(self, **kwargs):
+        """Get the build cache key from the fingerprint of the build inputs.
+
+        The fingerprint include the content of the input paths, the builder
+        class, the variant index, the custom build arguments, and the build
+        and install paths as the outputs may embed them. The build path is
+        excluded from the inputs as it is usually placed under the source path.
+
+        Args:
+            kwargs: The key word arguments to pass to the custom_build method.
+
+        Returns:
+            str: The cache key.
+        """
+        hasher = hashlib.sha256()
+        cls = self.__class__
+        for value in [
+                f"{cls.__module__}.{cls.__qualname__}", self.variant_index,
+                os.path.abspath(self.build_path),
+                os.path.abspath(self.install_path),
+                json.dumps(kwargs, sort_keys=True, default=repr)]:
+            hasher.update(value.encode("utf-8") + b"\x00")
+        for path in self.get_build_cache_inputs():
+            hash_tree(path, hasher, excludes=[self.build_path])
+        return hasher.hexdigest()
+
+    def is_build_cacheable(self, **kwargs):
+        """Check whether the build result can be cached.
+
+        Only the workspace is stored in the build cache, so a build writing
+        outside the workspace must not be restored from it.
+
+        Args:
+            kwargs: The key word arguments to pass to the custom_build method.
+
+        Returns:
+            bool: True if the build result is all in the workspace.
+        """
+        return True
+
+    def get_environment_key(self):
+        """Get the fingerprint of the interpreter and the variant environment.
+
+        The `REZ_BUILD_*` variables are left out as they differ between the
+        variants even in the same environment.
+
+        Returns:
+            str: The fingerprint.
+        """
+        hasher = hashlib.sha256()
+        hasher.update(get_compiler_id(self.get_python()).encode("utf-8"))
+        for name, value in sorted(self.env.items()):
+            if not name.startswith("REZ_BUILD_"):
+                hasher.update(f"\x00{name}={value}".encode("utf-8"))
+        return hasher.hexdigest()
+
+    def get_python(self):
+        """Get the python interpreter of the variant environment.
+
+        Returns:
+            str: The path of the python interpreter. The interpreter of this
+                process if not found in the `PATH` of the environment.
+        """
+        return shutil.which(
+            "python", path=self.env.get("PATH")) or sys.executable
+
     def create_work_dir(self):
         """Create the work directory.
 
@@ -87,25 +335,69 @@ class RezBuilder(abc.ABC):
             "This method does not implemented by the invoker.")
 
     def install(self):
-        """Copy files from work directory to self.install_path."""
+        """Install files from work directory to self.install_path.
+
+        The files are installed by `self.install_strategy`. Unsupported
+        strategy falls back to copy.
+
+        Returns:
+            tuple: The install strategy actually used and the statistics of
+                the `incremental` strategy, see `utils.sync_tree`. Empty
+                string and None if not installed.
+        """
         if os.environ.get("REZ_BUILD_INSTALL") == "1":
-            if os.path.exists(self.install_path):
-                remove_tree(self.install_path)
-            shutil.copytree(self.workspace, self.install_path, symlinks=True)
+            strategy, stats = install_tree(
+                self.workspace, self.install_path, self.install_strategy,
+                use_hash=self.install_hash)
+            logging.getLogger(__name__).info(
+                f"Installed {self.install_path} by {strategy}.")
+            return strategy, stats
+        return "", None
+
+    def run_shared_stage(self, key, function, *args, **kwargs):
+        """Run the stage once for all the variants built together.
+
+        Run the function directly if the builder does not share stages. The
+        key is extended by `get_environment_key`, so the variants with
+        different interpreters or environments never share the results.
+
+        Args:
+            key (tuple): The key of the stage. Should contain everything that
+                changes the stage result.
+            function (callable): The stage function.
+            args: The arguments to pass to the function.
+            kwargs: The key word arguments to pass to the function.
+
+        Returns:
+            The result of the stage.
+        """
+        if self.shared_stages is None:
+            return function(*args, **kwargs)
+        key = (self.get_environment_key(),) + tuple(key)
+        return self.shared_stages.run(key, function, *args, **kwargs)
 
 
 class CopyBuilder(RezBuilder):
     """Copy all files into package root."""
 
-    def custom_build(self, root=""):
+    def custom_build(self, root="", snapshot=False, includes=None):
         """Copy files to workspace.
 
         Args:
             root (str): The source path to copy files from. Default is
                 `src` folder under the source path.
+            snapshot (bool, optional): Whether to copy only the files tracked
+                or not ignored by git, like `__pycache__` and the editor
+                backups are skipped. Default is False.
+            includes (:obj:`list` of :obj:`str`, optional): Gitignore style
+                patterns of the files to copy in the snapshot mode, instead of
+                the git rules.
         """
         root = root or os.path.join(self.source_path, "src")
-        copy_tree(root, self.workspace, dirs_exist_ok=True)
+        if snapshot or includes:
+            snapshot_tree(root, self.workspace, includes=includes, link=False)
+        else:
+            copy_tree(root, self.workspace, dirs_exist_ok=True)
 
 
 class InstallBuilder(RezBuilder, abc.ABC):
@@ -116,16 +408,41 @@ class InstallBuilder(RezBuilder, abc.ABC):
     LOCAL = 0
     PYPI = 1
 
-    def __init__(self, mode=None, **kwargs):
+    def __init__(
+            self, mode=None, index_url=None, pypi_cache_size=None,
+            verify_installers=None, **kwargs):
         """Initialize the builder.
 
         Args:
             mode (int): The installer search mode to set.
                 InstallerBuilder.LOCAL -- 0
                 InstallerBuilder.PYPI -- 1
+            index_url (str, optional): The URL of the PEP 503 simple
+                repository to search the installers in the PYPI mode. Get from
+                the `REZBUILD_PYPI_URL` environment variable if not given.
+                Default is `https://pypi.org/simple`.
+            pypi_cache_size (str or int, optional): The size limit of the
+                download cache, like `5G`. Get from the
+                `REZBUILD_PYPI_CACHE_SIZE` environment variable if not given.
+                Default is 5G. The download cache is placed under the cache
+                root and disabled if the cache root is not set.
+            verify_installers (bool, optional): Whether to verify the local
+                installers by the checksums in the manifest or the sidecar
+                files. Get from the `REZBUILD_VERIFY_INSTALLERS` environment
+                variable if not given. Default is False.
         """
         self._search_mode = None
         self._init_search_mode(mode)
+        self.index_url = index_url or os.getenv(
+            "REZBUILD_PYPI_URL", DEFAULT_PYPI_URL)
+        self.pypi_cache_size = parse_size(
+            pypi_cache_size or os.getenv(
+                "REZBUILD_PYPI_CACHE_SIZE", DEFAULT_PYPI_CACHE_SIZE))
+        self._pypi_files = {}
+        self._pypi_installers = {}
+        if verify_installers is None:
+            verify_installers = os.getenv("REZBUILD_VERIFY_INSTALLERS") == "1"
+        self.verify_installers = verify_installers
         super().__init__(**kwargs)
 
     def _init_search_mode(self, mode):
@@ -150,9 +467,55 @@ class InstallBuilder(RezBuilder, abc.ABC):
         else:
             raise ArgumentError(f"Mode {self._search_mode} unsupported.")
 
+    def get_build_cache_inputs(self):
+        """Add the local installers of this variant to the build inputs.
+
+        The installers from the simple repository are keyed by their index
+        entries instead, see `get_build_cache_key`.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The file or directory paths.
+        """
+        inputs = super().get_build_cache_inputs()
+        if self._search_mode == self.__class__.PYPI:
+            return inputs
+        return inputs + self.get_installers()
+
+    def get_build_cache_key(self, **kwargs):
+        """Add the pinned index entries of the installers to the cache key.
+
+        In `InstallerBuilder.PYPI` mode, the file names and the hashes in the
+        simple repository fingerprint the installers, so nothing is
+        downloaded to get the key. The installers are downloaded to be hashed
+        only if the index does not provide their hashes.
+
+        Args:
+            kwargs: The key word arguments to pass to the custom_build method.
+
+        Returns:
+            str: The cache key.
+        """
+        key = super().get_build_cache_key(**kwargs)
+        if self._search_mode != self.__class__.PYPI:
+            return key
+        hasher = hashlib.sha256(key.encode("utf-8"))
+        files = self.get_pypi_files()
+        if all(file["hashes"] for file in files):
+            for file in sorted(files, key=lambda file: file["filename"]):
+                hasher.update(file["filename"].encode("utf-8") + b"\x00")
+                for name, value in sorted(file["hashes"].items()):
+                    hasher.update(f"{name}={value}".encode("utf-8") + b"\x00")
+        else:
+            for path in self.get_pypi_installers():
+                hash_tree(path, hasher)
+        return hasher.hexdigest()
+
     def get_installers(self, local_path=None, regex=None):
         """Get installers.
 
+        In `InstallerBuilder.PYPI` mode, the installers are downloaded from
+        the simple repository. See `get_pypi_installers`.
+
         In `InstallerBuilder.LOCAL` mode, the default place is a folder named
         "installers" under the source root. You can put the installers into the
         installers folder, or if the different variant has different installer,
@@ -183,38 +546,55 @@ class InstallBuilder(RezBuilder, abc.ABC):
             local_path (str): The directory where the installers placed.
                 This will be used when the installer_search_mode is
                 `InstallerBuilder.LOCAL`.
-            regex (str): The regex string to match the installer name.
+            regex (str or :obj:`list` of :obj:`str`): The regex string to
+                match the installer name. The installers match any of the
+                regex strings are returned if a list is given.
+
+        If `verify_installers` is True, the local installers are verified by
+        the checksums before returned, and the checksum sidecar files are not
+        returned. See `verify_installer_files`.
 
         Returns:
-            :obj:`list` of :obj:`str`: All the paths of the installers.
+            :obj:`list` of :obj:`str`: All the paths of the installers, sorted
+                by the file name.
 
         Raises:
             ArgumentError: When the installer search mode does not support.
+            ChecksumError: When any of the installers is corrupt.
         """
-        regex = regex or r".*"
-        exclude_files = [".DS_Store"]
         if self._search_mode == self.__class__.LOCAL:
-            if local_path:
-                path = os.path.join(local_path, self.variant_index)
-            else:
-                path = os.path.join(
-                    self.source_path, "installers", self.variant_index)
-            if not os.path.isdir(path):
-                path = os.path.join(self.source_path, "installers")
-            files = []
-            for filename in os.listdir(path):
-                if filename in exclude_files:
-                    continue
-                filepath = os.path.join(path, filename)
-                if os.path.isfile(filepath) and re.match(regex, filename):
-                    files.append(filepath)
-            return files
+            index = self.get_installer_index(local_path)
+            # The checksum sidecar files are installers too if not verified.
+            installers = index.find(
+                regex, skip_checksums=self.verify_installers)
+            if self.verify_installers:
+                self.verify_installer_files(installers, index=index)
+            return installers
         elif self._search_mode == self.__class__.PYPI:
-            raise NotImplementedError(
-                "PyPI mode does not implemented in this version.")
+            return self.get_pypi_installers(regex)
         else:
             raise ArgumentError(f"Mode {self._search_mode} unsupported.")
 
+    def get_installer_index(self, local_path=None):
+        """Get the index of the local installers of this variant.
+
+        The directory is scanned once and the index is reused until the
+        directory changes. The directory is never scanned if it contains an
+        `installers.json` manifest.
+
+        Args:
+            local_path (str): The directory where the installers placed.
+                Default is the `installers` folder under the source root.
+
+        Returns:
+            InstallerIndex: The index of the installers.
+        """
+        root = local_path or os.path.join(self.source_path, "installers")
+        path = os.path.join(root, self.variant_index)
+        if not os.path.isdir(path):
+            path = root
+        return InstallerIndex.get(path)
+
     def get_mode(self):
         """Return the current mode.
 
@@ -225,6 +605,94 @@ class InstallBuilder(RezBuilder, abc.ABC):
         """
         return self._search_mode
 
+    def get_pypi_files(self, regex=None):
+        """Get the index entries of the installers in the simple repository.
+
+        Without the regex, the installers are the source archives and the
+        wheel of the package version most compatible with the python
+        interpreter of the variant environment.
+
+        Args:
+            regex (str or :obj:`list` of :obj:`str`): The regex strings to
+                match the file names in the index, instead of matching the
+                package version.
+
+        Returns:
+            :obj:`list` of :obj:`dict`: The files from
+                `rezbuild.pypi.list_files`.
+
+        Raises:
+            DownloadError: When failed to get the index.
+            InstallerNotFoundError: When no installer found.
+        """
+        key = tuple([regex] if isinstance(regex, str) else regex or [])
+        if key not in self._pypi_files:
+            index = self.get_simple_index()
+            try:
+                files = index.list_files(self.name)
+            finally:
+                index.close()
+            if regex:
+                files = match_files(files, regex)
+            else:
+                files = select_files(
+                    files, self.name, self.version,
+                    get_supported_tags(self.get_python(), self.env))
+            if not files:
+                raise InstallerNotFoundError(
+                    f"No installer of {self.name} {self.version} found "
+                    f"in {self.index_url}.")
+            self._pypi_files[key] = files
+        return list(self._pypi_files[key])
+
+    def get_pypi_installers(self, regex=None):
+        """Download the installers of the package from the simple repository.
+
+        The installers are the files from `get_pypi_files`. The downloads run
+        concurrently and are verified by the hashes in the index. The
+        downloaded files are stored in the cache and reused by the later
+        builds.
+
+        Args:
+            regex (str or :obj:`list` of :obj:`str`): The regex strings to
+                match the file names in the index, instead of matching the
+                package version.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The local paths of the installers,
+                sorted by the file name.
+
+        Raises:
+            ChecksumError: When the downloaded file does not match the hash.
+            DownloadError: When failed to download the file.
+            InstallerNotFoundError: When no installer found.
+        """
+        key = tuple([regex] if isinstance(regex, str) else regex or [])
+        if key not in self._pypi_installers:
+            files = self.get_pypi_files(regex)
+            index = self.get_simple_index()
+            try:
+                self._pypi_installers[key] = sorted(
+                    index.download(files), key=os.path.basename)
+            finally:
+                index.close()
+        return list(self._pypi_installers[key])
+
+    def get_simple_index(self):
+        """Get the client of the simple repository.
+
+        Returns:
+            SimpleIndex: The client.
+        """
+        cache = None
+        if self.cache_root:
+            cache = DirectoryCache(
+                os.path.join(self.cache_root, "pypi"), self.pypi_cache_size)
+        return SimpleIndex(
+            self.index_url, os.path.join(self.build_path, "downloads"),
+            cache=cache, workers=get_workers(
+                None, "REZBUILD_DOWNLOAD_WORKERS", DEFAULT_DOWNLOAD_WORKERS))
+
     @classmethod
     def list_modes(cls):
         """List all the supported installer search modes.
@@ -232,7 +700,7 @@ class InstallBuilder(RezBuilder, abc.ABC):
         Returns:
             :obj:`list` of :obj:`int`: All supported installer search modes.
         """
-        return [cls.LOCAL]
+        return [cls.LOCAL, cls.PYPI]
 
     def set_search_mode(self, mode):
         """Set search mode.
@@ -250,6 +718,56 @@ class InstallBuilder(RezBuilder, abc.ABC):
         else:
             raise ArgumentError(f"Mode {self._search_mode} unsupported.")
 
+    def verify_installer_files(self, installers, index=None, workers=None):
+        """Verify the installers by the checksums concurrently.
+
+        The expected checksums are the `size` and the digests in the manifest
+        entries, or the sidecar files like `installer.zip.sha256` next to the
+        installers. The installers without checksum are skipped. The digests
+        are cached by the path, size, modification time and inode of the
+        installer, in the `checksums` folder under the cache root if it is
+        set, so an unchanged installer is hashed only once.
+
+        Args:
+            installers (:obj:`list` of :obj:`str`): The installer paths.
+            index (InstallerIndex, optional): The index of the installers, to
+                get the manifest entries.
+            workers (int, optional): The number of the hash threads. Get from
+                the `REZBUILD_HASH_WORKERS` environment variable if not given.
+                Default is the cpu count.
+
+        Raises:
+            ChecksumError: When any of the installers is corrupt. The message
+                lists all the corrupt installers.
+        """
+        cache = VerifiedHashCache(
+            os.path.join(self.cache_root, "checksums")
+            if self.cache_root else None)
+
+        def verify(installer):
+            entry = index.get_entry(os.path.basename(installer)) if (
+                index) else {}
+            try:
+                expected = get_expected_hashes(installer, entry)
+                if not expected:
+                    logging.getLogger(__name__).debug(
+                        f"No checksum of {installer}, skip verification.")
+                    return None
+                verify_file(
+                    installer, expected, size=entry.get("size"), cache=cache)
+            except ChecksumError as e:
+                return str(e)
+            return None
+
+        workers = get_workers(
+            workers, "REZBUILD_HASH_WORKERS", get_cpu_count())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = [
+                error for error in executor.map(verify, installers) if error]
+        if errors:
+            raise ChecksumError(
+                "Corrupt installers found:\n" + "\n".join(errors))
+
 
 class WindowsBuilder(RezBuilder, abc.ABC):
     """Base windows builder."""
@@ -292,35 +810,304 @@ class MsiBuilder(WindowsBuilder, InstallBuilder):
 class ExtractBuilder(InstallBuilder):
     """Build package from the archive file."""
 
-    def extract(self, extract_path, installer_regex=None):
+    @staticmethod
+    def check_conflicts(
+            extract_path, members, dirs_exist_ok=True, file_overwrite=True):
+        """Check whether the archive members conflict with the existing files.
+
+        Args:
+            extract_path (str): The path to extract to.
+            members (:obj:`list` of :obj:`tuple`): Each item is a tuple of the
+                member name and whether the member is a directory.
+            dirs_exist_ok (bool): Whether to merge into the existing top level
+                directories. Default is True.
+            file_overwrite (bool): Whether to overwrite the existing files.
+                Default is True.
+
+        Raises:
+            FileAlreadyExistError: When the member conflicts.
+        """
+        if dirs_exist_ok and file_overwrite:
+            return
+        top_dirs = set()
+        for name, is_dir in members:
+            parts = normalize_member_name(name).split("/")
+            if is_dir or len(parts) > 1:
+                top_dirs.add(parts[0])
+            if is_dir or file_overwrite:
+                continue
+            dst = os.path.join(extract_path, *parts)
+            if os.path.lexists(dst):
+                raise FileAlreadyExistError(
+                    f"File {dst} already exist. Set the file_overwrite as "
+                    f"True if you want overwrite it.")
+        if dirs_exist_ok:
+            return
+        for name in sorted(top_dirs):
+            dst = os.path.join(extract_path, name)
+            if os.path.isdir(dst):
+                raise FileAlreadyExistError(
+                    f"Directory {dst} already exist. Set the dirs_exist_ok as "
+                    f"True if you want merge it.")
+
+    def extract(
+            self, extract_path, installer_regex=None, clear=True,
+            dirs_exist_ok=True, file_overwrite=True, workers=None):
         """Extract the installers.
 
+        The installers are extracted concurrently, big zip archives are also
+        decompressed by multiple threads. When more than one installer contain
+        the same file, the last installer in the order of `get_installers`
+        wins, or FileAlreadyExistError raised if file_overwrite is False. The
+        installers are ordered by the file name.
+
+        Each tar archive is opened once, the members listed for the plan are
+        reused by the extraction. A single tar archive without the conflict
+        checks is extracted in one streaming pass without the plan.
+
         Args:
             extract_path (str): The path to extract to.
             installer_regex (str): The regex to match the installer name. Only
                 the matched installer will be extracted. Will catch all the
                 installers if not given.
+            clear (bool): Whether to clear the extract path before extraction.
+                Default is True.
+            dirs_exist_ok (bool): Whether to extract when the top level
+                directory of the member already exists. Default is True.
+            file_overwrite (bool): Whether to overwrite the file when the
+                member already exists. Default is True.
+            workers (int): The max number of the extract threads. Get from
+                the `REZBUILD_EXTRACT_WORKERS` environment variable if not
+                given. Default is the cpu count. Never more threads than the
+                extract tasks.
+
+        Returns:
+            str: The extract path.
+
+        Raises:
+            FileAlreadyExistError: When the members conflict.
+            UnsupportedError: When the installer format is unsupported.
         """
-        clear_path(extract_path)
-        for installer in self.get_installers(regex=installer_regex):
-            if installer.split(".")[-1] in ["gz", "xz"]:
-                with tarfile.open(installer, "r") as tar:
-                    tar.extractall(extract_path)
-            elif installer.endswith("7z.exe"):
-                name = os.path.basename(installer).split(".")[0]
-                extract_path = os.path.join(extract_path, name)
-                cmds = [installer, "-y", f"-o{extract_path}"]
-                subprocess.run(cmds, check=True)
-            elif installer.endswith(".zip"):
-                with zipfile.ZipFile(installer) as zip_file:
-                    zip_file.extractall(extract_path)
+        if clear:
+            clear_path(extract_path)
+        elif not os.path.isdir(extract_path):
+            os.makedirs(extract_path)
+        installers = self.get_installers(regex=installer_regex)
+        if len(installers) == 1 and _is_tar(installers[0]) and (
+                dirs_exist_ok and file_overwrite):
+            self.extract_tar(installers[0], extract_path)
+            return extract_path
+        tars = {}
+        try:
+            return self._extract(
+                installers, extract_path, tars, dirs_exist_ok,
+                file_overwrite, workers)
+        finally:
+            for tar in tars.values():
+                tar.close()
+
+    def _extract(
+            self, installers, extract_path, tars, dirs_exist_ok,
+            file_overwrite, workers):
+        """Plan and extract the installers, see `extract`.
+
+        Args:
+            installers (:obj:`list` of :obj:`str`): The installers.
+            extract_path (str): The path to extract to.
+            tars (dict): The opened tar archives keyed by the installers,
+                closed by the caller.
+            dirs_exist_ok (bool): Whether to extract when the top level
+                directory of the member already exists.
+            file_overwrite (bool): Whether to overwrite the file when the
+                member already exists.
+            workers (int): The max number of the extract threads.
+
+        Returns:
+            str: The extract path.
+        """
+        plans = []
+        for installer in installers:
+            if _is_tar(installer):
+                tars[installer] = tarfile.open(installer, "r")
+                plans.append((
+                    installer, "tar", _list_tar_members(tars[installer])))
+            else:
+                plans.append(self.get_extract_plan(installer))
+        owners = {}
+        top_dirs = {}
+        for index, (_, _, members) in enumerate(plans):
+            self.check_conflicts(
+                extract_path, members, dirs_exist_ok=dirs_exist_ok,
+                file_overwrite=file_overwrite)
+            for name, is_dir in members:
+                if is_dir or "/" in name:
+                    top_dir = name.split("/")[0]
+                    if not dirs_exist_ok and top_dirs.get(
+                            top_dir, index) != index:
+                        raise FileAlreadyExistError(
+                            f"Directory {top_dir} exists in more than one "
+                            f"installer. Set the dirs_exist_ok as True if you "
+                            f"want merge it.")
+                    top_dirs[top_dir] = index
+                if is_dir:
+                    continue
+                if not file_overwrite and name in owners:
+                    raise FileAlreadyExistError(
+                        f"File {name} exists in more than one installer. Set "
+                        f"the file_overwrite as True if you want overwrite "
+                        f"it.")
+                owners[name] = index
+        # Create all the directories first so the threads never race on them.
+        for _, _, members in plans:
+            for name, is_dir in members:
+                dir_ = name if is_dir else os.path.dirname(name)
+                if dir_:
+                    os.makedirs(
+                        os.path.join(extract_path, dir_), exist_ok=True)
+        workers = get_workers(
+            workers, "REZBUILD_EXTRACT_WORKERS", get_cpu_count())
+        tasks = []
+        for index, (installer, kind, members) in enumerate(plans):
+            names = [
+                name for name, is_dir in members
+                if is_dir or owners.get(name) == index]
+            if kind == "7z":
+                output_path = os.path.join(extract_path, members[0][0])
+                cmds = [installer, "-y", f"-o{output_path}"]
+                tasks.append((subprocess.run, (cmds,), {"check": True}))
+            elif kind == "tar":
+                tasks.append((
+                    self.extract_tar, (installer, extract_path, names),
+                    {"tar": tars[installer]}))
             else:
-                suffix = installer.split(".")[-1]
-                raise UnsupportedError(f"Unsupported file format: {suffix}")
+                for chunk in self.split_zip_members(
+                        installer, names, workers):
+                    tasks.append((
+                        self.extract_zip, (installer, extract_path, chunk),
+                        {}))
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(workers, len(tasks)))) as executor:
+            futures = [
+                executor.submit(function, *args, **kwargs)
+                for function, args, kwargs in tasks]
+            for future in futures:
+                future.result()
+        return extract_path
+
+    @staticmethod
+    def extract_tar(installer, extract_path, names=None, tar=None):
+        """Extract the members from the tar archive.
+
+        Args:
+            installer (str): The path of the tar archive.
+            extract_path (str): The path to extract to.
+            names (:obj:`list` of :obj:`str`, optional): The normalized member
+                names to extract. Extract all the members in one streaming
+                pass if not given.
+            tar (tarfile.TarFile, optional): The opened archive whose members
+                are already listed, so the archive is not read again to list
+                them. Open the installer if not given.
+        """
+        if names is None:
+            with tarfile.open(installer, "r|*") as stream:
+                stream.extractall(extract_path, members=(
+                    member for member in stream
+                    if normalize_member_name(member.name)))
+            return
+        names = set(names)
+        with contextlib.ExitStack() as stack:
+            if tar is None:
+                tar = stack.enter_context(tarfile.open(installer, "r"))
+            members = [
+                member for member in tar.getmembers()
+                if normalize_member_name(member.name) in names]
+            tar.extractall(extract_path, members=members)
+
+    @staticmethod
+    def extract_zip(installer, extract_path, names):
+        """Extract the members from the zip archive.
+
+        Each call opens its own file handle so that it can run in parallel.
+
+        Args:
+            installer (str): The path of the zip archive.
+            extract_path (str): The path to extract to.
+            names (:obj:`list` of :obj:`str`): The normalized member names to
+                extract.
+        """
+        names = set(names)
+        with zipfile.ZipFile(installer) as zip_file:
+            members = [
+                info for info in zip_file.infolist()
+                if normalize_member_name(info.filename) in names]
+            zip_file.extractall(extract_path, members=members)
+
+    @staticmethod
+    def get_extract_plan(installer):
+        """Get the archive type and the members of the installer.
+
+        Args:
+            installer (str): The path of the installer.
+
+        Returns:
+            tuple: The installer path, the archive type (one of `tar`, `zip`
+                and `7z`) and a list of tuples of the normalized member name
+                and whether the member is a directory.
+
+        Raises:
+            UnsupportedError: When the installer format is unsupported.
+        """
+        if _is_tar(installer):
+            with tarfile.open(installer, "r") as tar:
+                members = _list_tar_members(tar)
+            return installer, "tar", members
+        elif installer.endswith("7z.exe"):
+            name = os.path.basename(installer).split(".")[0]
+            return installer, "7z", [(name, True)]
+        elif installer.endswith(".zip"):
+            with zipfile.ZipFile(installer) as zip_file:
+                members = [
+                    (normalize_member_name(info.filename), info.is_dir())
+                    for info in zip_file.infolist()
+                    if normalize_member_name(info.filename)]
+            return installer, "zip", members
+        else:
+            suffix = installer.split(".")[-1]
+            raise UnsupportedError(f"Unsupported file format: {suffix}")
+
+    @staticmethod
+    def split_zip_members(installer, names, count):
+        """Split the zip members into balanced chunks by uncompressed size.
+
+        Small archives are not split as the threads cost more than they save.
+
+        Args:
+            installer (str): The path of the zip archive.
+            names (:obj:`list` of :obj:`str`): The normalized member names.
+            count (int): The max number of the chunks.
+
+        Returns:
+            :obj:`list` of :obj:`list`: The chunks of the member names.
+        """
+        names = set(names)
+        with zipfile.ZipFile(installer) as zip_file:
+            infos = [
+                info for info in zip_file.infolist()
+                if normalize_member_name(info.filename) in names]
+        total = sum(info.file_size for info in infos)
+        if total < PARALLEL_UNZIP_SIZE or count < 2:
+            return [sorted(names)]
+        chunks = [[] for _ in range(min(count, len(infos)))]
+        sizes = [0] * len(chunks)
+        for info in sorted(infos, key=lambda info_: -info_.file_size):
+            index = sizes.index(min(sizes))
+            chunks[index].append(normalize_member_name(info.filename))
+            sizes[index] += info.file_size
+        return [chunk for chunk in chunks if chunk]
 
     def custom_build(
             self, extract_path=None, installer_regex=None, dirs_exist_ok=True,
-            follow_symlinks=True, file_overwrite=False):
+            follow_symlinks=True, file_overwrite=None, direct=False):
         """Run the extract build.
 
         Args:
@@ -334,10 +1121,27 @@ class ExtractBuilder(InstallBuilder):
             follow_symlinks (bool): Whether to copy the symbolic links as
                 symbolic links. Default is True.
             file_overwrite: Whether to overwrite the file when the destination
-                file already exists. Default is False.
+                file already exists. Default is False, or True in the direct
+                mode to keep the files duplicated across the installers
+                overwritten like the extract path does.
+            direct (bool): Whether to extract the installers directly into the
+                workspace, without the extract path and the copying. The
+                conflict rules are checked for each archive member, symbolic
+                links are always kept as is. Default is False.
         """
+        if direct:
+            self.extract(
+                self.workspace, installer_regex=installer_regex, clear=False,
+                dirs_exist_ok=dirs_exist_ok,
+                file_overwrite=file_overwrite is not False)
+            return
+        file_overwrite = bool(file_overwrite)
         extract_path = extract_path or os.path.join(self.build_path, "extract")
-        self.extract(extract_path, installer_regex=installer_regex)
+        # The variants with the same installers share the extraction.
+        installers = self.get_installers(regex=installer_regex)
+        extract_path = self.run_shared_stage(
+            ("extract", tuple(installers)), self.extract, extract_path,
+            installer_regex=installer_regex)
         for name in os.listdir(extract_path):
             src = os.path.join(extract_path, name)
             dst = os.path.join(self.workspace, name)
@@ -357,28 +1161,120 @@ class ExtractBuilder(InstallBuilder):
 class CompileBuilder(ExtractBuilder):
     """Build package from source by compiler."""
 
+    def __init__(
+            self, compiler_cache_dir=None, compiler_cache_size=None,
+            **kwargs):
+        """Initialize the builder.
+
+        Args:
+            compiler_cache_dir (str, optional): The directory of the compiler
+                cache. Get from the `REZBUILD_COMPILER_CACHE_DIR` environment
+                variable if not given. Default is the `compiler` folder under
+                the cache root. The compiler cache is disabled if all empty.
+            compiler_cache_size (str or int, optional): The size limit of the
+                compiler cache, like `5G`. Get from the
+                `REZBUILD_COMPILER_CACHE_SIZE` environment variable if not
+                given. Default is 5G.
+        """
+        super().__init__(**kwargs)
+        self.compiler_cache_dir = (
+            compiler_cache_dir or os.getenv("REZBUILD_COMPILER_CACHE_DIR")
+            or (self.cache_root and os.path.join(self.cache_root, "compiler")))
+        self.compiler_cache_size = parse_size(
+            compiler_cache_size or os.getenv(
+                "REZBUILD_COMPILER_CACHE_SIZE", DEFAULT_COMPILER_CACHE_SIZE))
+
     @staticmethod
-    def compile(source_path, install_path, extra_config_args=None):
+    def compile(
+            source_path, install_path, extra_config_args=None, jobs=None,
+            compiler_cache=None, configure_cache="", env=None):
         """Compile the package.
 
+        `make` runs in parallel as a client of the jobserver shared by all the
+        compile calls in this process, so concurrent compiles never exceed the
+        jobs in total.
+
         Args:
             source_path (str): The source root of this package to compile.
             install_path (str): The install path to install to.
             extra_config_args (:obj:`list` of :obj:`str`): Extra config
                 arguments to pass to the configure.
+            jobs (int): The max number of the concurrent make jobs. Get from
+                the `REZBUILD_MAKE_JOBS` environment variable if not given.
+                Default is the number of the cpus available.
+            compiler_cache (CompilerCache): The compiler cache to wrap the
+                `CC` and `CXX` with. Default is not to use cache.
+            configure_cache (str): The path of the configure cache file to
+                load before and save after configure. Default is not to use
+                cache.
+            env (dict): The environment variables to compile in. Default is
+                the current environment.
         """
         extra_config_args = extra_config_args or []
-        commands = [
+        jobs = get_workers(jobs, "REZBUILD_MAKE_JOBS", get_cpu_count())
+        env = dict(os.environ if env is None else env)
+        if compiler_cache:
+            env = compiler_cache.get_env(source_path, env)
+            extra_config_args = list(extra_config_args)
+            for index, arg in enumerate(extra_config_args):
+                name, _, value = arg.partition("=")
+                if name in ["CC", "CXX"] and value:
+                    value = compiler_cache.wrap(value)
+                    extra_config_args[index] = f"{name}={value}"
+        CompileBuilder.configure(
+            source_path,
             ["./configure", f"--prefix={install_path}"] + extra_config_args,
-            ["make"],
-            ["make", "install"],
-        ]
-        for cmds in commands:
-            subprocess.run(cmds, check=True, cwd=source_path)
+            env, cache_file=configure_cache)
+        if jobs > 1:
+            JobServer.get(jobs).run(
+                ["make"], env=env, check=True, cwd=source_path)
+        else:
+            subprocess.run(["make"], check=True, cwd=source_path, env=env)
+        subprocess.run(
+            ["make", "install"], check=True, cwd=source_path, env=env)
+
+    @staticmethod
+    def configure(source_path, command, env, cache_file=""):
+        """Run the configure command.
+
+        If the cache file given, the cached results will be loaded by
+        `--cache-file` and the new results saved back after configure. The
+        cache file is replaced atomically, so the concurrent configures with
+        the same cache file never break it.
+
+        Args:
+            source_path (str): The source root to configure.
+            command (:obj:`list` of :obj:`str`): The configure command.
+            env (dict): The environment variables.
+            cache_file (str): The path of the configure cache file. Default is
+                not to use cache.
+        """
+        if not cache_file:
+            subprocess.run(command, check=True, cwd=source_path, env=env)
+            return
+        local_cache = os.path.join(source_path, "config.cache")
+        command = command + [f"--cache-file={local_cache}"]
+        if os.path.isfile(cache_file):
+            shutil.copy2(cache_file, local_cache)
+        subprocess.run(command, check=True, cwd=source_path, env=env)
+        if not os.path.isfile(local_cache):
+            return
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        handle, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(cache_file), suffix=".tmp")
+        os.close(handle)
+        try:
+            shutil.copy2(local_cache, temp_file)
+            os.replace(temp_file, cache_file)
+        except OSError:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
 
     def custom_build(
             self, extra_config_args=None, installer_regex=None,
-            install_path=None, make_movable=False):
+            install_path=None, make_movable=False, jobs=None,
+            configure_cache=False):
         """Run the compile build.
 
         Args:
@@ -391,17 +1287,115 @@ class CompileBuilder(ExtractBuilder):
                 the configure as the value of the prefix.
             make_movable (bool): Whether to make the package movable. Default
                 is False.
+            jobs (int): The max number of the concurrent make jobs. Default is
+                the number of the cpus available.
+            configure_cache (bool): Whether to reuse the configure results
+                across the variants and rebuilds. Default is False.
         """
         with tempfile.TemporaryDirectory() as temp_dir:
             extract_path = os.path.join(temp_dir, "extract")
             install_path = install_path or self.workspace
+            compiler_cache = self.get_compiler_cache(
+                os.path.join(temp_dir, "compiler_cache_stats"))
             self.extract(extract_path, installer_regex=installer_regex)
             for extract in os.listdir(extract_path):
+                cache_file = ""
+                if configure_cache:
+                    cache_file = self.get_configure_cache_file(
+                        extract, extra_config_args)
                 self.compile(
                     os.path.join(extract_path, extract), install_path,
-                    extra_config_args=extra_config_args)
+                    extra_config_args=extra_config_args, jobs=jobs,
+                    compiler_cache=compiler_cache, configure_cache=cache_file,
+                    env=self.env)
+            if compiler_cache:
+                compiler_cache.evict()
+                hits, misses = compiler_cache.get_stats()
+                print(f"\nCompiler cache: {hits} hits, {misses} misses.")
         if make_movable:
-            make_bins_movable(os.path.join(install_path, "bin"))
+            bin_dir = os.path.join(install_path, "bin")
+            lib_dir = os.path.join(install_path, "lib")
+            errors = {}
+            if platform.system() == "Linux":
+                errors.update(bundle_elfs(
+                    [dir_ for dir_ in [bin_dir, lib_dir]
+                     if os.path.isdir(dir_)], lib_dir))
+            errors.update(make_bins_movable(bin_dir, raise_errors=False))
+            if platform.system() == "Linux" and os.path.isdir(lib_dir):
+                errors.update(make_elfs_movable(lib_dir, lib_dir=lib_dir))
+            if errors:
+                raise MakeMovableError(
+                    "Failed to make the files movable:\n" + "\n".join(
+                        f"{path}: {error}" for path, error in errors.items()))
+
+    def is_build_cacheable(self, install_path=None, **kwargs):
+        """Check whether the build result can be cached.
+
+        Args:
+            install_path (str, optional): The install path passed to the
+                custom_build method.
+            kwargs: The other key word arguments to pass to the custom_build
+                method.
+
+        Returns:
+            bool: False if the package is installed outside the workspace.
+        """
+        if not install_path:
+            return True
+        workspace = os.path.abspath(self.workspace)
+        path = os.path.abspath(install_path)
+        return path == workspace or path.startswith(workspace + os.sep)
+
+    def get_compiler_cache(self, stats_file=""):
+        """Get the compiler cache.
+
+        Args:
+            stats_file (str, optional): The file to count the hits and misses.
+
+        Returns:
+            CompilerCache: The compiler cache. None if the cache is disabled.
+        """
+        if not self.compiler_cache_dir:
+            return None
+        return CompilerCache(
+            self.compiler_cache_dir, self.compiler_cache_size, stats_file)
+
+    def get_configure_cache_file(self, source_name, extra_config_args=None):
+        """Get the configure cache file path.
+
+        The cache file is keyed on the package name, version, source name,
+        compiler identity, extra config arguments and the environment
+        variables that change the configure results, like `CFLAGS` and
+        `REZ_RESOLVE` of the variant, so it is invalidated when any of them
+        changed. It is placed under the `configure` folder of the
+        cache root, or the build path if the cache root is not set.
+
+        Args:
+            source_name (str): The name of the source directory to configure.
+            extra_config_args (:obj:`list` of :obj:`str`): Extra config
+                arguments to pass to the configure.
+
+        Returns:
+            str: The path of the configure cache file.
+        """
+        extra_config_args = extra_config_args or []
+        compilers = {
+            "CC": self.env.get("CC", "cc"),
+            "CXX": self.env.get("CXX", "c++")}
+        for arg in extra_config_args:
+            name, _, value = arg.partition("=")
+            if name in compilers and value:
+                compilers[name] = value
+        hasher = hashlib.sha256()
+        for value in [self.name, self.version, source_name] + [
+                get_compiler_id(compiler.split()[0])
+                for compiler in compilers.values()] + extra_config_args + [
+                f"{name}={self.env.get(name, '')}"
+                for name in CONFIGURE_ENV_VARS]:
+            hasher.update(value.encode("utf-8") + b"\x00")
+        root = self.cache_root or self.build_path
+        return os.path.join(
+            root, "configure", f"{hasher.hexdigest()}.cache")
 
 
 class MacOSBuilder(RezBuilder, abc.ABC):
@@ -500,31 +1494,45 @@ class PythonBuilder(RezBuilder, abc.ABC):
     def determine_python(filepath):
         """Determine the entry point is using python.exe or pythonw.exe.
 
+        Only the executables and the scripts are searched, in chunks, for the
+        shebang, see `bin_utils.classify_file`.
+
         Args:
             filepath (str): Path of the bin entry points.
         """
-        with open(filepath, "rb") as file:
-            content = file.read()
-        if b"python.exe" in content:
-            return "python.exe"
-        elif b"pythonw.exe" in content:
+        shebang = ""
+        if classify_file(filepath) in [FILE_PE, FILE_SCRIPT]:
+            shebang = get_windows_shebang(filepath, r".+pythonw?\.exe")
+        if shebang.endswith("pythonw.exe"):
             return "pythonw.exe"
+        elif shebang.endswith("python.exe"):
+            return "python.exe"
         else:
             raise NotFoundPythonInBinError(
                 f"Not found python executable path in {filepath}")
 
-    def change_shebang(self, root="", shebang=""):
+    def change_shebang(self, root="", shebang="", exclude=None):
         """Change all the shebang of entry files.
 
+        The files are changed by a thread pool, see
+        `bin_utils.make_bins_movable`.
+
         Args:
             root (str): Where the entry files placed. Default is the bin
                 directory.
             shebang (str): The shebang content you want to change to.
+            exclude (:obj:`list` of :obj:`str`): The file paths to skip, like
+                the scripts already have the shebang.
+
+        Raises:
+            MakeMovableError: When failed to change any of the files. All the
+                failed files are listed in the message.
         """
         root = root or os.path.join(self.workspace, "bin")
-        for filename in os.listdir(root):
-            bin_file = os.path.join(root, filename)
-            if platform.system() == "Windows":
+        exclude = exclude or []
+        if platform.system() == "Windows":
+
+            def change(bin_file):
                 try:
                     shebang_ = (
                         shebang or "#!" + self.determine_python(bin_file))
@@ -536,15 +1544,31 @@ class PythonBuilder(RezBuilder, abc.ABC):
                     logging.getLogger(__name__).warning(
                         "Shebang regex #!.+pythonw?.exe not match, skip "
                         "changing shebang")
-            else:
-                shebang = shebang or "/usr/bin/env python"
-                make_bin_movable(bin_file, shebang)
+
+            bin_files = [
+                os.path.join(root, filename)
+                for filename in sorted(os.listdir(root))
+                if os.path.join(root, filename) not in exclude
+                and os.path.isfile(os.path.join(root, filename))]
+            errors = map_files(change, bin_files)
+        else:
+            errors = make_bins_movable(
+                root, shebang or "/usr/bin/env python", exclude=exclude,
+                raise_errors=False)
+        if errors:
+            raise MakeMovableError(
+                "Failed to change the shebang:\n" + "\n".join(
+                    f"{path}: {error}" for path, error in errors.items()))
 
     def install_wheel(
             self, wheel_file, install_path="", change_shebang=False,
-            shebang=""):
+            shebang="", use_pip=False):
         """Install wheel file.
 
+        Install by the builtin wheel installer, the shebang of the scripts is
+        changed while unpacking. Fall back to pip if the wheel is unsupported
+        by the builtin installer.
+
         Args:
             wheel_file (str): The path of the wheel file to install.
             install_path (str, optional): Path to install to. Default is
@@ -552,16 +1576,35 @@ class PythonBuilder(RezBuilder, abc.ABC):
             change_shebang (bool, optional): Whether to change shebang in bin
                 directory. Default is False.
             shebang (str, optional): The shebang content you want to change to.
+            use_pip (bool, optional): Whether to always install by pip.
+                Default is False, or `REZBUILD_WHEEL_INSTALLER` is `pip`.
         """
         install_path = install_path or os.path.join(self.workspace, "python")
-        command = [
-            "python", "-m", "pip", "install", "--ignore-installed", "--no-deps",
-            "--no-compile", "--target", install_path, wheel_file]
-        print(f"\nInstall command: {' '.join(command)}")
-        subprocess.run(command, check=True)
-        if change_shebang:
-            bin_root = os.path.join(install_path, "bin")
-            self.change_shebang(shebang=shebang, root=bin_root)
+        use_pip = use_pip or os.getenv("REZBUILD_WHEEL_INSTALLER") == "pip"
+        scripts = []
+        if not use_pip:
+            if change_shebang:
+                shebang_ = shebang or "/usr/bin/env python"
+            else:
+                shebang_ = self.get_python()
+            try:
+                print(f"\nInstall wheel: {wheel_file}")
+                scripts = install_wheel(wheel_file, install_path, shebang_)
+            except UnsupportedError as e:
+                logging.getLogger(__name__).warning(
+                    f"{e} Fall back to pip.")
+                use_pip = True
+        if use_pip:
+            command = [
+                "python", "-m", "pip", "install", "--ignore-installed",
+                "--no-deps", "--no-compile", "--target", install_path,
+                wheel_file]
+            print(f"\nInstall command: {' '.join(command)}")
+            subprocess.run(command, check=True, env=self.env)
+        bin_root = os.path.join(install_path, "bin")
+        if change_shebang and os.path.isdir(bin_root):
+            self.change_shebang(
+                shebang=shebang, root=bin_root, exclude=scripts)
 
 
 class PythonSourceBuilder(PythonBuilder):
@@ -572,44 +1615,167 @@ class PythonSourceBuilder(PythonBuilder):
 
     """
 
-    def create_wheel(self, source_root="", use_venv=True):
-        """Create wheel file from source code and put into a temp dir.
+    def __init__(
+            self, wheel_cache_size=None, build_env_max_age=None, **kwargs):
+        """Initialize the builder.
 
         Args:
-            source_root (str, optional): The source root. Default is
-                self.source_path.
+            wheel_cache_size (str or int, optional): The size limit of the
+                wheel cache, like `2G`. Get from the
+                `REZBUILD_WHEEL_CACHE_SIZE` environment variable if not given.
+                Default is 2G. The wheel cache is placed under the cache root
+                and disabled if the cache root is not set.
+            build_env_max_age (int, optional): The seconds to reuse a pooled
+                build environment before recreating it. Get from the
+                `REZBUILD_BUILD_ENV_MAX_AGE` environment variable if not
+                given. Default is 7 days. The pool is placed under the cache
+                root and disabled if the cache root is not set.
+        """
+        super().__init__(**kwargs)
+        self.wheel_cache_size = parse_size(
+            wheel_cache_size or os.getenv(
+                "REZBUILD_WHEEL_CACHE_SIZE", DEFAULT_WHEEL_CACHE_SIZE))
+        self.build_env_max_age = int(
+            build_env_max_age or os.getenv(
+                "REZBUILD_BUILD_ENV_MAX_AGE", DEFAULT_BUILD_ENV_MAX_AGE))
+
+    def build_wheel(
+            self, source_root, wheel_dir, use_venv=True, snapshot=False,
+            includes=None):
+        """Build the wheel file by pyproject-build.
+
+        Args:
+            source_root (str): The source root.
+            wheel_dir (str): The directory to put the wheel file to.
             use_venv (bool, optional): Whether to create venv when build python
                 package.
-
-        Returns:
-            str: The wheel file path.
+            snapshot (bool, optional): Whether to build from a snapshot of the
+                files tracked or not ignored by git instead of a full copy of
+                the source root. The files are hard linked if possible.
+            includes (:obj:`list` of :obj:`str`, optional): Gitignore style
+                patterns of the files in the snapshot, instead of the git
+                rules.
         """
-        source_root = source_root or self.source_path
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_src = os.path.join(temp_dir, "src")
-            shutil.copytree(source_root, temp_src)
-            wheel_dir = os.path.join(self.build_path, "wheel_dir")
-            if os.path.exists(wheel_dir):
-                remove_tree(wheel_dir)
-            os.makedirs(wheel_dir)
+            if snapshot or includes:
+                snapshot_tree(source_root, temp_src, includes=includes)
+            else:
+                shutil.copytree(source_root, temp_src)
             command = ["pyproject-build", "-o", wheel_dir]
             if not use_venv:
                 command.append("--no-isolation")
-                env = dict(os.environ)
+                env = dict(self.env)
             else:
                 # Remove pip from environment to let venv install it.
-                env = self.get_no_pip_environment()
-            print(f"\nWheel create command: {' '.join(command)}")
-            subprocess.run(command, check=True, cwd=temp_src, env=env)
+                env = self.get_no_pip_environment(self.env)
+            pool = self.get_build_env_pool() if use_venv else None
+            if not pool or not self.build_wheel_in_pool(
+                    pool, temp_src, wheel_dir, env):
+                print(f"\nWheel create command: {' '.join(command)}")
+                subprocess.run(command, check=True, cwd=temp_src, env=env)
             # Remove temporary manually as sometimes git files will cause some
             # permission error.
             remove_tree(temp_dir)
             os.makedirs(temp_dir)
+
+    @staticmethod
+    def build_wheel_in_pool(pool, source_root, wheel_dir, env):
+        """Build the wheel file in a pooled build environment.
+
+        Args:
+            pool (BuildEnvPool): The pool of the build environments.
+            source_root (str): The source root to build.
+            wheel_dir (str): The directory to put the wheel file to.
+            env (dict): The environment variables.
+
+        Returns:
+            bool: True if built. False if the `pyproject.toml` can't be read,
+                the environment can't be prepared, or the backend asks for the
+                requirements not installed in it.
+
+        Raises:
+            subprocess.CalledProcessError: When the build itself failed. The
+                build is never retried.
+        """
+        try:
+            requires = read_build_requires(source_root)
+            with pool.checkout(requires) as python:
+                if not pool.has_build_requires(python, source_root, env):
+                    logging.getLogger(__name__).warning(
+                        "The build requirements are not all installed in the "
+                        "pooled environment, build in an isolated "
+                        "environment.")
+                    return False
+                command = [
+                    python, "-m", "build", "--no-isolation",
+                    "--skip-dependency-check", "-o", wheel_dir, source_root]
+                print(f"\nWheel create command: {' '.join(command)}")
+                # Not run in the source root, or the `build.py` of the rez
+                # package will shadow the build module.
+                subprocess.run(command, check=True, cwd=wheel_dir, env=env)
+        except (BuildEnvError, UnsupportedError) as e:
+            logging.getLogger(__name__).warning(
+                f"{e} Build in an isolated environment.")
+            return False
+        return True
+
+    def create_wheel(
+            self, source_root="", use_venv=True, snapshot=False,
+            includes=None):
+        """Create wheel file from source code and put into a temp dir.
+
+        Reuse the cached wheel if the source tree and the build configuration
+        are unchanged since a previous build.
+
+        Args:
+            source_root (str, optional): The source root. Default is
+                self.source_path.
+            use_venv (bool, optional): Whether to create venv when build python
+                package.
+            snapshot (bool, optional): Whether to build from a snapshot of the
+                files tracked or not ignored by git. The `.git` directory is
+                not in the snapshot, so don't use it with the build backends
+                get the version from git, like setuptools_scm. Default is
+                False.
+            includes (:obj:`list` of :obj:`str`, optional): Gitignore style
+                patterns of the files in the snapshot, instead of the git
+                rules.
+
+        Returns:
+            str: The wheel file path.
+        """
+        source_root = source_root or self.source_path
+        wheel_dir = os.path.join(self.build_path, "wheel_dir")
+        if os.path.exists(wheel_dir):
+            remove_tree(wheel_dir)
+        os.makedirs(wheel_dir)
+        cache = self.get_wheel_cache()
+        key = ""
+        if cache:
+            files = None
+            if snapshot or includes:
+                files = list_source_files(source_root, includes)
+            key = self.get_wheel_cache_key(source_root, use_venv, files)
+        content = cache.get(key) if key else None
+        if content:
+            print(f"\nWheel cache hit: {key}")
+            for name in os.listdir(content):
+                shutil.copy2(os.path.join(content, name), wheel_dir)
+        else:
+            self.build_wheel(
+                source_root, wheel_dir, use_venv, snapshot=snapshot,
+                includes=includes)
         wheel_file_name = [
             name for name in os.listdir(wheel_dir) if name.endswith(".whl")][0]
-        return os.path.join(wheel_dir, wheel_file_name)
+        wheel_file = os.path.join(wheel_dir, wheel_file_name)
+        if key and not content:
+            cache.store(key, wheel_file)
+        return wheel_file
 
-    def custom_build(self, change_shebang=False, use_venv=True, shebang=""):
+    def custom_build(
+            self, change_shebang=False, use_venv=True, shebang="",
+            snapshot=False, includes=None):
         """Build package from source.
 
         Args:
@@ -617,26 +1783,124 @@ class PythonSourceBuilder(PythonBuilder):
                 bin files.
             use_venv (bool): Whether to create venv when build python package.
             shebang (str): The shebang content you want to change to.
+            snapshot (bool): Whether to build the wheel from a snapshot of the
+                files tracked or not ignored by git.
+            includes (:obj:`list` of :obj:`str`): Gitignore style patterns of
+                the files in the snapshot, instead of the git rules.
         """
-        wheel_file = self.create_wheel(use_venv=use_venv)
+        # The variants share the same wheel.
+        wheel_file = self.run_shared_stage(
+            ("create_wheel", use_venv, snapshot, tuple(includes or [])),
+            self.create_wheel, use_venv=use_venv, snapshot=snapshot,
+            includes=includes)
         self.install_wheel(
             wheel_file, change_shebang=change_shebang, shebang=shebang)
 
     @staticmethod
-    def get_no_pip_environment():
-        """Remove pip path from the PYTHONPATH environment variables."""
-        env = dict(os.environ)
+    def get_no_pip_environment(env=None):
+        """Remove pip path from the PYTHONPATH environment variables.
+
+        Args:
+            env (dict, optional): The environment variables. Default is the
+                current environment.
+        """
+        env = dict(os.environ if env is None else env)
         delimiter = get_delimiter()
         env["PYTHONPATH"] = delimiter.join([
             path for path in env["PYTHONPATH"].split(delimiter)
-            if not path.startswith(os.environ[f"REZ_PIP_ROOT"])
+            if not path.startswith(env[f"REZ_PIP_ROOT"])
         ])
         return env
 
+    def get_build_env_pool(self):
+        """Get the pool of the build environments.
+
+        Returns:
+            BuildEnvPool: The pool. None if the cache root is not set.
+        """
+        if not self.cache_root:
+            return None
+        return BuildEnvPool(
+            os.path.join(self.cache_root, "build_env"), self.get_python(),
+            max_age=self.build_env_max_age)
+
+    def get_wheel_cache(self):
+        """Get the wheel cache.
+
+        Returns:
+            DirectoryCache: The wheel cache. None if the cache is disabled.
+        """
+        if not self.cache_root:
+            return None
+        return DirectoryCache(
+            os.path.join(self.cache_root, "wheel"), self.wheel_cache_size)
+
+    def get_wheel_cache_key(self, source_root, use_venv=True, files=None):
+        """Get the wheel cache key from the source tree and the build config.
+
+        The VCS directories are skipped except the current revision and the
+        nearest tag, as tools like setuptools_scm get the version from them.
+
+        Args:
+            source_root (str): The source root.
+            use_venv (bool, optional): Whether to create venv when build python
+                package.
+            files (:obj:`list` of :obj:`str`, optional): The relative paths of
+                the files to hash. Default is all the files under the source
+                root.
+
+        Returns:
+            str: The cache key.
+        """
+        hasher = hashlib.sha256()
+        for value in [
+                get_compiler_id(self.get_python()), platform.python_version(),
+                platform.machine(), sys.platform, str(use_venv)]:
+            hasher.update(value.encode("utf-8") + b"\x00")
+        build_path = os.path.join(os.path.abspath(self.build_path), "")
+        if files is not None:
+            for file in files:
+                filepath = os.path.join(source_root, file)
+                if os.path.abspath(filepath).startswith(build_path):
+                    continue
+                hasher.update(file.encode("utf-8") + b"\x00")
+                if os.path.islink(filepath):
+                    hasher.update(os.readlink(filepath).encode("utf-8"))
+                else:
+                    hasher.update(hash_file(filepath).encode("utf-8"))
+                hasher.update(b"\x00")
+        else:
+            excludes = []
+            if not os.path.abspath(source_root).startswith(
+                    os.path.abspath(self.build_path)):
+                excludes.append(self.build_path)
+            hash_tree(
+                source_root, hasher, excludes=excludes,
+                ignore_names=WHEEL_CACHE_IGNORE_NAMES)
+        hasher.update(get_git_revision(source_root).encode("utf-8"))
+        return hasher.hexdigest()
+
 
 class PythonSourceArchiveBuilder(PythonSourceBuilder, InstallBuilder):
     """Build the external package from python source archive file."""
 
+    def create_wheel_from_archive(self, archive, use_venv=True):
+        """Extract the python source archive and create the wheel file.
+
+        Args:
+            archive (str): The path of the `.tar.gz` source archive.
+            use_venv (bool, optional): Whether to create venv when build python
+                package.
+
+        Returns:
+            str: The wheel file path.
+        """
+        with tarfile.open(archive, "r") as file:
+            file.extractall(self.build_path)
+        dirname = os.path.basename(archive).replace(".tar.gz", "")
+        source_root = os.path.join(self.build_path, dirname)
+        return self.create_wheel(source_root, use_venv=use_venv)
+
     def custom_build(self, change_shebang=False, use_venv=True, shebang=""):
         """Build package from python source archive file.
 
@@ -648,13 +1912,12 @@ class PythonSourceArchiveBuilder(PythonSourceBuilder, InstallBuilder):
         """
         archives = [archive for archive in self.get_installers()
                     if archive.endswith(".tar.gz")]
-        with tarfile.open(archives[0], "r") as file:
-            file.extractall(self.build_path)
-        dirname = os.path.basename(archives[0]).replace(".tar.gz", "")
-        source_root = os.path.join(self.build_path, dirname)
-        wheel_file = self.create_wheel(source_root, use_venv=use_venv)
+        # Python installer always only one archive file. The variants with the
+        # same archive share the same wheel.
+        wheel_file = self.run_shared_stage(
+            ("create_wheel_from_archive", archives[0], use_venv),
+            self.create_wheel_from_archive, archives[0], use_venv=use_venv)
         self.install_wheel(
-            # Python installer always only one archive file.
             wheel_file, change_shebang=change_shebang, shebang=shebang)
 
 
@@ -679,3 +1942,31 @@ class PythonWheelBuilder(PythonBuilder, InstallBuilder):
             # Python installer always only one whl file.
             wheels[0], change_shebang=change_shebang, shebang=shebang,
             install_path=wheel_install_path)
+
+
+def _is_tar(installer):
+    """Check whether the installer is a compressed tar archive by the suffix.
+
+    Args:
+        installer (str): The path of the installer.
+
+    Returns:
+        bool: True if the installer is a `.gz` or `.xz` tar archive.
+    """
+    return installer.split(".")[-1] in ["gz", "xz"]
+
+
+def _list_tar_members(tar):
+    """List the members of the opened tar archive for the extract plan.
+
+    Args:
+        tar (tarfile.TarFile): The opened tar archive.
+
+    Returns:
+        :obj:`list` of :obj:`tuple`: The normalized member names and whether
+            the members are directories.
+    """
+    return [
+        (normalize_member_name(member.name), member.isdir())
+        for member in tar.getmembers()
+        if normalize_member_name(member.name)]
@@ -0,0 +1,203 @@
+"""Local on-disk cache with size-bounded LRU eviction.
+
+The cache stores files or directory trees under a key. Each entry is a
+directory named with its key under the cache root:
+
+cache_root/
+├── entries/
+│   └── <key>/
+│       ├── content/
+│       └── meta.json
+└── tmp/
+
+The modification time of `meta.json` records the last access time of the
+entry. When the total size of the entries exceeds the size limit, the least
+recently used entries will be removed.
+"""
+
+# Import built-in modules
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+# Import local modules
+from rezbuild.utils import get_tree_size
+from rezbuild.utils import remove_tree
+
+
+class DirectoryCache(object):
+    """Cache files and directories by key."""
+
+    META_FILE = "meta.json"
+
+    def __init__(self, root, max_size=0):
+        """Initialize the cache.
+
+        Args:
+            root (str): The root directory of the cache.
+            max_size (int, optional): The size limit in bytes. No limit if it
+                is 0. Default is 0.
+        """
+        self.root = root
+        self.max_size = max_size
+        self.entries_root = os.path.join(root, "entries")
+        self.temp_root = os.path.join(root, "tmp")
+        for path in [self.entries_root, self.temp_root]:
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        """Get the content path of the entry and mark it as recently used.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            str: The content path of the entry. None if the entry does not
+                exist.
+        """
+        meta_path = os.path.join(self.get_entry_path(key), self.META_FILE)
+        try:
+            os.utime(meta_path, None)
+        except OSError:
+            return None
+        return os.path.join(self.get_entry_path(key), "content")
+
+    def get_entry_path(self, key):
+        """Get the directory path of the entry.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            str: The directory path of the entry.
+        """
+        return os.path.join(self.entries_root, key)
+
+    def list_entries(self):
+        """List all the entries from the least recently used.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: Each item is a tuple of the entry key,
+                last access time and size.
+        """
+        entries = []
+        for key in os.listdir(self.entries_root):
+            meta_path = os.path.join(self.get_entry_path(key), self.META_FILE)
+            try:
+                with open(meta_path) as file:
+                    size = json.load(file)["size"]
+                atime = os.stat(meta_path).st_mtime
+            except (OSError, ValueError, KeyError):
+                # Broken or half removed entry.
+                atime, size = 0, 0
+            entries.append((key, atime, size))
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def evict(self, reserve=0):
+        """Remove the least recently used entries until under the size limit.
+
+        Args:
+            reserve (int, optional): The extra bytes to free for the coming
+                entry. Default is 0.
+        """
+        if not self.max_size:
+            return
+        entries = self.list_entries()
+        total = sum(entry[2] for entry in entries)
+        for key, _, size in entries:
+            if total + reserve <= self.max_size:
+                break
+            logging.getLogger(__name__).debug(f"Evict cache entry {key}")
+            self.remove(key)
+            total -= size
+
+    def remove(self, key):
+        """Remove the entry.
+
+        The entry will be renamed into the temporary directory first so that
+        other processes never see a half removed entry.
+
+        Args:
+            key (str): The key of the entry.
+        """
+        path = self.get_entry_path(key)
+        trash = tempfile.mkdtemp(dir=self.temp_root)
+        try:
+            os.rename(path, os.path.join(trash, key))
+        except OSError:
+            pass
+        remove_tree(trash)
+
+    def restore(self, key, dst):
+        """Copy the cached directory to the destination.
+
+        Args:
+            key (str): The key of the entry.
+            dst (str): The destination directory. Will be removed if exists.
+
+        Returns:
+            bool: True if restored, False if the entry does not exist.
+        """
+        content = self.get(key)
+        if not content:
+            return False
+        if os.path.exists(dst):
+            remove_tree(dst)
+        try:
+            shutil.copytree(content, dst, symlinks=True)
+        except (OSError, shutil.Error):
+            # The entry may be evicted by another process during copying.
+            if os.path.exists(dst):
+                remove_tree(dst)
+            os.makedirs(dst)
+            return False
+        return True
+
+    def store(self, key, src, move=False):
+        """Store the file or directory into the cache.
+
+        The content will be copied into the temporary directory and then
+        renamed as the entry, so concurrent stores of the same key are safe.
+
+        Args:
+            key (str): The key of the entry.
+            src (str): The file or directory to store.
+            move (bool, optional): Whether to move the src into the cache
+                instead of copying it. Default is False.
+
+        Returns:
+            str: The content path of the entry.
+        """
+        size = get_tree_size(src)
+        if self.max_size and size > self.max_size:
+            logging.getLogger(__name__).warning(
+                f"Skip caching {src}: {size} bytes exceeds the cache size "
+                f"limit {self.max_size}.")
+            return ""
+        self.evict(reserve=size)
+        temp_dir = tempfile.mkdtemp(dir=self.temp_root)
+        content = os.path.join(temp_dir, "content")
+        if os.path.isdir(src):
+            if move:
+                shutil.move(src, content)
+            else:
+                shutil.copytree(src, content, symlinks=True)
+        else:
+            os.makedirs(content)
+            dst = os.path.join(content, os.path.basename(src))
+            if move:
+                shutil.move(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        with open(os.path.join(temp_dir, self.META_FILE), "w") as file:
+            json.dump({"size": size, "created": time.time()}, file)
+        try:
+            os.rename(temp_dir, self.get_entry_path(key))
+        except OSError:
+            # Another process already stored the same key.
+            remove_tree(temp_dir)
+        return self.get(key)
@@ -0,0 +1,243 @@
+"""Verify the installers by the checksums.
+
+The expected checksums come from the `installers.json` manifest or the
+sidecar files next to the installers, like `installer.zip.sha256`. A sidecar
+file contains the hex digest, optionally followed by the file name like the
+output of `sha256sum`.
+
+Hashing a big installer is expensive, so the digests are cached by the
+identity of the file: the real path, size, modification time and inode. An
+unchanged installer is hashed only once per host if the cache has a root
+directory:
+
+cache_root/
+└── <identity hash>.json
+"""
+
+# Import built-in modules
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+
+# Import local modules
+from rezbuild.constants import CHECKSUM_SUFFIXES
+from rezbuild.constants import HASH_CHUNK_SIZE
+from rezbuild.exceptions import ChecksumError
+
+# Size of the slices of the mapped file passed to the hashers.
+MMAP_SLICE_SIZE = 16 * HASH_CHUNK_SIZE
+
+
+class VerifiedHashCache(object):
+    """Cache the file digests by the identity of the file."""
+
+    # The digests of this process, shared by all the instances.
+    _digests = {}
+    _lock = threading.Lock()
+
+    def __init__(self, root=None):
+        """Initialize the cache.
+
+        Args:
+            root (str, optional): The directory to keep the digests across the
+                processes. Only cache in the memory if not given.
+        """
+        self.root = root
+        if root and not os.path.isdir(root):
+            os.makedirs(root, exist_ok=True)
+
+    def get(self, path, algorithm):
+        """Get the cached digest of the file.
+
+        Args:
+            path (str): The file path.
+            algorithm (str): The hash algorithm.
+
+        Returns:
+            str: The hex digest. None if the file is not cached or changed.
+        """
+        key = self.get_key(path)
+        with self._lock:
+            digests = self._digests.get(key)
+        if digests is None and self.root:
+            try:
+                with open(os.path.join(self.root, f"{key}.json")) as file:
+                    digests = json.load(file)
+            except (OSError, ValueError):
+                digests = None
+            if digests is not None:
+                with self._lock:
+                    self._digests[key] = digests
+        return (digests or {}).get(algorithm)
+
+    @staticmethod
+    def get_key(path):
+        """Get the key of the file by one stat.
+
+        Args:
+            path (str): The file path.
+
+        Returns:
+            str: The key.
+        """
+        stat = os.stat(path)
+        identity = "\x00".join(str(item) for item in [
+            os.path.realpath(path), stat.st_size, stat.st_mtime_ns,
+            stat.st_ino])
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def hash(self, path, algorithms):
+        """Get the digests of the file, hash it only if not cached.
+
+        Args:
+            path (str): The file path.
+            algorithms (:obj:`list` of :obj:`str`): The hash algorithms.
+
+        Returns:
+            dict: The hex digests keyed by the algorithms.
+        """
+        digests = {}
+        missing = []
+        for algorithm in algorithms:
+            digest = self.get(path, algorithm)
+            if digest:
+                digests[algorithm] = digest
+            else:
+                missing.append(algorithm)
+        if missing:
+            key = self.get_key(path)
+            digests.update(hash_file_once(path, missing))
+            # The file changed while hashing, do not trust the digests.
+            if self.get_key(path) == key:
+                self.set(key, digests)
+        return digests
+
+    def set(self, key, digests):
+        """Merge the digests into the cache.
+
+        Args:
+            key (str): The key of the file, returned by get_key.
+            digests (dict): The hex digests keyed by the algorithms.
+        """
+        with self._lock:
+            digests = dict(self._digests.get(key) or {}, **digests)
+            self._digests[key] = digests
+        if not self.root:
+            return
+        handle, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(handle, "w") as file:
+            json.dump(digests, file)
+        os.replace(temp_path, os.path.join(self.root, f"{key}.json"))
+
+
+def get_expected_hashes(path, entry=None):
+    """Get the expected digests of the installer.
+
+    Args:
+        path (str): The installer path.
+        entry (dict, optional): The manifest entry of the installer.
+
+    Returns:
+        dict: The expected hex digests keyed by the algorithms. Empty if no
+            checksum is given. The sidecar files are not looked up if the
+            manifest entry has any digest.
+    """
+    expected = {
+        algorithm: entry[algorithm].lower()
+        for algorithm in CHECKSUM_SUFFIXES.values()
+        if (entry or {}).get(algorithm)}
+    if expected:
+        return expected
+    for suffix, algorithm in CHECKSUM_SUFFIXES.items():
+        if os.path.isfile(path + suffix):
+            expected[algorithm] = read_sidecar(path + suffix)
+    return expected
+
+
+def hash_file_once(path, algorithms):
+    """Hash the file by all the algorithms in a single pass.
+
+    The file is mapped into the memory instead of read, so the content is
+    never copied and the big file never be loaded into the memory at once.
+    Fall back to reading in chunks if the file can't be mapped.
+
+    Args:
+        path (str): The file path.
+        algorithms (:obj:`list` of :obj:`str`): The hash algorithms.
+
+    Returns:
+        dict: The hex digests keyed by the algorithms.
+    """
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    with open(path, "rb") as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files and some file systems can't be mapped.
+            mapped = None
+        if mapped is None:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                for hasher in hashers:
+                    hasher.update(chunk)
+        else:
+            with mapped, memoryview(mapped) as view:
+                for start in range(0, len(view), MMAP_SLICE_SIZE):
+                    slice_ = view[start:start + MMAP_SLICE_SIZE]
+                    for hasher in hashers:
+                        hasher.update(slice_)
+                    slice_.release()
+    return {
+        algorithm: hasher.hexdigest()
+        for algorithm, hasher in zip(algorithms, hashers)}
+
+
+def read_sidecar(path):
+    """Read the digest from the sidecar file.
+
+    Args:
+        path (str): The sidecar file path.
+
+    Returns:
+        str: The lower case hex digest.
+
+    Raises:
+        ChecksumError: When the sidecar file is empty.
+    """
+    with open(path) as file:
+        content = file.read().split()
+    if not content:
+        raise ChecksumError(f"No checksum found in {path}.")
+    return content[0].lower()
+
+
+def verify_file(path, expected, size=None, cache=None):
+    """Verify the file by the expected digests.
+
+    Args:
+        path (str): The file path.
+        expected (dict): The expected hex digests keyed by the algorithms.
+        size (int, optional): The expected size, checked before hashing so
+            the truncated file fails fast.
+        cache (VerifiedHashCache, optional): The cache of the digests. Only
+            cache in the memory if not given.
+
+    Raises:
+        ChecksumError: When the file does not match the size or any of the
+            digests.
+    """
+    if size is not None and os.path.getsize(path) != size:
+        raise ChecksumError(
+            f"The size of {path} is {os.path.getsize(path)}, expected "
+            f"{size}.")
+    cache = cache or VerifiedHashCache()
+    digests = cache.hash(path, sorted(expected))
+    for algorithm, digest in sorted(expected.items()):
+        if digests[algorithm] != digest:
+            raise ChecksumError(
+                f"The {algorithm} of {path} is {digests[algorithm]}, "
+                f"expected {digest}.")
+    logging.getLogger(__name__).debug(f"Verified {path}.")
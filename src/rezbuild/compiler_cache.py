@@ -0,0 +1,442 @@
+"""Compiler cache for CompileBuilder.
+
+Use ccache if it is available. Otherwise wrap the compiler by this module,
+which caches the object files keyed on the preprocessed source, the compiler
+and the flags. The wrapper is a standalone script written into the cache
+directory, it runs this module without importing the whole `rezbuild`
+package, so each compilation starts fast and writes nothing more to stderr:
+
+    <cache_dir>/rezbuild-cc <compiler> <arguments>
+
+Only the single source compilations (`-c`) are cached. Everything else like
+linking runs the compiler directly.
+"""
+
+# Import built-in modules
+import hashlib
+import os
+import platform
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Import local modules
+from rezbuild.cache import DirectoryCache
+
+# The placeholder of the base directory in the cached dependency files.
+BASEDIR_PLACEHOLDER = "@REZBUILD_BASEDIR@"
+
+# Suffix of the source files that can be cached.
+SOURCE_SUFFIXES = [
+    ".c", ".cc", ".cp", ".cpp", ".cxx", ".c++", ".C", ".m", ".mm", ".S"]
+
+# Arguments followed by a value that only affect the output paths.
+OUTPUT_ARGS = ["-o", "-MF", "-MT", "-MQ"]
+
+# Arguments followed by a value that only affect the preprocessing.
+PREPROCESSOR_ARGS = ["-I", "-D", "-U", "-include", "-isystem", "-iquote"]
+
+# Arguments that only affect the dependency file generation.
+DEPENDENCY_FLAGS = ["-MD", "-MMD", "-MP"]
+
+# Name of the wrapper scripts in the cache directory.
+WRAPPER_NAME = "rezbuild-cc"
+
+# The python wrapper script. The `rezbuild` package is registered as an empty
+# package so `rezbuild/__init__.py` and the builders are never imported.
+WRAPPER_CODE = """import sys
+import types
+
+package = types.ModuleType("rezbuild")
+package.__path__ = [{package_dir!r}]
+sys.modules["rezbuild"] = package
+
+from rezbuild.compiler_cache import main
+
+main()
+"""
+
+# The shell wrapper script, so the interpreter path never appears in CC.
+WRAPPER_SCRIPT = """#!/bin/sh
+exec {python} {script} "$@"
+"""
+
+
+class CompilerCache(object):
+    """Cache the compilations by ccache or by this module."""
+
+    def __init__(self, cache_dir, max_size=0, stats_file=""):
+        """Initialize the compiler cache.
+
+        Args:
+            cache_dir (str): The directory to store the cache.
+            max_size (int, optional): The size limit in bytes. No limit if it
+                is 0. Default is 0.
+            stats_file (str, optional): The file to count the hits and misses
+                of the fallback cache. Default is not to count.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.stats_file = stats_file
+        self.ccache = shutil.which("ccache")
+        self._ccache_stats = self.get_ccache_stats()
+        self._wrapper = ""
+
+    def evict(self):
+        """Remove the least recently used objects over the size limit."""
+        if not self.ccache:
+            DirectoryCache(self.cache_dir, self.max_size).evict()
+
+    def get_ccache_stats(self):
+        """Get the hit and miss counters of ccache.
+
+        Returns:
+            tuple: The hits and misses count. (0, 0) if not available.
+        """
+        if not self.ccache:
+            return 0, 0
+        env = dict(os.environ, CCACHE_DIR=self.cache_dir)
+        result = subprocess.run(
+            [self.ccache, "--print-stats"], env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+        counters = dict(
+            line.split("\t", 1) for line in result.stdout.splitlines()
+            if "\t" in line)
+        hits = sum(int(counters.get(name, 0)) for name in [
+            "direct_cache_hit", "preprocessed_cache_hit", "cache_hit_direct",
+            "cache_hit_preprocessed"])
+        return hits, int(counters.get("cache_miss", 0))
+
+    def get_env(self, source_path, env=None):
+        """Get the environment variables to compile with the cache.
+
+        Args:
+            source_path (str): The source root to compile.
+            env (dict, optional): The environment variables to base on. Default
+                is the current environment.
+
+        Returns:
+            dict: The environment variables.
+        """
+        env = dict(env or os.environ)
+        env["CC"] = self.wrap(env.get("CC", "cc"))
+        env["CXX"] = self.wrap(env.get("CXX", "c++"))
+        if self.ccache:
+            env["CCACHE_DIR"] = self.cache_dir
+            # Ignore the temporary directory that the source extracted to.
+            env["CCACHE_BASEDIR"] = os.path.dirname(source_path)
+            env["CCACHE_NOHASHDIR"] = "1"
+            if self.max_size:
+                size = max(1, self.max_size // 1024 ** 2)
+                env["CCACHE_MAXSIZE"] = f"{size}Mi"
+        else:
+            env["REZBUILD_COMPILER_CACHE_DIR"] = self.cache_dir
+            env["REZBUILD_COMPILER_CACHE_STATS"] = self.stats_file
+            env["REZBUILD_COMPILER_CACHE_BASEDIR"] = os.path.dirname(
+                source_path)
+        return env
+
+    def get_stats(self):
+        """Get the hits and misses since this cache object created.
+
+        Returns:
+            tuple: The hits and misses count.
+        """
+        if self.ccache:
+            hits, misses = self.get_ccache_stats()
+            return (
+                hits - self._ccache_stats[0], misses - self._ccache_stats[1])
+        if not self.stats_file or not os.path.isfile(self.stats_file):
+            return 0, 0
+        with open(self.stats_file, "rb") as file:
+            content = file.read()
+        return content.count(b"h"), content.count(b"m")
+
+    def get_wrapper(self):
+        """Get the command of the wrapper, write the wrapper script if needed.
+
+        Returns:
+            str: The wrapper command, quoted for the shell.
+        """
+        if self._wrapper:
+            return self._wrapper
+        script = os.path.join(self.cache_dir, f"{WRAPPER_NAME}.py")
+        _write_script(script, WRAPPER_CODE.format(
+            package_dir=os.path.dirname(os.path.abspath(__file__))))
+        if platform.system() == "Windows":
+            self._wrapper = f"{_quote(sys.executable)} {_quote(script)}"
+            return self._wrapper
+        path = os.path.join(self.cache_dir, WRAPPER_NAME)
+        _write_script(path, WRAPPER_SCRIPT.format(
+            python=shlex.quote(sys.executable), script=shlex.quote(script)))
+        self._wrapper = _quote(path)
+        return self._wrapper
+
+    def wrap(self, compiler):
+        """Wrap the compiler command with the cache.
+
+        Args:
+            compiler (str): The compiler command, like `gcc`.
+
+        Returns:
+            str: The wrapped compiler command.
+        """
+        wrapper = _quote(self.ccache) if self.ccache else self.get_wrapper()
+        if compiler.startswith(wrapper):
+            return compiler
+        return f"{wrapper} {compiler}"
+
+
+def compile_with_cache(
+        compiler, args, cache_dir, stats_file="", basedir=""):
+    """Compile by the compiler, reuse the cached object if possible.
+
+    Args:
+        compiler (:obj:`list` of :obj:`str`): The compiler command.
+        args (:obj:`list` of :obj:`str`): The compiler arguments.
+        cache_dir (str): The directory of the cache.
+        stats_file (str, optional): The file to count the hits and misses.
+        basedir (str, optional): The directory that the sources placed in.
+            Paths under it are relocated in the cached dependency files.
+            Default is the current working directory.
+
+    Returns:
+        int: The return code of the compilation.
+    """
+    parsed = parse_args(args)
+    if not parsed:
+        return subprocess.call(compiler + args)
+    output, dep_file, key_args = parsed
+    preprocess = subprocess.run(
+        compiler + strip_output_args(args) + ["-E"], stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    if preprocess.returncode:
+        # Let the compiler report the error.
+        return subprocess.call(compiler + args)
+    hasher = hashlib.sha256()
+    hasher.update(get_compiler_id(compiler[0]).encode("utf-8"))
+    hasher.update("\0".join(key_args).encode("utf-8"))
+    # The entries stored without the dependency file never serve the
+    # compilations that need it.
+    hasher.update(b"\0deps" if dep_file else b"\0")
+    debug_args = [arg for arg in key_args if arg.startswith("-g")]
+    if debug_args and debug_args[-1] != "-g0":
+        # The debug info embeds the working directory and the paths of the
+        # source and the headers, like the `hash_dir` of ccache.
+        hasher.update(b"\0" + os.getcwd().encode("utf-8") + b"\0")
+        hasher.update(preprocess.stdout)
+    else:
+        # Remove the line markers as they contain the absolute paths.
+        hasher.update(re.sub(rb"(?m)^# \d+ .*\n", b"", preprocess.stdout))
+    key = hasher.hexdigest()
+    cache = DirectoryCache(cache_dir)
+    basedir = basedir or os.getcwd()
+    content = cache.get(key)
+    if content and (
+            not dep_file or os.path.isfile(os.path.join(content, "deps"))):
+        _replace_file(os.path.join(content, "object"), output)
+        if dep_file:
+            with open(os.path.join(content, "deps")) as file:
+                deps = file.read().replace(BASEDIR_PLACEHOLDER, basedir)
+            with open(dep_file, "w") as file:
+                file.write(deps)
+        _count(stats_file, b"h")
+        return 0
+    returncode = subprocess.call(compiler + args)
+    _count(stats_file, b"m")
+    if returncode:
+        return returncode
+    with tempfile.TemporaryDirectory() as temp_dir:
+        shutil.copy2(output, os.path.join(temp_dir, "object"))
+        if dep_file:
+            with open(dep_file) as file:
+                deps = file.read().replace(basedir, BASEDIR_PLACEHOLDER)
+            with open(os.path.join(temp_dir, "deps"), "w") as file:
+                file.write(deps)
+        cache.store(key, temp_dir)
+    return 0
+
+
+def get_compiler_id(compiler):
+    """Get the identity of the compiler by its real path, size and mtime.
+
+    Args:
+        compiler (str): The compiler executable.
+
+    Returns:
+        str: The identity of the compiler.
+    """
+    path = os.path.realpath(shutil.which(compiler) or compiler)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return f"{path}:{stat.st_size}:{stat.st_mtime}"
+
+
+def parse_args(args):
+    """Parse the compiler arguments of a cacheable compilation.
+
+    Args:
+        args (:obj:`list` of :obj:`str`): The compiler arguments.
+
+    Returns:
+        tuple: The object path, the dependency file path (empty if no
+            dependency file) and the arguments without the output paths. None
+            if the compilation can't be cached.
+    """
+    if "-c" not in args or any(arg.startswith("@") for arg in args):
+        return None
+    if any(arg in ["-E", "-M", "-MM", "-"] for arg in args):
+        return None
+    key_args = strip_output_args(args)
+    sources = [
+        arg for arg in key_args
+        if os.path.splitext(arg)[1] in SOURCE_SUFFIXES
+        and not arg.startswith("-")]
+    if len(sources) != 1:
+        return None
+    output = _get_arg_value(args, "-o") or (
+        os.path.splitext(os.path.basename(sources[0]))[0] + ".o")
+    dep_file = ""
+    if "-MD" in args or "-MMD" in args:
+        dep_file = _get_arg_value(args, "-MF") or (
+            os.path.splitext(output)[0] + ".d")
+    # The source path and the preprocessor arguments are left out of the key,
+    # as the preprocessed source already reflects them.
+    key_args = [
+        arg for arg in _strip_args(key_args, PREPROCESSOR_ARGS)
+        if arg != sources[0]]
+    return output, dep_file, key_args
+
+
+def strip_output_args(args):
+    """Remove the arguments of the output and dependency paths.
+
+    Args:
+        args (:obj:`list` of :obj:`str`): The compiler arguments.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The arguments left.
+    """
+    return [
+        arg for arg in _strip_args(args, OUTPUT_ARGS)
+        if arg not in DEPENDENCY_FLAGS]
+
+
+def _count(stats_file, flag):
+    """Append the hit or miss flag to the stats file.
+
+    Appending a single byte is atomic so concurrent compilers never lose it.
+
+    Args:
+        stats_file (str): The stats file. Do nothing if empty.
+        flag (bytes): `h` for hit, `m` for miss.
+    """
+    if stats_file:
+        with open(stats_file, "ab") as file:
+            file.write(flag)
+
+
+def _get_arg_value(args, name):
+    """Get the value of an argument like `-o file` or `-ofile`.
+
+    Args:
+        args (:obj:`list` of :obj:`str`): The compiler arguments.
+        name (str): The argument name.
+
+    Returns:
+        str: The value. Empty string if not found.
+    """
+    for index, arg in enumerate(args):
+        if arg == name and index + 1 < len(args):
+            return args[index + 1]
+        if arg.startswith(name) and len(arg) > len(name):
+            return arg[len(name):]
+    return ""
+
+
+def _quote(path):
+    """Quote the path for the shell if it contains spaces.
+
+    Args:
+        path (str): The path.
+
+    Returns:
+        str: The quoted path.
+    """
+    if platform.system() == "Windows":
+        return f'"{path}"' if " " in path else path
+    return shlex.quote(path)
+
+
+def _replace_file(src, dst):
+    """Copy src to a temporary file beside dst and rename it as dst.
+
+    Args:
+        src (str): The file to copy from.
+        dst (str): The file to replace.
+    """
+    temp = f"{dst}.rezbuild-tmp"
+    shutil.copyfile(src, temp)
+    os.replace(temp, dst)
+
+
+def _write_script(path, content):
+    """Write the executable script atomically if its content changed.
+
+    Args:
+        path (str): The script path.
+        content (str): The script content.
+    """
+    try:
+        with open(path) as file:
+            if file.read() == content:
+                return
+    except OSError:
+        pass
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, "w") as file:
+        file.write(content)
+    os.chmod(temp_path, 0o755)
+    os.replace(temp_path, path)
+
+
+def _strip_args(args, names):
+    """Remove the arguments like `-I dir` and `-Idir` by names.
+
+    Args:
+        args (:obj:`list` of :obj:`str`): The compiler arguments.
+        names (:obj:`list` of :obj:`str`): The argument names to remove.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The arguments left.
+    """
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in names:
+            skip = True
+        elif not arg.startswith(tuple(names)):
+            result.append(arg)
+    return result
+
+
+def main():
+    """Run as the compiler wrapper."""
+    compiler = sys.argv[1].split()
+    sys.exit(compile_with_cache(
+        compiler, sys.argv[2:], os.environ["REZBUILD_COMPILER_CACHE_DIR"],
+        stats_file=os.getenv("REZBUILD_COMPILER_CACHE_STATS", ""),
+        basedir=os.getenv("REZBUILD_COMPILER_CACHE_BASEDIR", "")))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,3 +8,87 @@ pwd=$( cd $( dirname $0 ) && pwd )
 path="$pwd/{app_name}"
 open -a "$path"
 """
+
+# Name of the manifest file in the installers directory.
+INSTALLER_MANIFEST = "installers.json"
+
+# Suffixes of the checksum sidecar files and their hash algorithms.
+CHECKSUM_SUFFIXES = {
+    ".md5": "md5",
+    ".sha1": "sha1",
+    ".sha256": "sha256",
+    ".sha512": "sha512",
+}
+
+# Size of the chunks to read when hashing files.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Max size of the shebang line to read from the files.
+SHEBANG_MAX_SIZE = 64 * 1024
+
+# Types of the files told by the headers, see `bin_utils.classify_file`.
+FILE_DATA = "data"
+FILE_ELF = "elf"
+FILE_MACHO = "macho"
+FILE_MACHO_FAT = "macho_fat"
+FILE_PE = "pe"
+FILE_SCRIPT = "script"
+
+# Size of the header read to classify the files.
+FILE_HEADER_SIZE = 8
+
+# Default size limit of the build cache, in bytes.
+DEFAULT_BUILD_CACHE_SIZE = 10 * 1024 ** 3
+
+# Default size limit of the wheel cache, in bytes.
+DEFAULT_WHEEL_CACHE_SIZE = 2 * 1024 ** 3
+
+# Seconds to wait for a jobserver token before running without it.
+JOBSERVER_TOKEN_TIMEOUT = 60
+
+# Default max age of the pooled build environments, in seconds.
+DEFAULT_BUILD_ENV_MAX_AGE = 7 * 24 * 3600
+
+# Directories in the source tree that never affect the built wheel.
+WHEEL_CACHE_IGNORE_NAMES = [
+    ".git", ".hg", ".svn", ".tox", ".nox", ".venv", "venv", "__pycache__",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache",
+]
+
+# Gitignore style patterns never copied into the source snapshots when the
+# source is not a git repository.
+SNAPSHOT_IGNORE_PATTERNS = [
+    ".git/", ".hg/", ".svn/", "__pycache__/", "*.py[cod]", "*~", ".*.swp",
+    ".*.swo", "#*#", ".#*", ".DS_Store", "Thumbs.db", ".idea/", ".vscode/",
+]
+
+# Default simple repository to search the installers in the PYPI mode.
+DEFAULT_PYPI_URL = "https://pypi.org/simple"
+
+# Default size limit of the download cache of the PYPI mode, in bytes.
+DEFAULT_PYPI_CACHE_SIZE = 5 * 1024 ** 3
+
+# Default number of the concurrent downloads.
+DEFAULT_DOWNLOAD_WORKERS = 8
+
+# Default size limit of the compiler cache, in bytes.
+DEFAULT_COMPILER_CACHE_SIZE = 5 * 1024 ** 3
+
+# Strategies to install the workspace into the install path.
+INSTALL_COPY = "copy"
+INSTALL_HARDLINK = "hardlink"
+INSTALL_INCREMENTAL = "incremental"
+INSTALL_MOVE = "move"
+INSTALL_REFLINK = "reflink"
+INSTALL_STRATEGIES = [
+    INSTALL_COPY, INSTALL_HARDLINK, INSTALL_INCREMENTAL, INSTALL_MOVE,
+    INSTALL_REFLINK]
+
+# Environment variables that change the configure results.
+CONFIGURE_ENV_VARS = [
+    "CC", "CFLAGS", "CPP", "CPPFLAGS", "CXX", "CXXFLAGS", "LDFLAGS", "LIBS",
+    "PATH", "PKG_CONFIG_PATH", "REZ_RESOLVE"]
+
+# Zip archives whose uncompressed size is larger than this are decompressed by
+# multiple threads.
+PARALLEL_UNZIP_SIZE = 64 * 1024 ** 2
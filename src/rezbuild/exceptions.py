@@ -13,6 +13,24 @@ class ArgumentError(RezBuildException):
     pass
 
 
+class BuildEnvError(RezBuildException):
+    """When failed to prepare the build environment."""
+
+    pass
+
+
+class ChecksumError(RezBuildException):
+    """When the checksum of the file does not match."""
+
+    pass
+
+
+class DownloadError(RezBuildException):
+    """When failed to download the file."""
+
+    pass
+
+
 class FileAlreadyExistError(RezBuildException):
     """When the file already exist."""
 
@@ -31,6 +49,12 @@ class InstallerNotFoundError(RezBuildException):
     pass
 
 
+class MakeMovableError(RezBuildException):
+    """When failed to make the files movable."""
+
+    pass
+
+
 class NotFoundPythonInBinError(RezBuildException):
     """When can't find python executable path in entry point file."""
 
@@ -0,0 +1,209 @@
+"""Index of the installers in a directory.
+
+The directory is scanned once and the index is reused by all the later
+lookups of the process until the directory changes. If the directory contains
+an `installers.json` manifest, the index is loaded from it and the directory
+is never scanned. The manifest looks like this:
+
+{
+    "installers": [
+        {"name": "installer1.zip", "size": 1024, "sha256": "..."},
+        {"name": "installer2.tar.gz", "size": 2048, "sha256": "..."}
+    ]
+}
+
+The `size` and `sha256` are optional. The manifest can be created by
+InstallerIndex.create_manifest. The checksum sidecar files like
+`installer1.zip.sha256` are not treated as installers when the installers are
+verified, see InstallerIndex.find.
+"""
+
+# Import built-in modules
+import functools
+import json
+import os
+import re
+import threading
+
+# Import local modules
+from rezbuild.constants import CHECKSUM_SUFFIXES
+from rezbuild.constants import INSTALLER_MANIFEST
+from rezbuild.utils import hash_file
+
+
+class InstallerIndex(object):
+    """The installer names and their manifest entries in a directory."""
+
+    # Files never treated as installers.
+    EXCLUDE_FILES = [".DS_Store", INSTALLER_MANIFEST]
+
+    _indexes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path, entries, signature=None):
+        """Initialize the index.
+
+        Args:
+            path (str): The directory of the installers.
+            entries (dict): The installer names and their manifest entries.
+            signature (tuple, optional): The state of the directory or the
+                manifest when the index created, to detect the changes.
+        """
+        self.path = path
+        self.entries = entries
+        self.signature = signature
+        self.names = sorted(entries)
+
+    @classmethod
+    def create_manifest(cls, path, algorithm="sha256"):
+        """Scan the directory and write the manifest with the hashes.
+
+        Args:
+            path (str): The directory of the installers.
+            algorithm (str, optional): The hash algorithm. Default is sha256.
+
+        Returns:
+            str: The path of the manifest.
+        """
+        installers = []
+        for name in cls.scan(path).names:
+            if os.path.splitext(name)[1] in CHECKSUM_SUFFIXES:
+                continue
+            filepath = os.path.join(path, name)
+            installers.append({
+                "name": name,
+                "size": os.path.getsize(filepath),
+                algorithm: hash_file(filepath, algorithm),
+            })
+        manifest = os.path.join(path, INSTALLER_MANIFEST)
+        with open(manifest, "w") as file:
+            json.dump({"installers": installers}, file, indent=4)
+        return manifest
+
+    def find(self, patterns=None, skip_checksums=False):
+        """Find the installers match any of the patterns.
+
+        Args:
+            patterns (str or :obj:`list` of :obj:`str`, optional): The regex
+                patterns to match the installer names from the beginning. Match
+                all the installers if not given.
+            skip_checksums (bool, optional): Whether to skip the checksum
+                sidecar files like `installer1.zip.sha256`. Default is False.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The paths of the installers, sorted by
+                the name.
+        """
+        names = self.names
+        if skip_checksums:
+            names = [
+                name for name in names
+                if os.path.splitext(name)[1] not in CHECKSUM_SUFFIXES]
+        if not patterns:
+            return [os.path.join(self.path, name) for name in names]
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        regexes = [_compile(pattern) for pattern in patterns]
+        return [
+            os.path.join(self.path, name) for name in names
+            if any(regex.match(name) for regex in regexes)]
+
+    @classmethod
+    def get(cls, path):
+        """Get the index of the directory, reuse it if the directory unchanged.
+
+        Args:
+            path (str): The directory of the installers.
+
+        Returns:
+            InstallerIndex: The index.
+        """
+        path = os.path.abspath(path)
+        signature = cls.get_signature(path)
+        with cls._lock:
+            index = cls._indexes.get(path)
+        if index and index.signature == signature:
+            return index
+        if signature[0] == "manifest":
+            index = cls.load_manifest(os.path.join(path, INSTALLER_MANIFEST))
+        else:
+            index = cls.scan(path)
+        index.signature = signature
+        with cls._lock:
+            cls._indexes[path] = index
+        return index
+
+    def get_entry(self, name):
+        """Get the manifest entry of the installer.
+
+        Args:
+            name (str): The installer name.
+
+        Returns:
+            dict: The manifest entry, like the `size` and the `sha256`. Empty
+                if the installer is not in a manifest.
+        """
+        return self.entries.get(name) or {}
+
+    @staticmethod
+    def get_signature(path):
+        """Get the state of the manifest or the directory by one stat.
+
+        Args:
+            path (str): The directory of the installers.
+
+        Returns:
+            tuple: The source of the index and the modification time and size.
+        """
+        try:
+            stat = os.stat(os.path.join(path, INSTALLER_MANIFEST))
+            return "manifest", stat.st_mtime_ns, stat.st_size
+        except OSError:
+            stat = os.stat(path)
+            return "scan", stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def load_manifest(cls, manifest):
+        """Load the index from the manifest without scanning the directory.
+
+        Args:
+            manifest (str): The path of the manifest.
+
+        Returns:
+            InstallerIndex: The index.
+        """
+        with open(manifest) as file:
+            data = json.load(file)
+        entries = {
+            entry["name"]: entry for entry in data.get("installers", [])
+            if entry["name"] not in cls.EXCLUDE_FILES}
+        return cls(os.path.dirname(manifest), entries)
+
+    @classmethod
+    def scan(cls, path):
+        """Create the index by scanning the directory once.
+
+        Args:
+            path (str): The directory of the installers.
+
+        Returns:
+            InstallerIndex: The index.
+        """
+        with os.scandir(path) as entries:
+            names = [
+                entry.name for entry in entries
+                if entry.name not in cls.EXCLUDE_FILES and entry.is_file()]
+        return cls(path, {name: {} for name in names})
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern):
+    """Compile the regex pattern and cache it.
+
+    Args:
+        pattern (str): The regex pattern.
+
+    Returns:
+        re.Pattern: The compiled pattern.
+    """
+    return re.compile(pattern)
@@ -0,0 +1,188 @@
+"""GNU make jobserver shared by all the make commands in this process.
+
+The jobserver is a pipe filled with job tokens. Every make command started
+with the jobserver in `MAKEFLAGS` takes a token from the pipe before starting
+an extra job and puts it back after the job finished. Each make command also
+has an implicit job slot, so the jobserver takes a token for it before the
+command starts. The total jobs of all the concurrent make commands will never
+exceed the token count. If a token is lost, like a make command killed with
+it, the implicit slot is taken without a token after a timeout instead of
+waiting forever.
+
+Reference: https://www.gnu.org/software/make/manual/html_node/Job-Slots.html
+"""
+
+# Import built-in modules
+import contextlib
+import functools
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+
+# Import local modules
+from rezbuild.constants import JOBSERVER_TOKEN_TIMEOUT
+
+
+class JobServer(object):
+    """A GNU make jobserver based on pipe."""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, jobs):
+        """Create the pipe and fill it with the tokens.
+
+        Args:
+            jobs (int): The max number of the concurrent jobs.
+        """
+        self.jobs = jobs
+        self.read_fd, self.write_fd = os.pipe()
+        for fd in [self.read_fd, self.write_fd]:
+            os.set_inheritable(fd, True)
+        os.write(self.write_fd, b"+" * jobs)
+
+    @classmethod
+    def get(cls, jobs):
+        """Get the jobserver of this process, create it if not exists.
+
+        The jobserver is created with the jobs of the first call. All the
+        later calls share the same jobserver.
+
+        Args:
+            jobs (int): The max number of the concurrent jobs.
+
+        Returns:
+            JobServer: The shared jobserver.
+        """
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(jobs)
+            elif cls._instance.jobs != jobs:
+                logging.getLogger(__name__).debug(
+                    f"Jobserver already created with {cls._instance.jobs} "
+                    f"jobs, ignore {jobs}.")
+            return cls._instance
+
+    def get_makeflags(self, version=None, makeflags=""):
+        """Get the MAKEFLAGS to make the make command a jobserver client.
+
+        Make 4.2 and later read `--jobserver-auth` with the job count, the
+        older ones read `--jobserver-fds` with a bare `-j`. The jobserver
+        flags are appended to the options of the existing MAKEFLAGS, after
+        removing its job count and jobserver flags. The variable definitions
+        after `--` are kept at the end.
+
+        Args:
+            version (tuple, optional): The version of GNU make, see
+                `get_make_version`. Default is the old make.
+            makeflags (str, optional): The existing MAKEFLAGS value.
+
+        Returns:
+            str: The MAKEFLAGS value.
+        """
+        fds = f"{self.read_fd},{self.write_fd}"
+        if version and version >= (4, 2):
+            flags = f"-j{self.jobs} --jobserver-auth={fds}"
+        else:
+            flags = f"-j --jobserver-fds={fds}"
+        match = re.search(r"(?:^|\s)--(?:\s|$)", makeflags)
+        options = makeflags[:match.start()] if match else makeflags
+        variables = " " + makeflags[match.start():].lstrip() if match else ""
+        options = [
+            option for option in options.split()
+            if not re.match(r"-j|--jobs|--jobserver-", option)]
+        return " ".join(options + [flags]) + variables
+
+    @contextlib.contextmanager
+    def slot(self, timeout=JOBSERVER_TOKEN_TIMEOUT):
+        """Take a token for the implicit job slot and put it back after.
+
+        The token is read by a helper thread. If no token comes in the
+        timeout, the slot is taken without a token, and the token read later
+        is put back at once.
+
+        Args:
+            timeout (float, optional): The seconds to wait for the token.
+
+        Yields:
+            bytes: The token, empty if timed out.
+        """
+        tokens = queue.Queue()
+        lock = threading.Lock()
+        abandoned = []
+
+        def read():
+            token = os.read(self.read_fd, 1)
+            with lock:
+                if abandoned:
+                    os.write(self.write_fd, token)
+                else:
+                    tokens.put(token)
+
+        threading.Thread(target=read, daemon=True).start()
+        try:
+            token = tokens.get(timeout=timeout)
+        except queue.Empty:
+            with lock:
+                try:
+                    token = tokens.get_nowait()
+                except queue.Empty:
+                    abandoned.append(True)
+                    token = b""
+            if not token:
+                logging.getLogger(__name__).warning(
+                    f"No jobserver token in {timeout} seconds, a token may be "
+                    f"lost. Run without the token.")
+        try:
+            yield token
+        finally:
+            if token:
+                os.write(self.write_fd, token)
+
+    def run(self, cmds, env=None, **kwargs):
+        """Run the make command as a client of the jobserver.
+
+        Args:
+            cmds (:obj:`list` of :obj:`str`): The make command.
+            env (dict, optional): The environment variables. Default is the
+                current environment.
+            kwargs: Other key word arguments to pass to subprocess.run.
+
+        Returns:
+            subprocess.CompletedProcess: The result of the command.
+        """
+        env = dict(env or os.environ)
+        make = shutil.which(cmds[0], path=env.get("PATH")) or cmds[0]
+        env["MAKEFLAGS"] = self.get_makeflags(
+            get_make_version(make), env.get("MAKEFLAGS", ""))
+        with self.slot():
+            return subprocess.run(
+                cmds, env=env, pass_fds=(self.read_fd, self.write_fd),
+                **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def get_make_version(make="make"):
+    """Get the version of GNU make.
+
+    Args:
+        make (str, optional): The make executable. Default is `make`.
+
+    Returns:
+        tuple: The major and minor version numbers. Empty tuple if the
+            executable is not GNU make or failed to run.
+    """
+    try:
+        result = subprocess.run(
+            [make, "--version"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+    except OSError:
+        return ()
+    match = re.search(rb"GNU Make (\d+)\.(\d+)", result.stdout)
+    if not match:
+        return ()
+    return int(match.group(1)), int(match.group(2))
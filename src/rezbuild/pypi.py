@@ -0,0 +1,715 @@
+"""Find and download the files from a PEP 503 simple repository.
+
+The index can be any simple repository URL, like the PyPI, a mirror or a local
+directory by `file://`. Both the HTML (PEP 503) and the JSON (PEP 691) pages
+are supported. The files are downloaded concurrently over kept alive
+connections, verified by the hashes in the index, and stored into a local
+cache so that the same file is never downloaded twice. The files are always
+hard linked or copied out of the cache into the download directory, so the
+eviction of the cache never removes a file in use.
+
+Reference: https://peps.python.org/pep-0503/
+"""
+
+# Import built-in modules
+import hashlib
+import html.parser
+import http.client
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Import local modules
+from rezbuild.constants import HASH_CHUNK_SIZE
+from rezbuild.exceptions import ChecksumError
+from rezbuild.exceptions import DownloadError
+from rezbuild.exceptions import InstallerNotFoundError
+
+# The content types of the index pages, prefer JSON.
+ACCEPT = (
+    "application/vnd.pypi.simple.v1+json, "
+    "application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.1")
+
+# The max number of the redirects to follow.
+MAX_REDIRECTS = 5
+
+# The suffixes of the source archives.
+SDIST_SUFFIXES = [".tar.gz", ".zip", ".tar.bz2", ".tar.xz", ".tgz"]
+
+# The hash algorithms to verify the files, from the strongest.
+HASH_ALGORITHMS = ["sha512", "sha384", "sha256", "sha224", "sha1", "md5"]
+
+# Print the wheel tags the interpreter supports, only the implementation and
+# the version if `packaging` is not installed for it.
+SUPPORTED_TAGS_SCRIPT = """import json
+import sys
+try:
+    from packaging import tags
+except ImportError:
+    tags = None
+print(json.dumps({
+    "tags": [str(tag) for tag in tags.sys_tags()] if tags else None,
+    "implementation": sys.implementation.name,
+    "version": list(sys.version_info[:2])}))
+"""
+
+
+class SimpleIndex(object):
+    """Client of a PEP 503 simple repository."""
+
+    def __init__(
+            self, index_url, download_dir, cache=None, workers=8,
+            timeout=60):
+        """Initialize the client.
+
+        Args:
+            index_url (str): The URL of the simple repository, like
+                `https://pypi.org/simple`.
+            download_dir (str): The directory to put the downloaded files if
+                the cache is not given or the file is too big to cache.
+            cache (DirectoryCache, optional): The cache to store the
+                downloaded files.
+            workers (int, optional): The number of the concurrent downloads.
+                Default is 8.
+            timeout (int, optional): The timeout in seconds of the
+                connections. Default is 60.
+        """
+        self.index_url = index_url.rstrip("/") + "/"
+        self.cache = cache
+        self.download_dir = download_dir
+        self.workers = workers
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close all the kept alive connections of all the threads.
+
+        The closed connections reconnect when they are used again.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def download(self, files):
+        """Download the files concurrently, skip the cached ones.
+
+        Args:
+            files (:obj:`list` of :obj:`dict`): The files from list_files.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The local paths of the files, in the
+                same order as the given files.
+
+        Raises:
+            ChecksumError: When the file does not match the hash.
+            DownloadError: When failed to download the file.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(self.download_file, file)
+                    for file in files]
+        finally:
+            # The connections of the finished threads are never reused.
+            self.close()
+        return [future.result() for future in futures]
+
+    def download_file(self, file):
+        """Download the file if it is not in the cache.
+
+        The file is hard linked or copied into the download directory, so it
+        is kept even if the cache entry is evicted later.
+
+        Args:
+            file (dict): The file from list_files.
+
+        Returns:
+            str: The local path of the file in the download directory.
+
+        Raises:
+            ChecksumError: When the file does not match the hash.
+            DownloadError: When failed to download the file.
+        """
+        key = self.get_cache_key(file)
+        path = os.path.join(self.download_dir, file["filename"])
+        os.makedirs(self.download_dir, exist_ok=True)
+        if self.cache:
+            content = self.cache.get(key)
+            if content and _pin_file(
+                    os.path.join(content, file["filename"]), path):
+                logging.getLogger(__name__).debug(f"Cache hit: {path}")
+                return path
+        temp_dir = tempfile.mkdtemp(
+            dir=self.cache.temp_root if self.cache else self.download_dir)
+        try:
+            temp_file = os.path.join(temp_dir, file["filename"])
+            print(f"\nDownload: {file['url']}")
+            self.fetch_file(file, temp_file)
+            if self.cache:
+                _pin_file(temp_file, path)
+                self.cache.store(key, temp_file, move=True)
+            else:
+                shutil.move(temp_file, path)
+            return path
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def fetch_file(self, file, path):
+        """Stream the file to the path and verify the hash.
+
+        Args:
+            file (dict): The file from list_files.
+            path (str): The local path to write to.
+
+        Raises:
+            ChecksumError: When the file does not match the hash.
+            DownloadError: When failed to download the file.
+        """
+        algorithm = next(
+            (name for name in HASH_ALGORITHMS if name in file["hashes"]), "")
+        hasher = hashlib.new(algorithm) if algorithm else None
+        with open(path, "wb") as output:
+            for chunk in self.stream(file["url"]):
+                if hasher:
+                    hasher.update(chunk)
+                output.write(chunk)
+        if hasher and hasher.hexdigest() != file["hashes"][algorithm]:
+            raise ChecksumError(
+                f"The {algorithm} of {file['url']} does not match the index.")
+
+    @staticmethod
+    def get_cache_key(file):
+        """Get the cache key of the file, by its hash if known.
+
+        Args:
+            file (dict): The file from list_files.
+
+        Returns:
+            str: The cache key.
+        """
+        for algorithm in HASH_ALGORITHMS:
+            if algorithm in file["hashes"]:
+                return f"{algorithm}-{file['hashes'][algorithm]}"
+        url = file["url"].split("#")[0]
+        return "url-" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def list_files(self, project):
+        """List the files of the project in the index.
+
+        Args:
+            project (str): The project name.
+
+        Returns:
+            :obj:`list` of :obj:`dict`: The files. Each item contains the
+                `filename`, `url`, `hashes`, `requires_python` and `yanked`.
+
+        Raises:
+            DownloadError: When failed to fetch the index page.
+            InstallerNotFoundError: When the project is not in the index.
+        """
+        url = urllib.parse.urljoin(
+            self.index_url, f"{normalize_name(project)}/")
+        try:
+            chunks, content_type, url = self.read(url)
+        except InstallerNotFoundError:
+            raise InstallerNotFoundError(
+                f"Project {project} not found in {self.index_url}.")
+        content = b"".join(chunks)
+        if "json" in content_type:
+            return parse_json_page(content.decode("utf-8"), url)
+        return parse_html_page(content.decode("utf-8"), url)
+
+    def read(self, url):
+        """Request the URL over a kept alive connection of this thread.
+
+        The `file://` URLs and the requests through a proxy are handled by
+        urllib without the connection pool.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            tuple: The iterator of the content chunks, the content type and
+                the final URL after the redirects.
+
+        Raises:
+            DownloadError: When failed to fetch the URL.
+            InstallerNotFoundError: When the URL is not found.
+        """
+        url = url.split("#")[0]
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ["http", "https"] or _use_proxy(parts):
+                return self._read_by_urllib(url)
+            response = self._request(parts)
+            if response.status in [301, 302, 303, 307, 308]:
+                response.read()
+                url = urllib.parse.urljoin(
+                    url, response.getheader("Location", ""))
+                continue
+            if response.status == 404:
+                response.read()
+                raise InstallerNotFoundError(f"Not found: {url}")
+            if response.status != 200:
+                response.read()
+                raise DownloadError(
+                    f"Failed to fetch {url}: {response.status} "
+                    f"{response.reason}")
+            content_type = response.getheader("Content-Type", "")
+            return _iter_response(response), content_type, url
+        raise DownloadError(f"Too many redirects: {url}")
+
+    def stream(self, url):
+        """Stream the content of the URL.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            iterator: The chunks of the content.
+
+        Raises:
+            DownloadError: When failed to fetch the URL.
+            InstallerNotFoundError: When the URL is not found.
+        """
+        return self.read(url)[0]
+
+    def _get_connection(self, parts, new=False):
+        """Get the kept alive connection of the host for this thread.
+
+        Args:
+            parts (urllib.parse.SplitResult): The parts of the URL.
+            new (bool, optional): Whether to replace the existing connection.
+
+        Returns:
+            http.client.HTTPConnection: The connection.
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (parts.scheme, parts.netloc)
+        if new and key in connections:
+            connections.pop(key).close()
+        if key not in connections:
+            cls = (
+                http.client.HTTPSConnection if parts.scheme == "https"
+                else http.client.HTTPConnection)
+            connections[key] = cls(parts.netloc, timeout=self.timeout)
+            with self._lock:
+                self._connections.append(connections[key])
+        return connections[key]
+
+    def _read_by_urllib(self, url):
+        """Request the URL by urllib.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            tuple: The iterator of the content chunks, the content type and
+                the final URL.
+
+        Raises:
+            DownloadError: When failed to fetch the URL.
+            InstallerNotFoundError: When the URL is not found.
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "file":
+            path = urllib.request.url2pathname(parts.path)
+            if os.path.isdir(path):
+                # A static directory served without the index.html.
+                path = os.path.join(path, "index.html")
+            if not os.path.isfile(path):
+                raise InstallerNotFoundError(f"Not found: {url}")
+            content_type = "text/html"
+            if path.endswith(".json"):
+                content_type = "application/vnd.pypi.simple.v1+json"
+            return _iter_file(path), content_type, url
+        request = urllib.request.Request(url, headers={"Accept": ACCEPT})
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise InstallerNotFoundError(f"Not found: {url}")
+            raise DownloadError(f"Failed to fetch {url}: {e}") from e
+        except OSError as e:
+            raise DownloadError(f"Failed to fetch {url}: {e}") from e
+        content_type = response.headers.get("Content-Type", "")
+        return _iter_response(response), content_type, response.geturl()
+
+    def _request(self, parts):
+        """Send the GET request, retry once on a dropped connection.
+
+        Args:
+            parts (urllib.parse.SplitResult): The parts of the URL.
+
+        Returns:
+            http.client.HTTPResponse: The response.
+
+        Raises:
+            DownloadError: When failed to send the request.
+        """
+        target = urllib.parse.urlunsplit(
+            ("", "", parts.path or "/", parts.query, ""))
+        for retry in [False, True]:
+            connection = self._get_connection(parts, new=retry)
+            try:
+                connection.request(
+                    "GET", target, headers={"Accept": ACCEPT})
+                return connection.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                # The server may close the kept alive connection at any time.
+                connection.close()
+                if retry:
+                    raise DownloadError(
+                        f"Failed to fetch {urllib.parse.urlunsplit(parts)}: "
+                        f"{e}") from e
+
+
+class _LinkParser(html.parser.HTMLParser):
+    """Collect the anchors of the simple repository page."""
+
+    def __init__(self):
+        """Initialize the parser."""
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        """Collect the attributes of the anchor.
+
+        Args:
+            tag (str): The tag name.
+            attrs (list): The attributes of the tag.
+        """
+        if tag == "a":
+            self.links.append(dict(attrs))
+
+
+def get_supported_tags(python=None, env=None):
+    """Get the wheel tags supported by the python interpreter.
+
+    The interpreter is asked for its tags by `packaging`. If `packaging` is
+    not installed for it, the tags are derived from its implementation and
+    version by the `packaging` of the current interpreter, otherwise only the
+    pure python tags.
+
+    Args:
+        python (str, optional): The python interpreter. Default is the
+            current interpreter.
+        env (dict, optional): The environment to run the interpreter.
+
+    Returns:
+        dict: The tags like `cp39-cp39-manylinux_2_17_x86_64` and their
+            priority, the smaller the better.
+    """
+    if not python or python == sys.executable:
+        info = {
+            "tags": None, "implementation": sys.implementation.name,
+            "version": list(sys.version_info[:2])}
+        try:
+            # Import third-party modules
+            from packaging import tags
+
+            info["tags"] = [str(tag) for tag in tags.sys_tags()]
+        except ImportError:
+            pass
+    else:
+        # Not run in the current directory, which may shadow `packaging`.
+        try:
+            result = subprocess.run(
+                [python, "-c", SUPPORTED_TAGS_SCRIPT], env=env,
+                cwd=os.path.dirname(python) or None, check=True,
+                stdout=subprocess.PIPE, universal_newlines=True)
+            info = json.loads(result.stdout)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            logging.getLogger(__name__).warning(
+                f"Failed to get the wheel tags of {python}: {e}. Use the "
+                f"tags of the current interpreter.")
+            return get_supported_tags()
+    tags_ = info["tags"] or _get_version_tags(
+        info["implementation"], *info["version"])
+    return {tag: rank for rank, tag in enumerate(tags_)}
+
+
+def _get_version_tags(implementation, major, minor):
+    """Get the wheel tags of the python implementation and version.
+
+    Args:
+        implementation (str): The implementation name like `cpython`.
+        major (int): The major version.
+        minor (int): The minor version.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The tags, from the most preferred.
+    """
+    pure_tags = [f"py{major}{minor}-none-any", f"py{major}-none-any"] + [
+        f"py{major}{minor_}-none-any" for minor_ in range(minor - 1, -1, -1)]
+    if implementation != "cpython":
+        return pure_tags
+    try:
+        # Import third-party modules
+        from packaging import tags
+    except ImportError:
+        return pure_tags
+    platforms = list(tags.platform_tags())
+    return [str(tag) for tag in tags.cpython_tags(
+        (major, minor), platforms=platforms)] + [
+        str(tag) for tag in tags.compatible_tags(
+            (major, minor), f"cp{major}{minor}", platforms)]
+
+
+def match_files(files, patterns):
+    """Filter the files by the regex patterns of the file names.
+
+    Args:
+        files (:obj:`list` of :obj:`dict`): The files from list_files.
+        patterns (str or :obj:`list` of :obj:`str`): The regex patterns to
+            match the file names from the beginning.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: The not yanked files match any pattern.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    regexes = [re.compile(pattern) for pattern in patterns]
+    return [
+        file for file in files if not file["yanked"]
+        and any(regex.match(file["filename"]) for regex in regexes)]
+
+
+def normalize_name(name):
+    """Normalize the project name as PEP 503.
+
+    Args:
+        name (str): The project name.
+
+    Returns:
+        str: The normalized name.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_filename(filename):
+    """Parse the project name, version and tags from the distribution name.
+
+    Args:
+        filename (str): The file name of the wheel or the source archive.
+
+    Returns:
+        tuple: The project name, the version and the set of the wheel tags
+            (None for the source archives). None if it is not a distribution.
+    """
+    if filename.endswith(".whl"):
+        parts = filename[:-len(".whl")].split("-")
+        if len(parts) not in [5, 6]:
+            return None
+        pythons, abis, platforms = parts[-3:]
+        tags = {
+            f"{python}-{abi}-{platform_}" for python in pythons.split(".")
+            for abi in abis.split(".") for platform_ in platforms.split(".")}
+        return parts[0], parts[1], tags
+    for suffix in SDIST_SUFFIXES:
+        if filename.endswith(suffix):
+            name, sep, version = filename[:-len(suffix)].rpartition("-")
+            return (name, version, None) if sep else None
+    return None
+
+
+def parse_html_page(content, url):
+    """Parse the files from the HTML project page.
+
+    Args:
+        content (str): The page content.
+        url (str): The URL of the page, to resolve the relative links.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: The files.
+    """
+    parser = _LinkParser()
+    parser.feed(content)
+    files = []
+    for link in parser.links:
+        href = link.get("href")
+        if not href:
+            continue
+        file_url = urllib.parse.urljoin(url, href)
+        path, _, fragment = file_url.partition("#")
+        algorithm, _, digest = fragment.partition("=")
+        files.append({
+            "filename": urllib.parse.unquote(path.rstrip("/").split("/")[-1]),
+            "url": file_url,
+            "hashes": {algorithm: digest} if digest else {},
+            "requires_python": link.get("data-requires-python") or "",
+            "yanked": "data-yanked" in link,
+        })
+    return files
+
+
+def parse_json_page(content, url):
+    """Parse the files from the JSON project page.
+
+    Args:
+        content (str): The page content.
+        url (str): The URL of the page, to resolve the relative links.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: The files.
+    """
+    files = []
+    for file in json.loads(content).get("files", []):
+        files.append({
+            "filename": file["filename"],
+            "url": urllib.parse.urljoin(url, file["url"]),
+            "hashes": file.get("hashes") or {},
+            "requires_python": file.get("requires-python") or "",
+            "yanked": bool(file.get("yanked")),
+        })
+    return files
+
+
+def select_files(files, project, version, supported=None):
+    """Select the source archives and the best wheel of the version.
+
+    Args:
+        files (:obj:`list` of :obj:`dict`): The files from list_files.
+        project (str): The project name.
+        version (str): The version.
+        supported (dict, optional): The supported tags and their priority
+            from get_supported_tags. Default is the tags of the current
+            interpreter.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: The most compatible wheel, followed by
+            the source archives.
+    """
+    if supported is None:
+        supported = get_supported_tags()
+    wheels = []
+    sdists = []
+    for file in files:
+        parsed = parse_filename(file["filename"])
+        if file["yanked"] or not parsed:
+            continue
+        name, version_, tags = parsed
+        if normalize_name(name) != normalize_name(project) or (
+                not _is_same_version(version_, version)):
+            continue
+        if tags is None:
+            sdists.append(file)
+            continue
+        ranks = [supported[tag] for tag in tags if tag in supported]
+        if ranks:
+            wheels.append((min(ranks), file))
+    wheels.sort(key=lambda wheel: wheel[0])
+    return [file for _, file in wheels[:1]] + sdists
+
+
+def _is_same_version(version, other):
+    """Check whether the versions are the same, like `1.0` and `1.0.0`.
+
+    Args:
+        version (str): The version.
+        other (str): The other version.
+
+    Returns:
+        bool: True if they are the same.
+    """
+    if version == other:
+        return True
+    try:
+        # Import third-party modules
+        from packaging.version import InvalidVersion
+        from packaging.version import Version
+    except ImportError:
+        return False
+    try:
+        return Version(version) == Version(other)
+    except InvalidVersion:
+        return False
+
+
+def _iter_file(path):
+    """Read the local file in chunks.
+
+    Args:
+        path (str): The file path.
+
+    Yields:
+        bytes: The chunks of the file.
+    """
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            yield chunk
+
+
+def _iter_response(response):
+    """Read the response in chunks.
+
+    Args:
+        response (http.client.HTTPResponse): The response.
+
+    Yields:
+        bytes: The chunks of the response.
+    """
+    try:
+        for chunk in iter(lambda: response.read(HASH_CHUNK_SIZE), b""):
+            yield chunk
+    finally:
+        response.close()
+
+
+def _pin_file(src, dst):
+    """Hard link or copy the file, replace the destination atomically.
+
+    Args:
+        src (str): The file to link or copy from, like a file in the cache.
+        dst (str): The destination path.
+
+    Returns:
+        bool: True if done. False if the source file is gone, like evicted
+            from the cache.
+    """
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(dst))
+    try:
+        temp_file = os.path.join(temp_dir, os.path.basename(dst))
+        try:
+            os.link(src, temp_file)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            try:
+                shutil.copy2(src, temp_file)
+            except FileNotFoundError:
+                return False
+        os.replace(temp_file, dst)
+        return True
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _use_proxy(parts):
+    """Check whether the request of the URL goes through a proxy.
+
+    Args:
+        parts (urllib.parse.SplitResult): The parts of the URL.
+
+    Returns:
+        bool: True if a proxy is set for the scheme and the host is not
+            bypassed by `no_proxy`.
+    """
+    if not urllib.request.getproxies().get(parts.scheme):
+        return False
+    return not urllib.request.proxy_bypass(parts.hostname or "")
@@ -0,0 +1,49 @@
+"""Share the variant independent build stages between concurrent builders.
+
+When the variants of a package are built in one process, stages like creating
+the same wheel or extracting the same archives only need to run once. The
+first builder runs the stage, the others wait for it and reuse the result.
+"""
+
+# Import built-in modules
+import threading
+from concurrent.futures import Future
+
+
+class SharedStages(object):
+    """Run each stage once and share the result by the stage key."""
+
+    def __init__(self):
+        """Initialize the shared stages."""
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def run(self, key, function, *args, **kwargs):
+        """Run the stage if it has not run with the same key.
+
+        If another thread is running the stage with the same key, wait for it
+        and return its result. The exception of the stage is raised for all
+        the callers.
+
+        Args:
+            key (hashable): The key of the stage. Should contain everything
+                that changes the stage result.
+            function (callable): The stage function.
+            args: The arguments to pass to the function.
+            kwargs: The key word arguments to pass to the function.
+
+        Returns:
+            The result of the stage.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+        if owner:
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
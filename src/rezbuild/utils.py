@@ -1,13 +1,33 @@
 """Utilities for rez_builder."""
 
 # Import built-in modules
+import errno
+import hashlib
+import logging
 import os
 import platform
+import re
 import shutil
 import stat
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Import local modules
+from rezbuild.constants import HASH_CHUNK_SIZE
+from rezbuild.constants import INSTALL_COPY
+from rezbuild.constants import INSTALL_HARDLINK
+from rezbuild.constants import INSTALL_INCREMENTAL
+from rezbuild.constants import INSTALL_MOVE
+from rezbuild.constants import INSTALL_REFLINK
+from rezbuild.constants import INSTALL_STRATEGIES
+from rezbuild.constants import SNAPSHOT_IGNORE_PATTERNS
+from rezbuild.exceptions import ArgumentError
 from rezbuild.exceptions import FileAlreadyExistError
+from rezbuild.exceptions import UnsupportedError
+
+# The ioctl request number to clone a file on Linux, from linux/fs.h.
+FICLONE = 0x40049409
 
 
 def clear_path(path):
@@ -23,30 +43,82 @@ def clear_path(path):
 
 def copy_tree(
         src, dst, dirs_exist_ok=False, follow_symlinks=True,
-        file_overwrite=False):
+        file_overwrite=False, workers=None):
+    """Copy the directory tree with a pool of threads.
+
+    The directories are created while walking the source tree, before the
+    file copies inside them are scheduled to the thread pool.
+
+    Args:
+        src (str): The directory to copy from.
+        dst (str): The directory to copy to.
+        dirs_exist_ok (bool, optional): Whether to merge into the destination
+            directory if it already exists. Default is False.
+        follow_symlinks (bool, optional): Whether to copy the symbolic links
+            as symbolic links when creating new directories. Default is True.
+        file_overwrite (bool, optional): Whether to overwrite the file when
+            the destination file already exists. Default is False.
+        workers (int, optional): The number of the copy threads. Get from the
+            `REZBUILD_COPY_WORKERS` environment variable if not given. Default
+            is the cpu count plus 4, at most 32.
+
+    Raises:
+        FileAlreadyExistError: When the file already exists and file_overwrite
+            is False.
+        FileExistsError: When the destination exists and dirs_exist_ok is
+            False.
     """
+    if not dirs_exist_ok and os.path.exists(dst):
+        raise FileExistsError(errno.EEXIST, "File exists", dst)
+    workers = get_copy_workers(workers)
+    created_dirs = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        try:
+            _schedule_copy_tree(
+                src, dst, executor, futures, created_dirs, follow_symlinks,
+                file_overwrite)
+        finally:
+            # Wait the scheduled copies even if failed to schedule the others.
+            errors = [
+                future.exception() for future in futures
+                if future.exception()]
+        if errors:
+            raise errors[0]
+    for src_dir, dst_dir in reversed(created_dirs):
+        shutil.copystat(src_dir, dst_dir)
+
+
+def get_copy_workers(workers=None):
+    """Get the number of the copy threads.
+
+    Args:
+        workers (int, optional): The number of the copy threads. Get from the
+            `REZBUILD_COPY_WORKERS` environment variable if not given.
 
+    Returns:
+        int: The number of the copy threads.
+    """
+    return get_workers(
+        workers, "REZBUILD_COPY_WORKERS", min(32, get_cpu_count() + 4))
+
+
+def get_cpu_count():
+    """Get the number of the cpus this process can use.
+
+    Respect the cpu affinity and the cgroup cpu quota on Linux.
+
+    Returns:
+        int: The number of the available cpus.
     """
-    if not dirs_exist_ok or not os.path.exists(dst):
-        shutil.copytree(src, dst, symlinks=follow_symlinks)
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
     else:
-        for file in os.listdir(src):
-            src_ = os.path.join(src, file)
-            dst_ = os.path.join(dst, file)
-            if os.path.isfile(src_) or os.path.islink(src_):
-                if not os.path.exists(dst_):
-                    shutil.copy2(src_, dst_)
-                elif os.path.exists(dst_) and file_overwrite:
-                    shutil.copy2(src_, dst_)
-                else:
-                    raise FileAlreadyExistError(
-                        f"File {dst_} already exist. Set the file_overwrite "
-                        f"as True if you want overwrite it.")
-            else:
-                copy_tree(
-                    src_, dst_, dirs_exist_ok=dirs_exist_ok,
-                    follow_symlinks=follow_symlinks,
-                    file_overwrite=file_overwrite)
+        count = os.cpu_count() or 1
+    quota = _get_cgroup_cpu_quota()
+    if quota:
+        count = min(count, quota)
+    return max(1, count)
 
 
 def get_delimiter():
@@ -61,6 +133,33 @@ def get_delimiter():
         return ":"
 
 
+def get_git_revision(root):
+    """Get the git revision and the nearest tag of the work tree.
+
+    Tools like setuptools_scm get the version from them. Read the `HEAD`, the
+    `packed-refs` and the tag refs of the `.git` directory if git is not
+    available.
+
+    Args:
+        root (str): The directory inside a git work tree.
+
+    Returns:
+        str: The revision and the description by the tags. Empty string if the
+            root is not in a git work tree.
+    """
+    if not shutil.which("git"):
+        return _read_git_refs(root)
+    values = []
+    for command in [["rev-parse", "HEAD"], ["describe", "--tags", "--long"]]:
+        result = subprocess.run(
+            ["git"] + command, cwd=root, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        # describe fails in the repository without tags.
+        values.append(
+            "" if result.returncode else os.fsdecode(result.stdout).strip())
+    return "\n".join(values) if values[0] else ""
+
+
 def get_relative_path(from_path, to_path):
     """Get the relative path between two paths.
 
@@ -80,6 +179,389 @@ def get_relative_path(from_path, to_path):
     return "/".join(['..'] * (len(folders1) - length) + folders2[length:])
 
 
+def get_tree_size(path):
+    """Get the total size of all the files under the path.
+
+    Symbolic links are counted by the size of the link itself.
+
+    Args:
+        path (str): The file or directory to measure.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def get_workers(workers, env_name, default):
+    """Get the number of the worker threads.
+
+    Args:
+        workers (int): The number of the worker threads. Get from the
+            environment variable if not given.
+        env_name (str): The name of the environment variable.
+        default (int): The default number if both are empty.
+
+    Returns:
+        int: The number of the worker threads, at least 1.
+    """
+    workers = workers or int(os.getenv(env_name, 0))
+    return max(1, workers or default)
+
+
+def hash_file(path, algorithm="sha256"):
+    """Hash the content of the file.
+
+    The file is read in chunks so that the big file never be loaded into the
+    memory at once.
+
+    Args:
+        path (str): The path of the file to hash.
+        algorithm (str, optional): The hash algorithm name supported by
+            hashlib. Default is sha256.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_tree(path, hasher, excludes=None, ignore_names=None):
+    """Feed the relative paths and file contents under the path to hasher.
+
+    Files are visited in sorted order so the same tree always gives the same
+    digest. Symbolic links, including the links to directories, are hashed by
+    their targets and not followed.
+
+    Args:
+        path (str): The file or directory to hash.
+        hasher (hashlib._Hash): The hash object to update.
+        excludes (:obj:`list` of :obj:`str`, optional): Paths to skip.
+        ignore_names (:obj:`list` of :obj:`str`, optional): Names of the
+            directories to skip, like `.git`.
+    """
+    excludes = [os.path.abspath(exclude) for exclude in excludes or []]
+    ignore_names = ignore_names or []
+    if not os.path.isdir(path):
+        hasher.update(os.path.basename(path).encode("utf-8"))
+        hasher.update(hash_file(path).encode("utf-8"))
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(
+            dir_ for dir_ in dirs if dir_ not in ignore_names
+            and os.path.abspath(os.path.join(root, dir_)) not in excludes)
+        links = [
+            dir_ for dir_ in dirs if os.path.islink(os.path.join(root, dir_))]
+        dirs[:] = [dir_ for dir_ in dirs if dir_ not in links]
+        for name in sorted(files + links):
+            filepath = os.path.join(root, name)
+            if os.path.abspath(filepath) in excludes:
+                continue
+            relpath = os.path.relpath(filepath, path).replace("\\", "/")
+            hasher.update(relpath.encode("utf-8") + b"\x00")
+            if os.path.islink(filepath):
+                hasher.update(os.readlink(filepath).encode("utf-8"))
+            else:
+                hasher.update(hash_file(filepath).encode("utf-8"))
+            hasher.update(b"\x00")
+
+
+def install_tree(src, dst, strategy=INSTALL_COPY, use_hash=False):
+    """Install the directory tree to the destination.
+
+    The destination will be removed before installing, except for the
+    `incremental` strategy which only updates the changed files and reports
+    the statistics of `sync_tree`. A symbolic link destination is unlinked,
+    the directory it points to is kept. The strategy falls back to `copy` when
+    it is not supported by the system or the file system.
+
+    Args:
+        src (str): The directory to install from.
+        dst (str): The directory to install to.
+        strategy (str, optional): One of `copy`, `hardlink`, `incremental`,
+            `reflink` and `move`. Default is `copy`.
+        use_hash (bool, optional): Whether to compare the file content by hash
+            in `incremental` strategy. Default is False.
+
+    Returns:
+        tuple: The strategy actually used and the statistics of the
+            `incremental` strategy, None for the other strategies.
+
+    Raises:
+        ArgumentError: When the strategy is unknown.
+    """
+    if strategy not in INSTALL_STRATEGIES:
+        raise ArgumentError(
+            f"Unknown install strategy {strategy}, choose from "
+            f"{INSTALL_STRATEGIES}.")
+    if strategy == INSTALL_INCREMENTAL:
+        if os.path.islink(dst) or os.path.isfile(dst):
+            _remove_path(dst)
+        stats = sync_tree(src, dst, use_hash=use_hash)
+        logging.getLogger(__name__).info(
+            f"Incremental install {dst}: added {stats['added_files']} files "
+            f"({stats['added_bytes']} bytes), updated {stats['copied_files']} "
+            f"files ({stats['copied_bytes']} bytes), skipped "
+            f"{stats['skipped_files']} files ({stats['skipped_bytes']} "
+            f"bytes), removed {stats['removed_files']} files.")
+        return strategy, stats
+    if os.path.lexists(dst):
+        _remove_path(dst)
+    parent = os.path.dirname(os.path.abspath(dst))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    functions = {
+        INSTALL_HARDLINK: link_tree,
+        INSTALL_MOVE: os.rename,
+        INSTALL_REFLINK: reflink_tree,
+    }
+    if strategy in functions:
+        try:
+            functions[strategy](src, dst)
+            return strategy, None
+        except (OSError, shutil.Error, subprocess.CalledProcessError,
+                UnsupportedError) as e:
+            logging.getLogger(__name__).warning(
+                f"Install strategy {strategy} unsupported, fall back to "
+                f"{INSTALL_COPY}: {e}")
+            if os.path.lexists(dst):
+                _remove_path(dst)
+    copy_tree(src, dst, follow_symlinks=True)
+    return INSTALL_COPY, None
+
+
+def link_tree(src, dst):
+    """Recreate the directory tree and hard link all the files.
+
+    Symbolic links are copied as symbolic links.
+
+    Args:
+        src (str): The directory to link from.
+        dst (str): The directory to link to. Should be on the same file system
+            as src.
+
+    Raises:
+        UnsupportedError: When hard link is not supported between src and dst.
+    """
+    _probe(src, dst, os.link)
+    shutil.copytree(src, dst, symlinks=True, copy_function=os.link)
+
+
+def list_source_files(root, includes=None):
+    """List the files of the source tree that should go into a snapshot.
+
+    The files are chosen by the first available rule:
+
+    1. The files match the includes patterns if given.
+    2. The tracked and the untracked but not ignored files reported by
+       `git ls-files`, if the root is inside a git work tree and any file is
+       reported. The untracked files match the SNAPSHOT_IGNORE_PATTERNS are
+       ignored too.
+    3. The files not ignored by the `.gitignore` files under the root and the
+       SNAPSHOT_IGNORE_PATTERNS, like when the root is inside a directory
+       ignored by the enclosing git work tree.
+
+    Only the directories that may hold the included files are walked in the
+    first rule, like only `src` for `src/*.py`.
+
+    Args:
+        root (str): The source root.
+        includes (:obj:`list` of :obj:`str`, optional): Gitignore style
+            patterns relative to the root, like `src/` or `*.toml`. A file is
+            included if the last pattern that matches it or any of its parent
+            directories is not negated by `!`.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The sorted relative paths of the files,
+            separated by `/`.
+    """
+    if includes:
+        rules = [
+            rule for rule in (
+                _parse_ignore_pattern(pattern, "") for pattern in includes)
+            if rule]
+        prefixes = [
+            _get_include_prefix(pattern) for pattern in includes
+            if pattern.strip() and not pattern.startswith(("!", "#"))]
+        files = _walk_files(root, lambda path, is_dir: (
+            os.path.basename(path) == ".git"
+            or not _may_include(path, prefixes) if is_dir
+            else not _is_included(path, rules)))
+    else:
+        files = _get_git_files(root)
+        if not files:
+            if files is not None:
+                logging.getLogger(__name__).warning(
+                    f"No file of {root} is listed by git, it may be ignored "
+                    f"by the enclosing work tree. List by the .gitignore "
+                    f"files instead.")
+            files = _list_not_ignored(root)
+    return sorted(files)
+
+
+def sync_tree(src, dst, use_hash=False, workers=None):
+    """Update the destination tree to be the same as the source tree.
+
+    Only the new or changed files are copied, the files only exist in the
+    destination are removed. A file is unchanged if it has the same size and
+    modification time in nanoseconds, which are preserved by the copy, or the
+    same content when use_hash is True.
+
+    Args:
+        src (str): The directory to sync from.
+        dst (str): The directory to sync to.
+        use_hash (bool, optional): Whether to compare the content by hash when
+            the sizes are same but the modification times are different.
+            Default is False.
+        workers (int, optional): The number of the copy threads.
+
+    Returns:
+        dict: The statistics with `added_files`, `added_bytes` of the files
+            not in the destination, `copied_files`, `copied_bytes` of the
+            changed files, `skipped_files`, `skipped_bytes` and
+            `removed_files`.
+    """
+    stats = dict.fromkeys([
+        "added_files", "added_bytes", "copied_files", "copied_bytes",
+        "skipped_files", "skipped_bytes", "removed_files"], 0)
+    futures = []
+    dirs = []
+    with ThreadPoolExecutor(max_workers=get_copy_workers(workers)) as executor:
+        for root, dirnames, filenames in os.walk(src):
+            dst_root = os.path.join(dst, os.path.relpath(root, src))
+            if os.path.islink(dst_root) or os.path.isfile(dst_root):
+                os.remove(dst_root)
+            if not os.path.isdir(dst_root):
+                os.makedirs(dst_root)
+            dirs.append((root, dst_root))
+            # Directory symbolic links are synced as links.
+            links = [name for name in dirnames
+                     if os.path.islink(os.path.join(root, name))]
+            dirnames[:] = [name for name in dirnames if name not in links]
+            names = set(dirnames + filenames + links)
+            for name in os.listdir(dst_root):
+                if name in names:
+                    continue
+                path = os.path.join(dst_root, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    stats["removed_files"] += sum(
+                        len(files) for _, _, files in os.walk(path))
+                    remove_tree(path)
+                else:
+                    stats["removed_files"] += 1
+                    os.remove(path)
+            for name in filenames + links:
+                futures.append(executor.submit(
+                    _sync_file, os.path.join(root, name),
+                    os.path.join(dst_root, name), use_hash))
+        for future in futures:
+            prefix, size = future.result()
+            stats[f"{prefix}_files"] += 1
+            stats[f"{prefix}_bytes"] += size
+    for src_dir, dst_dir in reversed(dirs):
+        shutil.copystat(src_dir, dst_dir)
+    return stats
+
+
+def normalize_member_name(name):
+    """Normalize the member name of the archive to a relative posix path.
+
+    Args:
+        name (str): The member name, like `./pkg/` or `pkg\\file`.
+
+    Returns:
+        str: The normalized name, like `pkg` or `pkg/file`.
+    """
+    parts = [
+        part for part in name.replace("\\", "/").split("/")
+        if part not in ["", "."]]
+    return "/".join(parts)
+
+
+def parse_size(size):
+    """Parse the size string to bytes.
+
+    Accept a plain number or a number with one of the K, M, G, T suffix, like
+    `512M` or `10G`.
+
+    Args:
+        size (str or int): The size to parse.
+
+    Returns:
+        int: The size in bytes.
+
+    Raises:
+        ArgumentError: When the size can not be parsed.
+    """
+    if isinstance(size, int):
+        return size
+    match = re.match(r"^\s*(\d+)\s*([KMGT]?)B?\s*$", str(size).upper())
+    if not match:
+        raise ArgumentError(f"Invalid size: {size}")
+    units = ["", "K", "M", "G", "T"]
+    return int(match.group(1)) * 1024 ** units.index(match.group(2))
+
+
+def reflink_file(src, dst):
+    """Clone the file by copy-on-write and copy the file status.
+
+    Only support Linux file systems implementing FICLONE, like btrfs and xfs.
+
+    Args:
+        src (str): The file to clone from.
+        dst (str): The file to clone to.
+
+    Raises:
+        UnsupportedError: When the system does not support reflink.
+    """
+    if platform.system() != "Linux":
+        raise UnsupportedError(
+            f"Reflink file unsupported on {platform.system()}.")
+    # Import built-in modules
+    import fcntl
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as e:
+            if e.errno in [
+                    errno.EBADF, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP,
+                    errno.EXDEV]:
+                raise UnsupportedError(f"Reflink unsupported: {e}")
+            raise
+    shutil.copystat(src, dst)
+    return dst
+
+
+def reflink_tree(src, dst):
+    """Recreate the directory tree and clone all the files by copy-on-write.
+
+    Use FICLONE on Linux and `cp -c` (clonefile) on macOS.
+
+    Args:
+        src (str): The directory to clone from.
+        dst (str): The directory to clone to.
+
+    Raises:
+        UnsupportedError: When reflink is not supported between src and dst.
+    """
+    if platform.system() == "Darwin":
+        subprocess.run(["cp", "-c", "-R", "-p", src, dst], check=True)
+        return
+    _probe(src, dst, reflink_file)
+    shutil.copytree(src, dst, symlinks=True, copy_function=reflink_file)
+
+
 def remove_tree(path):
     """Remove directory.
 
@@ -100,3 +582,548 @@ def remove_tree(path):
         func(path_)
 
     shutil.rmtree(path, onerror=rm_readonly)
+
+
+def snapshot_tree(src, dst, includes=None, link=True, workers=None):
+    """Copy the source files chosen by list_source_files to the destination.
+
+    Build outputs, virtual environments, caches and VCS directories are left
+    out as long as they are ignored, so the snapshot is usually much smaller
+    than the whole source tree.
+
+    Args:
+        src (str): The source root.
+        dst (str): The directory to put the snapshot in. Existing files in it
+            are overwritten.
+        includes (:obj:`list` of :obj:`str`, optional): Gitignore style
+            patterns of the files to include. See list_source_files.
+        link (bool, optional): Whether to hard link the files instead of
+            copying them. Fall back to copy if hard link is not possible. The
+            snapshot shares the content with the source in this case, so it
+            must not be modified in place. Default is True.
+        workers (int, optional): The number of the copy threads. Get from the
+            `REZBUILD_COPY_WORKERS` environment variable if not given.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The relative paths of the files in the
+            snapshot.
+    """
+    files = list_source_files(src, includes)
+    for dir_ in sorted({os.path.dirname(file) for file in files}):
+        os.makedirs(os.path.join(dst, dir_), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=get_copy_workers(workers)) as executor:
+        futures = [
+            executor.submit(
+                _snapshot_file, os.path.join(src, file),
+                os.path.join(dst, file), link)
+            for file in files]
+    for future in futures:
+        future.result()
+    return files
+
+
+def _get_cgroup_cpu_quota():
+    """Get the cpu quota of the cgroup v2 or v1 on Linux.
+
+    Returns:
+        int: The number of cpus the quota allows, rounded up. 0 if no quota.
+    """
+    quota_files = [
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us",
+         "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ]
+    for quota_file, period_file in quota_files:
+        try:
+            with open(quota_file) as file:
+                values = file.read().split()
+            if period_file:
+                with open(period_file) as file:
+                    values.append(file.read().strip())
+            quota, period = values[0], values[1]
+        except (OSError, IndexError):
+            continue
+        if quota == "max" or int(quota) <= 0:
+            return 0
+        return max(1, -(-int(quota) // int(period)))
+    return 0
+
+
+def _get_git_files(root):
+    """List the tracked and the not ignored untracked files by git.
+
+    Args:
+        root (str): The directory inside a git work tree.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The relative paths of the files. None if
+            git is not available or the root is not in a git work tree.
+    """
+    if not shutil.which("git"):
+        return None
+    # The junk files are skipped even if the repository does not ignore them.
+    excludes = [f"--exclude={pattern}" for pattern in SNAPSHOT_IGNORE_PATTERNS]
+    result = subprocess.run(
+        [
+            "git", "ls-files", "-z", "--cached", "--others",
+            "--exclude-standard"] + excludes,
+        cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode:
+        return None
+    files = []
+    for name in result.stdout.split(b"\0"):
+        path = os.fsdecode(name)
+        filepath = os.path.join(root, path)
+        if not path or not os.path.lexists(filepath):
+            # Deleted but not yet committed.
+            continue
+        if os.path.isdir(filepath) and not os.path.islink(filepath):
+            # Submodules are listed as directories.
+            files.extend(
+                f"{path}/{file}" for file in _walk_files(
+                    filepath, lambda path_, is_dir: path_ == ".git"))
+        else:
+            files.append(path)
+    return files
+
+
+def _get_include_prefix(pattern):
+    """Get the leading directories of the include pattern without globs.
+
+    Args:
+        pattern (str): The gitignore style pattern, not negated.
+
+    Returns:
+        str: The relative path separated by `/`, empty string if the first
+            part has globs. None if the pattern may match in any directory.
+    """
+    pattern = pattern.strip().rstrip("/")
+    if "/" not in pattern:
+        return None
+    parts = []
+    for part in pattern.lstrip("/").split("/"):
+        if any(char in part for char in "*?[\\"):
+            break
+        parts.append(part)
+    return "/".join(parts)
+
+
+def _glob_to_regex(pattern):
+    """Translate the gitignore style glob to the regular expression.
+
+    Args:
+        pattern (str): The glob pattern, without the leading `!` and the
+            trailing `/`.
+
+    Returns:
+        str: The regular expression.
+    """
+    result = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            result.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("**", index):
+            result.append(".*")
+            index += 2
+        elif pattern[index] == "*":
+            result.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            result.append("[^/]")
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2:]:
+            end = pattern.index("]", index + 2)
+            chars = pattern[index + 1:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            result.append(f"[{chars}]")
+            index = end + 1
+        else:
+            if pattern[index] == "\\" and index + 1 < len(pattern):
+                index += 1
+            result.append(re.escape(pattern[index]))
+            index += 1
+    return "".join(result)
+
+
+def _is_ignored(path, is_dir, rules):
+    """Check whether the path is ignored by the gitignore rules.
+
+    Args:
+        path (str): The relative path separated by `/`.
+        is_dir (bool): Whether the path is a directory.
+        rules (list): The rules from _parse_ignore_pattern.
+
+    Returns:
+        bool: True if the last matched rule is not negated.
+    """
+    ignored = False
+    for regex, negate, dir_only in rules:
+        if (is_dir or not dir_only) and regex.match(path):
+            ignored = not negate
+    return ignored
+
+
+def _is_included(path, rules):
+    """Check whether the file is matched by the include rules.
+
+    Args:
+        path (str): The relative file path separated by `/`.
+        rules (list): The rules from _parse_ignore_pattern.
+
+    Returns:
+        bool: True if the last rule matching the file or its parent
+            directories is not negated.
+    """
+    parts = path.split("/")
+    parents = ["/".join(parts[:index]) for index in range(1, len(parts))]
+    included = False
+    for regex, negate, dir_only in rules:
+        if (not dir_only and regex.match(path)) or any(
+                regex.match(parent) for parent in parents):
+            included = not negate
+    return included
+
+
+def _is_same_file(src, dst, use_hash):
+    """Check whether the destination file is up to date with the source file.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file.
+        use_hash (bool): Whether to compare the content by hash when the sizes
+            are same but the modification times are different.
+
+    Returns:
+        bool: True if the destination file does not need to update.
+    """
+    try:
+        src_stat, dst_stat = os.lstat(src), os.lstat(dst)
+    except OSError:
+        return False
+    if stat.S_ISLNK(src_stat.st_mode) or stat.S_ISLNK(dst_stat.st_mode):
+        return (
+            stat.S_ISLNK(src_stat.st_mode) and stat.S_ISLNK(dst_stat.st_mode)
+            and os.readlink(src) == os.readlink(dst))
+    if not stat.S_ISREG(dst_stat.st_mode):
+        return False
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    if use_hash and hash_file(src) == hash_file(dst):
+        shutil.copystat(src, dst)
+        return True
+    return False
+
+
+def _list_not_ignored(root):
+    """List the files not ignored by the `.gitignore` files under the root.
+
+    Args:
+        root (str): The directory to walk.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The relative paths of the files.
+    """
+    default_rules = [
+        rule for rule in (
+            _parse_ignore_pattern(pattern, "")
+            for pattern in SNAPSHOT_IGNORE_PATTERNS)
+        if rule]
+    # The rules of a `.gitignore` only apply to its directory and the sub
+    # directories, so the rules are passed down per directory.
+    rules_by_dir = {}
+    files = []
+    for dirpath, dirs, names in os.walk(root):
+        base = os.path.relpath(dirpath, root).replace("\\", "/")
+        base = "" if base == "." else f"{base}/"
+        rules = rules_by_dir.pop(dirpath, default_rules)
+        if ".gitignore" in names:
+            rules = rules + _read_ignore_file(
+                os.path.join(dirpath, ".gitignore"), base)
+        kept_dirs = []
+        for dir_ in sorted(dirs):
+            path = os.path.join(dirpath, dir_)
+            if os.path.islink(path):
+                # Keep the symbolic links to directories as links.
+                if not _is_ignored(f"{base}{dir_}", False, rules):
+                    files.append(f"{base}{dir_}")
+            elif not _is_ignored(f"{base}{dir_}", True, rules):
+                kept_dirs.append(dir_)
+                rules_by_dir[path] = rules
+        dirs[:] = kept_dirs
+        files.extend(
+            f"{base}{name}" for name in names
+            if not _is_ignored(f"{base}{name}", False, rules))
+    return files
+
+
+def _may_include(path, prefixes):
+    """Check whether the directory may hold the included files.
+
+    Args:
+        path (str): The relative directory path separated by `/`.
+        prefixes (list): The prefixes from _get_include_prefix.
+
+    Returns:
+        bool: True if any of the prefixes is in or above the directory, or
+            under it.
+    """
+    for prefix in prefixes:
+        if prefix is None or not prefix or path == prefix or (
+                path.startswith(f"{prefix}/")
+                or prefix.startswith(f"{path}/")):
+            return True
+    return False
+
+
+def _parse_ignore_pattern(pattern, base):
+    """Parse a line of the gitignore file.
+
+    Args:
+        pattern (str): The line of the gitignore file.
+        base (str): The relative path of the directory that the gitignore
+            file in, ends with `/`. Empty string for the root.
+
+    Returns:
+        tuple: The compiled regular expression of the full relative path,
+            whether the pattern is negated and whether it only matches the
+            directories. None for the blank lines and comments.
+    """
+    pattern = pattern.rstrip("\n").rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    anchored = "/" in pattern
+    body = _glob_to_regex(pattern.lstrip("/"))
+    prefix = re.escape(base) if anchored else f"{re.escape(base)}(?:.*/)?"
+    return re.compile(f"^{prefix}{body}$", re.S), negate, dir_only
+
+
+def _probe(src, dst, function):
+    """Check whether the function can create files from src to dst.
+
+    Args:
+        src (str): The source directory.
+        dst (str): The destination path. Its parent directory should exist.
+        function (function): Function to create file, like os.link.
+
+    Raises:
+        UnsupportedError: When failed to create the probe file.
+    """
+    parent = os.path.dirname(os.path.abspath(dst))
+    fd, probe_src = tempfile.mkstemp(dir=src, prefix=".rezbuild_probe")
+    os.close(fd)
+    probe_dst = os.path.join(parent, os.path.basename(probe_src))
+    try:
+        function(probe_src, probe_dst)
+    except OSError as e:
+        raise UnsupportedError(f"{function.__name__} unsupported: {e}")
+    finally:
+        for path in [probe_src, probe_dst]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _read_ignore_file(path, base):
+    """Read the rules from the gitignore file.
+
+    Args:
+        path (str): The path of the gitignore file.
+        base (str): The relative path of the directory that the gitignore
+            file in, ends with `/`.
+
+    Returns:
+        list: The rules from _parse_ignore_pattern.
+    """
+    with open(path, encoding="utf-8", errors="replace") as file:
+        rules = [_parse_ignore_pattern(line, base) for line in file]
+    return [rule for rule in rules if rule]
+
+
+def _schedule_copy_tree(
+        src, dst, executor, futures, created_dirs, follow_symlinks,
+        file_overwrite):
+    """Create the directories and schedule the file copies of the tree.
+
+    If the destination directory does not exist, the whole tree is copied as
+    new and the symbolic links are kept if follow_symlinks is True. Otherwise
+    the tree is merged into the destination, and every file must not exist
+    unless file_overwrite is True.
+
+    Args:
+        src (str): The directory to copy from.
+        dst (str): The directory to copy to.
+        executor (ThreadPoolExecutor): The executor to submit the copies to.
+        futures (list): The list to collect the futures of the copies.
+        created_dirs (list): The list to collect the created directories.
+        follow_symlinks (bool): Whether to copy the symbolic links as symbolic
+            links when creating new directories.
+        file_overwrite (bool): Whether to overwrite the existing files.
+    """
+    merge = os.path.exists(dst)
+    if not merge:
+        os.makedirs(dst)
+        created_dirs.append((src, dst))
+    for entry in sorted(os.scandir(src), key=lambda entry_: entry_.name):
+        src_ = entry.path
+        dst_ = os.path.join(dst, entry.name)
+        if merge:
+            if entry.is_file() or entry.is_symlink():
+                if os.path.exists(dst_) and not file_overwrite:
+                    raise FileAlreadyExistError(
+                        f"File {dst_} already exist. Set the file_overwrite "
+                        f"as True if you want overwrite it.")
+                futures.append(executor.submit(shutil.copy2, src_, dst_))
+                continue
+        elif entry.is_symlink() and follow_symlinks:
+            os.symlink(os.readlink(src_), dst_)
+            shutil.copystat(src_, dst_, follow_symlinks=False)
+            continue
+        elif not entry.is_dir():
+            futures.append(executor.submit(shutil.copy2, src_, dst_))
+            continue
+        _schedule_copy_tree(
+            src_, dst_, executor, futures, created_dirs, follow_symlinks,
+            file_overwrite)
+
+
+def _read_git_refs(root):
+    """Read the current revision and the tags from the `.git` directory.
+
+    Args:
+        root (str): The root of the git work tree.
+
+    Returns:
+        str: The fingerprint of the revision and the tags. Empty string if
+            there is no `.git` directory.
+    """
+    git_dir = os.path.join(root, ".git")
+    if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+        return ""
+    hasher = hashlib.sha256()
+    for name in ["HEAD", "packed-refs"]:
+        path = os.path.join(git_dir, name)
+        if os.path.isfile(path):
+            hasher.update(hash_file(path).encode("utf-8") + b"\x00")
+    with open(os.path.join(git_dir, "HEAD")) as file:
+        ref = file.read().strip()
+    # The branch ref is loose or in the packed-refs hashed above.
+    ref_path = os.path.join(git_dir, ref.replace("ref: ", "", 1))
+    if ref.startswith("ref: ") and os.path.isfile(ref_path):
+        hasher.update(hash_file(ref_path).encode("utf-8") + b"\x00")
+    tags = os.path.join(git_dir, "refs", "tags")
+    if os.path.isdir(tags):
+        hash_tree(tags, hasher)
+    return hasher.hexdigest()
+
+
+def _remove_path(path):
+    """Remove the file, the symbolic link or the directory tree.
+
+    The symbolic links to directories are unlinked without touching the
+    directories they point to.
+
+    Args:
+        path (str): The path to remove.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        if platform.system() == "Windows" and os.path.isdir(path):
+            # The directory links can only be removed by rmdir on Windows.
+            os.rmdir(path)
+        else:
+            os.remove(path)
+    else:
+        remove_tree(path)
+
+
+def _snapshot_file(src, dst, link):
+    """Hard link or copy the file into the snapshot.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file.
+        link (bool): Whether to try hard link first.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def _sync_file(src, dst, use_hash):
+    """Update the destination file if it is different from the source file.
+
+    The file is copied to a temporary file beside the destination and then
+    renamed, so the destination is never seen partly written.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file.
+        use_hash (bool): Whether to compare the content by hash.
+
+    Returns:
+        tuple: `added`, `copied` or `skipped`, and the size of the file.
+    """
+    size = os.lstat(src).st_size
+    if not os.path.lexists(dst):
+        state = "added"
+    elif _is_same_file(src, dst, use_hash):
+        return "skipped", size
+    else:
+        state = "copied"
+    temp = f"{dst}.rezbuild-tmp"
+    if os.path.lexists(temp):
+        os.remove(temp)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), temp)
+    else:
+        shutil.copy2(src, temp)
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        remove_tree(dst)
+    os.replace(temp, dst)
+    return state, size
+
+
+def _walk_files(root, skip):
+    """Walk the tree and list the files not skipped.
+
+    Args:
+        root (str): The directory to walk.
+        skip (callable): Called with the relative path separated by `/` and
+            whether it is a directory, return True to skip it.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The relative paths of the files.
+    """
+    files = []
+    for dirpath, dirs, names in os.walk(root):
+        base = os.path.relpath(dirpath, root).replace("\\", "/")
+        base = "" if base == "." else f"{base}/"
+        dirs[:] = [dir_ for dir_ in dirs if not skip(f"{base}{dir_}", True)]
+        for dir_ in list(dirs):
+            if os.path.islink(os.path.join(dirpath, dir_)):
+                dirs.remove(dir_)
+                if not skip(f"{base}{dir_}", False):
+                    files.append(f"{base}{dir_}")
+        files.extend(
+            f"{base}{name}" for name in names
+            if not skip(f"{base}{name}", False))
+    return files
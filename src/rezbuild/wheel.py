@@ -0,0 +1,370 @@
+"""Install wheel files without pip.
+
+Only support the cases rezbuild needs: install a single wheel into a target
+directory without dependency resolution, like `pip install --no-deps --target`.
+The layout of the target directory is the same as pip:
+
+target/
+├── bin/
+│   └── console scripts and scripts in the `.data/scripts`
+├── include/
+│   └── headers in the `.data/headers`
+├── package/
+└── package-1.0.0.dist-info/
+
+Raise UnsupportedError for the wheels can't be handled, so the caller can fall
+back to pip.
+
+Reference:
+    https://packaging.python.org/specifications/binary-distribution-format
+"""
+
+# Import built-in modules
+import base64
+import configparser
+import csv
+import hashlib
+import io
+import os
+import platform
+import re
+import stat
+import zipfile
+
+# Import local modules
+from rezbuild.exceptions import ChecksumError
+from rezbuild.exceptions import UnsupportedError
+
+# Size of the chunks to copy the wheel members.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Template of the console script, same as the one pip generates.
+SCRIPT_TEMPLATE = """{shebang}
+# -*- coding: utf-8 -*-
+import re
+import sys
+from {module} import {import_name}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({function}())
+"""
+
+# The `.data` sub directories and where they install to.
+DATA_SCHEMES = {
+    "purelib": "",
+    "platlib": "",
+    "scripts": "bin",
+    "headers": "include",
+    "data": "",
+}
+
+
+class WheelInstaller(object):
+    """Install a wheel file into a target directory."""
+
+    def __init__(self, wheel_file, target, shebang):
+        """Initialize the installer.
+
+        Args:
+            wheel_file (str): The path of the wheel file.
+            target (str): The directory to install to.
+            shebang (str): The shebang of the scripts, like
+                `#!/usr/bin/env python`.
+        """
+        self.wheel_file = wheel_file
+        self.target = target
+        self.shebang = shebang if shebang.startswith("#!") else f"#!{shebang}"
+        self.records = []
+        self.scripts = []
+
+    def get_shebang(self, gui=False):
+        """Get the shebang of the console or gui scripts.
+
+        The gui scripts run by `pythonw` if it is beside the interpreter of
+        the shebang, or on Windows if the interpreter is searched in `PATH`.
+
+        Args:
+            gui (bool, optional): Whether to get the shebang of the gui
+                scripts.
+
+        Returns:
+            str: The shebang.
+        """
+        root, ext = os.path.splitext(self.shebang)
+        if not gui or not root.lower().endswith("python") or (
+                ext.lower() not in ["", ".exe"]):
+            return self.shebang
+        shebang = f"{root}w{ext}"
+        interpreter = shebang[2:].strip()
+        if os.path.isfile(interpreter) or (
+                os.name == "nt" and not os.path.isabs(interpreter)):
+            return shebang
+        return self.shebang
+
+    def get_dist_info(self, zip_file):
+        """Get the dist-info directory name of the wheel.
+
+        Args:
+            zip_file (zipfile.ZipFile): The opened wheel file.
+
+        Returns:
+            str: The dist-info directory name.
+
+        Raises:
+            UnsupportedError: When the wheel is invalid or unsupported.
+        """
+        dist_infos = {
+            name.split("/")[0] for name in zip_file.namelist()
+            if name.split("/")[0].endswith(".dist-info")}
+        if len(dist_infos) != 1:
+            raise UnsupportedError(
+                f"Expect one dist-info directory in {self.wheel_file}.")
+        dist_info = dist_infos.pop()
+        metadata = self.read_metadata(zip_file, f"{dist_info}/WHEEL")
+        version = metadata.get("Wheel-Version", "1.0")
+        if version.split(".")[0] != "1":
+            raise UnsupportedError(f"Unsupported wheel version {version}.")
+        return dist_info
+
+    def get_target_path(self, name, data_dir):
+        """Get the path that the wheel member installs to.
+
+        Args:
+            name (str): The member name in the wheel.
+            data_dir (str): The `.data` directory name of the wheel.
+
+        Returns:
+            str: The relative path to the target directory.
+
+        Raises:
+            UnsupportedError: When the member is in an unknown scheme or out
+                of the target.
+        """
+        parts = name.split("/")
+        if parts[0] == data_dir:
+            if len(parts) < 3 or parts[1] not in DATA_SCHEMES:
+                raise UnsupportedError(f"Unsupported wheel data {name}.")
+            parts = [DATA_SCHEMES[parts[1]]] + parts[2:]
+        parts = [part for part in parts if part]
+        path = os.path.normpath(os.path.join(*parts))
+        if os.path.isabs(path) or path.split(os.sep)[0] == "..":
+            raise UnsupportedError(f"Wheel member out of target: {name}.")
+        return path
+
+    def install(self):
+        """Install the wheel.
+
+        Returns:
+            :obj:`list` of :obj:`str`: The paths of the scripts that created
+                with the shebang.
+
+        Raises:
+            ChecksumError: When the file content does not match the RECORD, or
+                the RECORD uses an unknown hash algorithm.
+            UnsupportedError: When the wheel is unsupported.
+        """
+        if platform.system() == "Windows":
+            raise UnsupportedError("Script launchers unsupported on Windows.")
+        with zipfile.ZipFile(self.wheel_file) as zip_file:
+            dist_info = self.get_dist_info(zip_file)
+            data_dir = dist_info.replace(".dist-info", ".data")
+            record_name = f"{dist_info}/RECORD"
+            hashes = self.read_record(zip_file, record_name)
+            # Resolve all the paths first so nothing is written if unsupported.
+            members = [
+                (info, self.get_target_path(info.filename, data_dir))
+                for info in zip_file.infolist()
+                if not info.filename.endswith("/")
+                and info.filename != record_name]
+            for info, path in members:
+                is_script = info.filename.startswith(f"{data_dir}/scripts/")
+                self.install_member(
+                    zip_file, info, path, hashes.get(info.filename, ""),
+                    is_script)
+            entry_points = f"{dist_info}/entry_points.txt"
+            if entry_points in zip_file.namelist():
+                self.install_entry_points(
+                    zip_file.read(entry_points).decode("utf-8"))
+        self.write_file(f"{dist_info}/INSTALLER", b"rezbuild\n")
+        self.write_record(f"{dist_info}/RECORD")
+        return self.scripts
+
+    def install_entry_points(self, content):
+        """Create the console and gui scripts from the entry points.
+
+        Args:
+            content (str): The content of the `entry_points.txt`.
+        """
+        parser = configparser.ConfigParser(delimiters="=")
+        parser.optionxform = str
+        parser.read_string(content)
+        for section in ["console_scripts", "gui_scripts"]:
+            if not parser.has_section(section):
+                continue
+            for name, value in parser.items(section):
+                module, _, function = value.split("[")[0].strip().partition(
+                    ":")
+                if not function:
+                    raise UnsupportedError(f"Unsupported entry point {value}.")
+                script = SCRIPT_TEMPLATE.format(
+                    shebang=self.get_shebang(section == "gui_scripts"),
+                    module=module.strip(),
+                    import_name=function.strip().split(".")[0],
+                    function=function.strip())
+                path = os.path.join("bin", name)
+                self.write_file(path, script.encode("utf-8"), executable=True)
+                self.scripts.append(os.path.join(self.target, path))
+
+    def install_member(self, zip_file, info, path, expected_hash, is_script):
+        """Extract the member and verify its hash.
+
+        The `#!python` and `#!pythonw` shebang lines of the scripts are
+        rewritten while extracting.
+
+        Args:
+            zip_file (zipfile.ZipFile): The opened wheel file.
+            info (zipfile.ZipInfo): The member to extract.
+            path (str): The relative path to the target directory.
+            expected_hash (str): The hash in RECORD, like `sha256=xxx`.
+            is_script (bool): Whether the member is in `.data/scripts`.
+
+        Raises:
+            ChecksumError: When the content does not match the hash, or the
+                hash algorithm is unknown.
+        """
+        algorithm, _, digest = expected_hash.partition("=")
+        verifier = None
+        if digest:
+            try:
+                verifier = hashlib.new(algorithm)
+            except ValueError:
+                raise ChecksumError(
+                    f"Unknown hash algorithm {algorithm} of {info.filename} "
+                    f"in the RECORD of {self.wheel_file}.")
+        dst = os.path.join(self.target, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+        with zip_file.open(info) as src, open(dst, "wb") as file:
+            first = True
+            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                if verifier:
+                    verifier.update(chunk)
+                match = first and is_script and re.match(
+                    rb"#!python(w?)(?=\s|$)", chunk)
+                if match:
+                    shebang = self.get_shebang(gui=bool(match.group(1)))
+                    line_end = chunk.find(b"\n")
+                    line_end = len(chunk) if line_end < 0 else line_end
+                    chunk = shebang.encode("utf-8") + chunk[line_end:]
+                    self.scripts.append(dst)
+                first = False
+                hasher.update(chunk)
+                size += len(chunk)
+                file.write(chunk)
+        if verifier and _encode_digest(verifier.digest()) != digest:
+            raise ChecksumError(
+                f"Hash of {info.filename} does not match the RECORD in "
+                f"{self.wheel_file}.")
+        mode = info.external_attr >> 16
+        if is_script or mode & stat.S_IXUSR:
+            os.chmod(dst, 0o755)
+        self.records.append(
+            (path, f"sha256={_encode_digest(hasher.digest())}", str(size)))
+
+    @staticmethod
+    def read_metadata(zip_file, name):
+        """Read the email header style metadata file, like WHEEL.
+
+        Args:
+            zip_file (zipfile.ZipFile): The opened wheel file.
+            name (str): The member name of the metadata file.
+
+        Returns:
+            dict: The metadata.
+        """
+        metadata = {}
+        for line in zip_file.read(name).decode("utf-8").splitlines():
+            key, _, value = line.partition(":")
+            if value:
+                metadata[key.strip()] = value.strip()
+        return metadata
+
+    @staticmethod
+    def read_record(zip_file, name):
+        """Read the hashes from the RECORD.
+
+        Args:
+            zip_file (zipfile.ZipFile): The opened wheel file.
+            name (str): The member name of the RECORD.
+
+        Returns:
+            dict: The member names and the hashes like `sha256=xxx`.
+        """
+        if name not in zip_file.namelist():
+            return {}
+        content = zip_file.read(name).decode("utf-8")
+        return {
+            row[0]: row[1] for row in csv.reader(io.StringIO(content))
+            if len(row) >= 2 and row[1]}
+
+    def write_file(self, path, content, executable=False):
+        """Write the file into the target and record it.
+
+        Args:
+            path (str): The relative path to the target directory.
+            content (bytes): The file content.
+            executable (bool): Whether to make the file executable.
+        """
+        dst = os.path.join(self.target, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, "wb") as file:
+            file.write(content)
+        if executable:
+            os.chmod(dst, 0o755)
+        digest = _encode_digest(hashlib.sha256(content).digest())
+        self.records.append((path, f"sha256={digest}", str(len(content))))
+
+    def write_record(self, path):
+        """Write the RECORD file of the installed files.
+
+        Args:
+            path (str): The relative path of the RECORD to the target.
+        """
+        with open(os.path.join(self.target, path), "w", newline="") as file:
+            writer = csv.writer(file)
+            for record in self.records:
+                writer.writerow([record[0].replace(os.sep, "/")] + list(
+                    record[1:]))
+            writer.writerow([path.replace(os.sep, "/"), "", ""])
+
+
+def install_wheel(wheel_file, target, shebang):
+    """Install the wheel file into the target directory.
+
+    Args:
+        wheel_file (str): The path of the wheel file.
+        target (str): The directory to install to.
+        shebang (str): The shebang of the scripts.
+
+    Returns:
+        :obj:`list` of :obj:`str`: The paths of the scripts that created with
+            the shebang.
+
+    Raises:
+        ChecksumError: When the file content does not match the RECORD.
+        UnsupportedError: When the wheel is unsupported.
+    """
+    return WheelInstaller(wheel_file, target, shebang).install()
+
+
+def _encode_digest(digest):
+    """Encode the digest as the urlsafe base64 without padding.
+
+    Args:
+        digest (bytes): The digest to encode.
+
+    Returns:
+        str: The encoded digest.
+    """
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")